@@ -1,179 +1,282 @@
 # -*- coding: utf-8 -*-
+from time import perf_counter
+_launched = perf_counter() # start of the startup timing report
 import sys
 import tkinter.font as tkFont
 
 import tkinter as tk
 from tkinter import ttk, messagebox
-from tkinter.filedialog import askopenfilename, asksaveasfilename, askopenfilenames
 
 import os
 import math
 import subprocess
 import platform # cpuinfo
-from PIL import Image, ImageTk
 from os.path import join as pjoin
 import datetime
-import configparser
-import shutil # for zipping
 import logging
-import psutil # for security
+import threading
+from lazyimport import lazy_import
+psutil = lazy_import("psutil") # for security
 
 # source files
 from tkhelper import ImageLabel, ToolTip, createToolTip, CopyrightLabel
-from tracers import Traces
+from profiler import PhaseTimer
+from prompts import TkPrompts, PromptBroker
+import statestore
+import sitlog
 import uiconfig
+# only needed once a collection starts
+tracers = lazy_import("tracers")
+scheduler = lazy_import("scheduler")
+archiver = lazy_import("archiver")
+dedup = lazy_import("dedup")
+incremental = lazy_import("incremental")
+acpitables = lazy_import("acpitables")
+ringcapture = lazy_import("ringcapture")
+dumpstream = lazy_import("dumpstream")
+telemetry = lazy_import("telemetry")
+checksums = lazy_import("checksums")
+journal = lazy_import("journal")
+permissions = lazy_import("permissions")
+progress = lazy_import("progress")
+_imported = perf_counter()
 
 # set the resource directory to: ./resource, relative to this file
 resrc_path = pjoin(os.path.abspath(os.path.dirname(__file__)), "resource")
 _codec = "utf8"
+PROGRESS_MS = 250 # refresh period of the progress panel
 
 def get_date_time():
     now = datetime.datetime.now()
     return now.strftime("%Y-%m-%d-%H-%M")
     
-def zipfolder(folder):
+def zipfolder(folder, archive=None, known=None):
+    r"""Zips the output directory into "<folder>.zip".
+    Args:
+        folder (str): the output directory.
+        archive (ArchiveWriter): archive that already holds part of the folder, if any.
+        known (dict): checksums of the files computed when they were collected, e.g. Collector.digests.
+    Returns:
+        list (str): the zip file, or its volumes.
+    """
     logging.info(f"Zipping directory \"{folder}\"...")
-    shutil.make_archive(folder, "zip", folder)
+    if archive is None:
+        archive = archiver.open_archive(folder, load_config())
+    if known is not None:
+        archive.known = known
+    archive.exclude.add(journal.NAME) # left by a run that did not finish
+    archive.add_tree(folder)
+    return archive.close()
     
-def execute(customer, queue, time=None, reset=False):
+def run_ingredient(tracer, x, logdir):
+    r"""Runs a single ingredient with the given tracer.
+    Args:
+        tracer (Traces): tracer instance writing into logdir.
+        x (dict): the ingredient, as in uiconfig.INGREDIENTS.
+        logdir (str): output directory, recorded for boot traces.
+    """
+    entry = uiconfig.REGISTRY[x["id"]]
+    if not entry["start"]:
+        logging.error(f"\"{entry['name']}\" is not supported in current tool. Skipped.")
+        return
+    # boot traces are recorded, so they are stopped when the tool is launched after the reboot.
+    # written before the trace starts, and before the journal records the ingredient as done:
+    # an autologger left enabled without its record is never stopped.
+    if entry["reboot"]:
+        store = statestore.get_store()
+        store.start_boot_trace(entry["name"], entry["id"], logdir)
+        store.commit()
+    for method, kwargs in entry["start"]:
+        getattr(tracer, method)(**kwargs)
+
+def report_results(results, prompts):
+    """Logs per-ingredient timing, and shows the failed ingredients to the user."""
+    for r in results:
+        logging.info(f"Ingredient result: {r}")
+    failed = [r for r in results if not r.ok]
+    if failed:
+        details = "\n".join(f"{r.name}: {r.error}" for r in failed)
+        prompts.error(title='Unhandled Exception',
+            message=f"The following ingredient(s) failed. See sit.log for more detail.\n\n{details}")
+
+def execute(customer, queue, time=None, reset=False, on_done=None, idle=None, cancel=None, prompts=None, resume=None,
+        tracker=None):
     r"""This is the main function for executing ingredients selected by the user.
     Args:
         customer (str): customer name, used for naming the output directory. 
         queue (list (dict)): list of ingredients pending execution.
         time (str): datetime string, used for naming the output directory. 
+        on_done (callable): called with an IngredientResult after each ingredient.
+        idle (callable): called periodically while waiting on commands, e.g. Tk.update.
+        cancel (threading.Event): kills the running commands when set.
+        prompts (TkPrompts or ScriptedPrompts): asks the user, Tk dialogs by default.
+        resume (Journal): continue this interrupted run, `queue` being its remaining ingredients.
+        tracker (ProgressTracker): receives the progress of the run and the output of its commands,
+            e.g. for the progress panel.
+    Returns:
+        dict: the output directory, zip file(s), reboot flag and the IngredientResult list.
     """
+    prompts = prompts if prompts is not None else TkPrompts()
 
     # determine trace directory, and initialize tracer
     time = time if time is not None else get_date_time()
     logdir = pjoin(os.getcwd(), "-".join([customer,"SoftwareIssueTracer",time])) if not reset else None
-    tracer = Traces(logdir=logdir, resrc_path=resrc_path, codec=_codec)
+    tracer = tracers.Traces(logdir=logdir, resrc_path=resrc_path, codec=_codec, prompts=prompts)
+    if logdir is not None:
+        # the bundle carries the log of this run only.
+        sitlog.begin_session(logdir, _codec)
+    tracer.runner.idle = idle
+    if tracker is not None:
+        # command output, for the console of the progress panel.
+        tracer.runner.console = tracker.add_line
+    if cancel is not None:
+        tracer.runner.cancel_event = cancel
 
     # reset registry keys
     if reset: 
         tracer.regclr()
-        return 
-
-    # execute all ingredients
-    for x in queue:
-        LogType = x["id"]
-        try:
-            if LogType == 1:
-                tracer.usb()
-            if LogType == 2:
-                tracer.highloadingactivities()
-            if LogType == 3:
-                tracer.idle()
-            if LogType == 4:
-                tracer.acpi()
-            if LogType == 5:
-                tracer.unexpected_reset()
-            if LogType == 6:
-                tracer.marker()
-                tracer.display()
-            if LogType == 7:
-                tracer.slp_s0_status()
-            if LogType == 8:
-                tracer.tbt()
-            if LogType == 9:
-                tracer.acpi2()
-            if LogType == 10:                
-                tracer.livedumpfile()
-            if LogType == 12:
-                tracer.rst()
-            if LogType == 13:
-                tracer.video_performance()
-            if LogType == 14:
-                update_config("Realtime BSOD", enable=True, logdir=logdir)
-                tracer.realtimebsod()
-            if LogType == 15:
-                update_config("TBT (boot)", enable=True, logdir=logdir)
-                tracer.tbt_boot()
-            if LogType == 16:
-                tracer.optane()
-            if LogType == 17:
-                update_config("ISST", enable=True, logdir=logdir)
-                tracer.isst()
-            if LogType == 18:
-                update_config("I2C", enable=True, logdir=logdir)
-                tracer.i2c(acpi=False)
-            if LogType == 19:                
-                tracer.sysinfo()
-            if LogType == 20:
-                update_config("I2C ACPI", enable=True, logdir=logdir)
-                tracer.i2c(acpi=True)
-            if LogType == 21:
-                update_config("Boot Trace", enable=True, logdir=logdir)
-                tracer.graphic_boot()
-            if LogType == 22:
-                update_config("Wiman Driver Log", enable=True, logdir=logdir)
-                tracer.wiman()
-            if LogType == 23:
-                tracer.installer()
-            if LogType == 24:
-                tracer.lms()
-            if LogType == 25:
-                tracer.icls()
-            if LogType == 26:
-                update_config("DAL Driver Log", enable=True, logdir=logdir)
-                tracer.dal()
-            if LogType == 27:
-                update_config("MEI Driver Yellow Bang", enable=True, logdir=logdir)
-                tracer.csme_yellowbang(mode="Tee")
-            if LogType == 28:
-                update_config("SPD Driver Yellow Bang", enable=True, logdir=logdir)
-                tracer.csme_yellowbang(mode="SPD")
-            if LogType == 29:
-                update_config("GSC Driver Yellow Bang", enable=True, logdir=logdir)
-                tracer.csme_yellowbang(mode="gsc")
-            if LogType == 30:
-                update_config("AUX Driver Yellow Bang", enable=True, logdir=logdir)
-                tracer.csme_yellowbang(mode="_aux")
-            if LogType == 31:
-                tracer.csme_bsod(mode="Tee")
-            if LogType == 32:
-                tracer.csme_bsod(mode="SPD")
-            if LogType == 33:
-                tracer.csme_bsod(mode="gsc")
-            if LogType == 34:
-                tracer.csme_bsod(mode="_aux")
-            if LogType == 35:
-                tracer.storage()
-        except Exception as e:
-            logging.exception("Unhandled exception occurred")
-            messagebox.showerror(title='Unhandled Exception',message=f"See sit.log for more detail. Error: {e}")
-            
+        return {"logdir": None, "archive": [], "reboot": False, "results": []}
+
+    config = load_config()
+    # the ingredients are journaled, so a crashed or hung run can be resumed on the next launch.
+    run_journal = resume if resume is not None else journal.open_journal(logdir, config)
+    if resume is None and run_journal is not None:
+        run_journal.begin(customer, time, [x["id"] for x in queue])
+    tracer.collector.journal = run_journal
+    # everything created in the output directory inherits its permission, files moved in are fixed by tracer.chmod.
+    tracer.permissions = tracer.collector.permissions = permissions.open_fixer(logdir, config)
+    # a resumed run is zipped, or not, as the run it continues.
+    planned = queue if resume is None else [uiconfig.REGISTRY[i] for i in resume.queue if i in uiconfig.REGISTRY]
+    LogType = planned[-1]["id"] if planned else None
+
+    # reuse unchanged files from earlier runs instead of copying them again.
+    store = dedup.open_store(config)
+    tracer.collector.store = store
+    if store is not None and tracer.permissions is not None:
+        # the outputs linked to the stored copies share their permission, they are not fixed one by one.
+        tracer.permissions.backend.prepare(store.root)
+    tracer.acpi_cache = acpitables.open_cache(config)
+    tracer.ring_options = ringcapture.ring_options(config)
+    tracer.dump_options = dumpstream.dump_options(config)
+    # hash the collected files while copying them, for the checksums of the bundle.
+    tracer.collector.algorithm = checksums.algorithm(config)
+    if config['General'].getboolean('IncrementalEventLogs', fallback=False):
+        tracer.eventlogs = incremental.EventLogTracker()
+    zipping = (config['General']['ZipOutput'].lower() == "true"
+        and not any([x["reboot"] for x in planned]) and LogType != 29 and LogType != 30)
+
+    # start compressing the outputs of finished ingredients while the rest are running.
+    archive = archiver.open_archive(logdir, config) if zipping else None
+    if archive is not None:
+        archive.known = tracer.collector.digests
+    def run_one(x):
+        if run_journal is not None:
+            run_journal.start(x["id"])
+        run_ingredient(tracer, x, logdir)
+    def ingredient_done(result):
+        if run_journal is not None:
+            run_journal.finish_ingredient(result.id, result.ok)
+        if tracker is not None:
+            tracker.done(result.id, result.ok)
+        if archive is not None and result.ok:
+            for name in uiconfig.OUTPUTS.get(result.id, []):
+                if os.path.exists(pjoin(logdir, name)):
+                    archive.add(pjoin(logdir, name), name)
+        if on_done is not None:
+            on_done(result)
+
+    # execute all ingredients, independent ones in parallel.
+    run = telemetry.new_run("collect" if resume is None else "resume", customer)
+    workers = config['General'].getint('Workers', fallback=4)
+    if tracker is not None:
+        # the ETA comes from the earlier runs of the same ingredients.
+        ids = [x["id"] for x in queue]
+        tracker.begin({i: uiconfig.REGISTRY[i]["name"] for i in ids},
+            telemetry.estimate(ids, telemetry.open_history(config)), workers)
+        progress.activate(tracker)
+    pool = scheduler.IngredientScheduler(
+        workers=workers,
+        locks=uiconfig.LOCKS,
+        interactive=uiconfig.INTERACTIVE,
+        names={i: d["name"] for i, d in uiconfig.REGISTRY.items()},
+        costs=uiconfig.COSTS,
+        on_done=ingredient_done,
+        on_start=tracker.start if tracker is not None else None)
+    try:
+        results = pool.run(queue, run_one, idle=idle)
+    finally:
+        # each boot trace is written when it starts (see run_ingredient), anything still staged now.
+        statestore.get_store().commit()
+    if tracker is not None:
+        tracker.set_phase("post-processing")
+    report_results(results, prompts)
+    if store is not None:
+        store.evict()
+        store.save()
+    if tracer.acpi_cache is not None:
+        tracer.acpi_cache.evict()
+
+    # timings, processes and bytes of every ingredient, into manifest.json and the run history.
+    telemetry.save_run(logdir, telemetry.finish_run(run, results, logdir), telemetry.open_history(config))
         
     logging.info("All traces has returned. Post-processing output directory...")
    
     # change the access of output dir to allow all. 
     tracer.chmod(logdir)
     tracer.cleanup()
+    sitlog.end_session()
+
+    summary = {"logdir": logdir, "archive": [], "reboot": any([x["reboot"] for x in planned]), "results": results}
 
     # If any boot trace are run, warn the user about reopening this tool after reboot.
-    if any([x["reboot"] for x in queue]):
-        messagebox.showwarning(title='Warning',message="You have enabled trace that requires a restart. Restart system and then reproduce your issue(s) if required. After issue is reproduced , launch this tool again and stop the trace.")
+    if summary["reboot"]:
+        prompts.warning(title='Warning',message="You have enabled trace that requires a restart. Restart system and then reproduce your issue(s) if required. After issue is reproduced , launch this tool again and stop the trace.")
         logging.info("All tasks completed. Boot traces are run, so not opening explorer.")
     elif LogType != 29 and LogType != 30:
     # if not, then zip the output dir & open the folder if necessary.
-        config = load_config()
-        if config['General']['ZipOutput'].lower() == "true":
-            zipfolder(logdir)
+        if archive is not None:
+            if tracker is not None:
+                tracker.set_phase("zipping")
+            summary["archive"] = zipfolder(logdir, archive)
+        elif tracer.collector.algorithm is not None:
+            checksums.write_folder(logdir, tracer.collector.digests, tracer.collector.algorithm, exclude=[journal.NAME])
+        if tracker is not None:
+            tracker.finish()
         logging.info("Task completed. Asking user if open folder...")
-        promptdir = messagebox.askyesno(title='Info',
-            message="All tasks completed. Please attach the resulting zip file to IPS issue attachment. Do you want to open the folder now?")
+        promptdir = prompts.yesno(title='Info',
+            message="All tasks completed. Please attach the resulting zip file to IPS issue attachment. Do you want to open the folder now?",
+            key="open_folder")
         if promptdir:
             logging.info("Opening directory with explorer.exe ...")
             os.system("explorer /select, \"{}\"".format(logdir))
         else:
             logging.info("User denied. Done.")
 
+    # the event log watermarks only move on once the bundle holding their ranges is complete.
+    if (tracer.eventlogs is not None and all(r.ok for r in results)
+            and (cancel is None or not cancel.is_set())):
+        tracer.eventlogs.commit()
+
+    if tracker is not None:
+        tracker.finish()
+        progress.activate(None)
+    # nothing left to resume once every ingredient succeeded and the outputs are zipped.
+    if run_journal is not None:
+        if all(r.ok for r in results):
+            run_journal.finish()
+        else:
+            run_journal.close()
+    return summary
+
 def format_color(r,g,b):
     return "#{:02x}{:02x}{:02x}".format(r,g,b)
 
 class SITInterface(tk.Tk):
-    def __init__(self):
+    def __init__(self, profiler=None):
         logging.info('Initializing UI components ...')
-        tk.Tk.__init__(self)
+        self.profiler = profiler if profiler is not None else PhaseTimer("UI")
+        with self.profiler.phase("tk"):
+            tk.Tk.__init__(self)
         
         self.timestamp = get_date_time()
 
@@ -201,36 +304,49 @@ class SITInterface(tk.Tk):
 
         # banner
         logging.info('Loading banner...')
-        self.banner = ImageLabel(self, self.paths["banner"], background=format_color(0,159,223))
-        self.banner.resize((1200,100))
-        self.banner.grid(row=0, column=0, columnspan=4, sticky="nswe")
+        with self.profiler.phase("banner"):
+            self.banner = ImageLabel(self, self.paths["banner"], background=format_color(0,159,223), size=(1200,100))
+            self.banner.grid(row=0, column=0, columnspan=4, sticky="nswe")
 
         # config
-        self.style_names = self.config_font()
+        with self.profiler.phase("fonts"):
+            self.style_names = self.config_font()
 
         # init shared values
         self.issue_selection = None
         self.checklist = []
+        self.trace_boxes = {} # ingredient checkbuttons, created when first shown
+        self.cancel = None # set while a collection is running
+        self.worker = None # thread running the collection
+        self.tracker = None # progress of the running collection, see refresh_progress
+        self.start_buttons = [] # disabled while a collection is running, see run_worker
+        # prompts of the collection are shown from the Tk loop, see run_queue.
+        self.prompts = PromptBroker(self)
+        self.prompts.start()
+        self.protocol("WM_DELETE_WINDOW", self.on_close)
 
         # create panels
-        self.oemframe = self.customer_panel()
-        self.qckframe = self.optional_panel()
-        self.isuframe = self.issue_panel()
-        self.igrframe = self.ingrdient_panel()
-        self.cltframe = self.collect_panel()
+        with self.profiler.phase("panels"):
+            self.oemframe = self.customer_panel()
+            self.qckframe = self.optional_panel()
+            self.isuframe = self.issue_panel()
+            self.igrframe = self.ingrdient_panel()
+            self.cltframe = self.collect_panel()
+            self.prgframe = self.progress_panel()
 
         self.oemframe.grid(padx=5, pady=5, row=1, column=0, rowspan=1, sticky="nswe")
         self.qckframe.grid(padx=5, pady=5, row=2, column=0, rowspan=1, sticky="nswe")
         self.isuframe.grid(padx=5, pady=5, row=1, column=1, rowspan=2, sticky="nswe")
         self.igrframe.grid(padx=5, pady=5, row=1, column=2, rowspan=2, sticky="nswe")
         self.cltframe.grid(padx=5, pady=5, row=1, column=3, rowspan=2, sticky="nswe")
+        self.prgframe.grid(padx=5, pady=5, row=3, column=0, columnspan=4, sticky="nswe")
         
         # bind greyout functions
         self.greyout_bindings()
 
         # copyright label
-        # self.create_copyright_text(rows=4, columns=4)
-        CopyrightLabel(self, rows=4, columns=4)
+        # self.create_copyright_text(rows=5, columns=4)
+        CopyrightLabel(self, rows=5, columns=4)
 
         # allow for resize in these dimensions
         for r in range(1, 3):
@@ -332,12 +448,74 @@ class SITInterface(tk.Tk):
 
         queue = [d for d in uiconfig.INGREDIENTS.values() if d["type"] in ("log", "config")]
 
-        execute(strOEM, queue, time=self.timestamp)
+        self.run_queue(strOEM, queue)
+
+    def run_queue(self, strOEM, queue, reset=False):
+        """Runs execute on the worker thread, see run_worker."""
+        self.run_worker(lambda cancel: execute(strOEM, queue, time=self.timestamp, reset=reset, cancel=cancel,
+            prompts=self.prompts, tracker=self.tracker))
+
+    def run_startup(self, boottraces):
+        """Stops the active boot traces, then resumes the unfinished runs, on the worker thread."""
+        if not boottraces and not journal.find_unfinished(os.getcwd()):
+            return
+        def startup(cancel):
+            if boottraces:
+                handle_boot_traces(boottraces, prompts=self.prompts, cancel=cancel, console=self.tracker.add_line)
+                logging.info('Successfully handled boot traces')
+            resume_unfinished(prompts=self.prompts, cancel=cancel, tracker=self.tracker)
+        self.run_worker(startup)
+
+    def run_worker(self, task):
+        r"""Runs task(cancel) on a worker thread, so the window stays responsive while
+        it runs. Its prompts are shown by the Tk loop through self.prompts. The
+        buttons starting a collection are disabled until it returns.
+        """
+        if self.cancel is not None:
+            logging.warning("A collection is already running. Ignored.")
+            return
+        self.cancel = threading.Event()
+        if self.tracker is None:
+            self.tracker = progress.ProgressTracker()
+        self.tracker.reset()
+        for button in self.start_buttons:
+            button.state(['disabled'])
+        def collect():
+            try:
+                task(self.cancel)
+            except Exception:
+                logging.exception("Exception occurred while collecting")
+                self.prompts.error(title='Unhandled Exception',
+                    message="The collection stopped unexpectedly. See sit.log for more detail.")
+            finally:
+                self.prompts.post(self.collection_done)
+        self.worker = threading.Thread(target=collect, name="collection", daemon=True)
+        self.worker.start()
+        self.refresh_progress()
+
+    def collection_done(self):
+        """Called on the Tk thread when the worker of run_queue returned."""
+        logging.info("Collection finished.")
+        self.cancel = None
+        self.worker = None
+        for button in self.start_buttons:
+            button.state(['!disabled'])
+        self.refresh_progress()
+
+    def on_close(self):
+        if self.cancel is not None:
+            if not messagebox.askyesno(title="Quit",
+                    message="A collection is running. Stop it and quit?"):
+                return
+            logging.info("Window closed, stopping the running collection...")
+            self.cancel.set()
+        self.prompts.close()
+        self.destroy()
 
     def reg_clear(self):
         strOEM = self.get_customer_name()        
 
-        execute(strOEM, [], time=self.timestamp, reset=True)
+        self.run_queue(strOEM, [], reset=True)
 
     def optional_panel(self):
         logging.info('Creating optional panel...')
@@ -346,10 +524,12 @@ class SITInterface(tk.Tk):
         config_button = ttk.Button(frame, text="Collect All Configs and Dumps", width=27,
             command=self.quick_launch)
         config_button.grid(padx=5, pady=5, row=0, column=0, sticky="nswe")
+        self.start_buttons.append(config_button)
 
         regclr_button = ttk.Button(frame, text="Reset registry keys set by SIT", width=27,
             command=self.reg_clear)
         regclr_button.grid(padx=5, pady=5, row=1, column=0, sticky="nswe")
+        self.start_buttons.append(regclr_button)
 
         # windbg_button = ttk.Button(buttonsframe, text="Enable WinDBG")
         # windbg_button.grid(padx=5, pady=5, row=1, column=0, sticky="nswe")
@@ -366,8 +546,7 @@ class SITInterface(tk.Tk):
         self.checklist.append(selection)        
         
         icon_pos = (3, 1)
-        icon = ImageLabel(frame, self.paths["collectall"], background="#f0f0f0")
-        icon.resize((60,60))
+        icon = ImageLabel(frame, self.paths["collectall"], background="#f0f0f0", size=(60,60))
         icon.grid(row=icon_pos[0], column=icon_pos[1], sticky="se")
 
         # this is so the icon can correctly stick to the sides
@@ -399,8 +578,7 @@ class SITInterface(tk.Tk):
         for c in range(columns):
             issueframe.columnconfigure(c,weight=1, uniform='issueops')
         
-        icon = ImageLabel(issueframe, self.paths["Issue"], background="#f0f0f0")
-        icon.resize((60,60))
+        icon = ImageLabel(issueframe, self.paths["Issue"], background="#f0f0f0", size=(60,60))
         icon.grid(row=self.SPLIT, column=2, sticky="se")
 
         # this is so the icon can correctly stick to the sides
@@ -411,24 +589,13 @@ class SITInterface(tk.Tk):
         return issueframe
 
     def create_trace_selection(self,frame):        
-        buttonList = []
-        
+        """Only the initial option (N/A) is shown at launch, other ingredients
+        are created by get_trace_box when an issue type first shows them."""
         for t, conf in sorted(uiconfig.INGREDIENTS.items()):
-            logging.info(f'Adding trace \"{t}\"')
-            trace_selection = ttk.Checkbutton(frame, text=t, command=lambda e=t: self.on_item_checked(e))
-            trace_selection.text = t
-            trace_selection.state(['!alternate', '!selected', '!disabled' if conf["id"] in uiconfig.AVAILABLE else 'disabled'])
-            
-            # show tips
-            tip = conf["tip"]
-            createToolTip(trace_selection, tip) 
-
-            buttonList.append(trace_selection)
-
             # for the initial option (N/A)
-            if conf["id"] < 0:           
+            if conf["id"] < 0:
+                trace_selection = self.get_trace_box(t, frame)
                 trace_selection.grid(padx=2, pady=2, row=0, column=0, sticky="NSWE")
-                         
 
         # at least one column, 5 rows
         # this ensures that the frame is not collapsed when options are not enough
@@ -437,26 +604,115 @@ class SITInterface(tk.Tk):
         # frame.grid_columnconfigure(0, minsize=200)
         frame.grid_columnconfigure(0, weight=1)
         frame.grid_columnconfigure(1, weight=1)
-        return buttonList
+        return [self.trace_boxes[t] for t in sorted(self.trace_boxes)]
+
+    def get_trace_box(self, t, frame=None):
+        """Returns the checkbutton of ingredient `t`, creating it on first use."""
+        if t in self.trace_boxes:
+            return self.trace_boxes[t]
+        logging.info(f'Adding trace \"{t}\"')
+        conf = uiconfig.INGREDIENTS[t]
+        frame = frame if frame is not None else self.igrframe
+        trace_selection = ttk.Checkbutton(frame, text=t, command=lambda e=t: self.on_item_checked(e))
+        trace_selection.text = t
+        trace_selection.state(['!alternate', '!selected', '!disabled' if conf["id"] in uiconfig.AVAILABLE else 'disabled'])
+        
+        # show tips
+        tip = conf["tip"]
+        createToolTip(trace_selection, tip) 
+
+        self.trace_boxes[t] = trace_selection
+        # keep the ingredients sorted, before the optional ones (i.e. sysinfo at the last).
+        optional = [box for box in self.checklist if box.text not in self.trace_boxes]
+        self.checklist = [self.trace_boxes[k] for k in sorted(self.trace_boxes)] + optional
+        return trace_selection
 
     def ingrdient_panel(self):
         logging.info('Creating Ingredient panel...')
         """Powertrace Selection"""
         traceframe = ttk.LabelFrame(self, text="Step 3: Select Ingredient(s)", style=self.style_names["LabelFrame"])
-        checklist = self.create_trace_selection(traceframe)
+        self.create_trace_selection(traceframe)
 
-        icon = ImageLabel(traceframe, self.paths["Ingredient"], background="#f0f0f0")
-        icon.resize((60,60))
+        icon = ImageLabel(traceframe, self.paths["Ingredient"], background="#f0f0f0", size=(60,60))
         icon.grid(row=self.SPLIT, column=1, rowspan=2, sticky="se")
 
         # this is so the icon can correctly stick to the sides
         traceframe.grid_rowconfigure(self.SPLIT, weight=1)
         traceframe.grid_columnconfigure(1, weight=1)
 
-        # insert at begining, so that it sysinfo can be at the last.
-        self.checklist = checklist + self.checklist
         return traceframe
 
+    def progress_panel(self):
+        logging.info('Creating progress panel...')
+        frame = ttk.LabelFrame(self, text="Progress", style=self.style_names["LabelFrame"])
+
+        self.progress_bar = ttk.Progressbar(frame, orient="horizontal", mode="determinate", maximum=1000)
+        self.progress_bar.grid(padx=5, pady=2, row=0, column=0, columnspan=3, sticky="we")
+
+        self.progress_text = {k: tk.StringVar() for k in ("status", "bytes", "eta")}
+        ttk.Label(frame, textvariable=self.progress_text["status"]).grid(padx=5, pady=2, row=1, column=0, sticky="w")
+        ttk.Label(frame, textvariable=self.progress_text["bytes"]).grid(padx=5, pady=2, row=1, column=1, sticky="w")
+        ttk.Label(frame, textvariable=self.progress_text["eta"]).grid(padx=5, pady=2, row=1, column=2, sticky="e")
+        self.progress_text["status"].set("Idle")
+
+        # output of the running commands, as it is written to sit.log.
+        self.console = tk.Text(frame, height=6, wrap="none", state="disabled", font=("Consolas", 8))
+        self.console.tag_configure("stderr", foreground="#c00000")
+        scroll = ttk.Scrollbar(frame, orient="vertical", command=self.console.yview)
+        self.console.configure(yscrollcommand=scroll.set)
+        self.console.grid(padx=(5, 0), pady=2, row=2, column=0, columnspan=3, sticky="nswe")
+        scroll.grid(pady=2, row=2, column=3, sticky="ns")
+
+        frame.grid_columnconfigure(0, weight=1)
+        frame.grid_columnconfigure(1, weight=1)
+        return frame
+
+    def draw_console(self, lines):
+        """Appends (stream name, line) to the console, keeping its last progress.CONSOLE_LINES lines."""
+        if not lines:
+            return
+        self.console.configure(state="normal")
+        for name, line in lines:
+            self.console.insert("end", line + "\n", name)
+        extra = int(self.console.index("end-1c").split(".")[0]) - 1 - progress.CONSOLE_LINES
+        if extra > 0:
+            self.console.delete("1.0", f"{extra + 1}.0")
+        self.console.configure(state="disabled")
+        self.console.see("end")
+
+    def refresh_progress(self):
+        r"""Draws a snapshot of self.tracker, and again every PROGRESS_MS while the collection runs.
+        The engine only counts, so however often it reports, the panel is drawn at this rate.
+        """
+        if self.tracker is None:
+            return
+        s = self.tracker.snapshot()
+        mb = 1 << 20
+        if s.phase == "collecting":
+            running = ", ".join(s.running) if s.running else "waiting"
+            status = f"{s.done}/{s.total} ingredient(s) done, running: {running}"
+        elif s.phase == "done":
+            status = f"Done, {s.done}/{s.total} ingredient(s)" + (f", {s.failed} failed" if s.failed else "")
+        else:
+            status = f"{s.done}/{s.total} ingredient(s) done, {s.phase}"
+        amount = f"{s.copied / mb:.1f} MB copied"
+        if s.to_zip:
+            amount += f", {s.zipped / mb:.1f}/{s.to_zip / mb:.1f} MB zipped"
+        if s.rate > 0:
+            amount += f" ({s.rate / mb:.1f} MB/s)"
+        self.progress_text["status"].set(status)
+        self.progress_text["bytes"].set(amount)
+        self.progress_text["eta"].set(f"Elapsed {progress.format_duration(s.elapsed)}, "
+            f"left {progress.format_duration(s.eta)}")
+        if s.fraction is None:
+            self.progress_bar.configure(mode="indeterminate")
+            self.progress_bar.step(20)
+        else:
+            self.progress_bar.configure(mode="determinate", value=int(s.fraction * 1000))
+        self.draw_console(self.tracker.take_lines())
+        if self.worker is not None:
+            self.after(PROGRESS_MS, self.refresh_progress)
+
     def collect_panel(self):
         logging.info('Creating Collect panel...')
         """buttons"""
@@ -464,6 +720,7 @@ class SITInterface(tk.Tk):
         
         ok_button = ttk.Button(buttonsframe, text="Start", command=self.ready)
         ok_button.grid(padx=5, pady=5, row=0, column=0, sticky="s")
+        self.start_buttons.append(ok_button)
 
         cancel_button = ttk.Button(buttonsframe, text="Cancel", command=self.abort)
         cancel_button.grid(padx=5, pady=5, row=1, column=0, sticky="s")
@@ -471,8 +728,7 @@ class SITInterface(tk.Tk):
         # default_button = ttk.Button(buttonsframe, text="Default", command=self.abort)
         # default_button.grid(padx=5, pady=5, row=2, column=0, sticky="s")
 
-        exe_icon = ImageLabel(buttonsframe, self.paths["Execute"], background="#f0f0f0")
-        exe_icon.resize((60,60))
+        exe_icon = ImageLabel(buttonsframe, self.paths["Execute"], background="#f0f0f0", size=(60,60))
         exe_icon.grid(row=2, column=0, sticky="se")
 
         # this is so the icon can correctly stick to the sides
@@ -505,9 +761,13 @@ class SITInterface(tk.Tk):
         logging.info(f"Customer name: {strOEM}")
         logging.info(f"Pending trace(s): {queue}")
         
-        execute(strOEM, queue, time=self.timestamp)
+        self.run_queue(strOEM, queue)
 
     def abort(self):
+        if self.cancel is not None:
+            logging.info('User pressed Cancel, stopping the running collection...')
+            self.cancel.set()
+            return
         logging.info('User pressed Cancel, clearing all input & grey out...')
         ## clears oem
         self.oem_name.set("")
@@ -536,12 +796,11 @@ class SITInterface(tk.Tk):
         defaults = uiconfig.ISSUETYPES[issue]["default"]
         
         pos = 0
-        for box in self.checklist:
-            # avoid running grid_forget for the "system performance" option.
-            if box.master != self.igrframe:
+        for t, conf in sorted(uiconfig.INGREDIENTS.items()):
+            i = conf["id"]
+            if i not in shown_options and t not in self.trace_boxes:
                 continue
-
-            i = uiconfig.INGREDIENTS[box.text]["id"]
+            box = self.get_trace_box(t)
 
             # reset state
             box.state(['!selected', ('!disabled' if i in uiconfig.AVAILABLE else 'disabled')])
@@ -607,174 +866,184 @@ class SITInterface(tk.Tk):
                 child.configure(state='enable')
 
 
-def load_config(name='settings.ini'):
-    logging.info(f"Loading configuration from {name}...")
-    config = configparser.ConfigParser()        
-    if os.path.isfile(name):
-        config.read(name)
-    else:
-        logging.info(f"Creating new configuration file...")
-        config['BootTraces'] = {}
-        config['General'] = {'ZipOutput':True}
-
-    with open(name, 'w') as configfile:
-        config.write(configfile)
-    return config
-
-def update_config(boottrace, enable, logdir="", name='settings.ini'):
-    logging.info(f"Updating config file...")
-    config = configparser.ConfigParser()
-    if not os.path.isfile(name):
-        logging.error("Failed to create config file or config is deleted manually. Please retry.")
-        return
-    
-    pool = [s.lower() for s in uiconfig.INGREDIENTS]
-    if boottrace.lower() not in pool:
-        logging.error(f"Failed to update config because \"{boottrace}\" is not a supported trace/log/config.")
-        raise AssertionError(f"Failed to update config because \"{boottrace}\" is not a supported trace/log/config.")
-
-    config.read(name)
-    if enable:
-        config['BootTraces'][boottrace] = "Active"
-        config['BootTraces']["location"] = logdir
-    else:
-        try:
-            del config['BootTraces'][boottrace]
-        except:
-            pass
-    with open(name, 'w') as configfile:
-        config.write(configfile)
-
-def handle_boot_traces(boottraces):
-    trace_names = []
-    for name, state in boottraces.items():
-        if state == "Active":
-            trace_names.append(name)
-
-    if len(trace_names) == 0:
+def load_config():
+    """The settings in settings.ini, read once per process (see statestore.py)."""
+    return statestore.get_store().settings
+
+def handle_boot_traces(boottraces, prompts=None, idle=None, cancel=None, console=None):
+    r"""Asks which active boot traces to stop, in one prompt, then stops them in
+    parallel and collects their outputs into the output directory of the run
+    that started them.
+    Args:
+        boottraces (list (BootTrace)): the active boot traces, see statestore.py.
+        prompts (TkPrompts or ScriptedPrompts): asks the user, Tk dialogs by default.
+        idle (callable): called periodically while waiting on the traces, e.g. Tk.update.
+        cancel (threading.Event): kills the running commands when set.
+        console (callable): called with (stream name, line) for every line of command output.
+    Returns:
+        dict: output directory -> the zip file(s) produced from it, or the directory when not zipped.
+    """
+    prompts = prompts if prompts is not None else TkPrompts()
+    if len(boottraces) == 0:
         logging.error("No boot trace found active. Aborted.")
-        return
-    
-    zipping = False
-    for trace_name in trace_names:
-        logging.info(f"Found boot trace {trace_name}, asking user...")
-        stopboot = messagebox.askyesno(title="Stop",
-            message=f"\"{trace_name}\" is active and running. Do you want to stop it now and collect output(s)?")
-        
-        if not stopboot:
-            logging.info("User denied. Aborted.")
+        return {}
+
+    logging.info(f"Found boot trace(s) {boottraces}, asking user...")
+    chosen = prompts.choose(title="Stop",
+        message="The following boot trace(s) are active and running. Stop the checked ones now and collect output(s)?",
+        options=[b.name for b in boottraces], key="stop_boot")
+    queue = []
+    for boot in boottraces:
+        if boot.name not in chosen:
+            logging.info(f"User denied stopping \"{boot.name}\".")
             continue
-        
-        zipping = True
-        # find the id of the ingredient trace
-        LogType = -99
-        for t,l in uiconfig.INGREDIENTS.items():
-            if t.lower() == trace_name:
-                LogType = l["id"]
-                break
-
-        if LogType == -99:
-            logging.error(f"\"{trace_name}\" is not supported in current tool. Aborted.")
-            return
-
-        # find the previous working directory to continue in.
-        try:
-            logdir = boottraces.pop("location") # remove "location" because error
-        except KeyError:
-            logging.warning("Previous logging directory not found. Creating a new directory.")
-            logdir = pjoin(os.getcwd(), "boottrace-"+get_date_time())
-
-        logging.info(f"Ouput directory set to: {logdir}")
-        tracer = Traces(logdir=logdir, resrc_path=resrc_path, codec=_codec)
-
-        try:
-            if LogType == 14:
-                tracer.realtimebsod(stop=True)
-            elif LogType == 15:
-                tracer.tbt_boot(stop=True)
-            elif LogType == 17:
-                tracer.isst(stop=True)
-            elif LogType == 18:
-                tracer.i2c(acpi=False, stop=True)
-            elif LogType == 20:
-                tracer.i2c(acpi=True, stop=True)
-            elif LogType == 21:
-                tracer.graphic_boot(stop=True)
-            elif LogType == 22:
-                tracer.wiman(stop=True)
-            elif LogType == 26:
-                tracer.dal(stop=True)
-            elif LogType == 27:
-                tracer.csme_yellowbang(stop=True, mode="Tee")
-            elif LogType == 28:
-                tracer.csme_yellowbang(stop=True, mode="SPD")
-            elif LogType == 29:
-                tracer.csme_yellowbang(stop=True, mode="gsc")
-            elif LogType == 30:
-                tracer.csme_yellowbang(stop=True, mode="_aux")
-           
-            update_config(trace_name, enable=False)
-        except Exception as e:
-            logging.exception("Unhandled exception occurred")
-            messagebox.showerror(title='Unhandled Exception',message=f"See log file for more detail. Error: {e}")
-                
-
-    if zipping:
-        logging.info("Post-processing output directory...")
+        entry = uiconfig.REGISTRY.get(boot.id)
+        if entry is None or not entry["stop"]:
+            logging.error(f"\"{boot.name}\" is not supported in current tool. Skipped.")
+            continue
+        if not boot.location:
+            logging.warning(f"Previous logging directory of \"{boot.name}\" not found. Creating a new directory.")
+            boot.location = pjoin(os.getcwd(), "boottrace-"+get_date_time())
+        queue.append((boot, entry))
+    if not queue:
+        return {}
+
+    # continue in the output directory of the run that started each trace.
+    tracer_of = {}
+    for boot, entry in queue:
+        if boot.location not in tracer_of:
+            logging.info(f"Ouput directory set to: {boot.location}")
+            tracer_of[boot.location] = tracers.Traces(logdir=boot.location, resrc_path=resrc_path, codec=_codec, prompts=prompts)
+            if cancel is not None:
+                tracer_of[boot.location].runner.cancel_event = cancel
+            tracer_of[boot.location].runner.console = console
+    if len(tracer_of) == 1:
+        # appended to the log of the run that started the traces.
+        sitlog.begin_session(next(iter(tracer_of)), _codec)
+    boot_of = {entry["id"]: boot for boot, entry in queue}
+
+    def stop(entry):
+        tracer = tracer_of[boot_of[entry["id"]].location]
+        for method, kwargs in entry["stop"]:
+            getattr(tracer, method)(**kwargs)
+
+    store = statestore.get_store()
+    def stopped(result):
+        if result.ok:
+            store.stop_boot_trace(boot_of[result.id].name)
 
+    config = load_config()
+    for logdir, tracer in tracer_of.items():
+        tracer.collector.algorithm = checksums.algorithm(config)
+        tracer.permissions = tracer.collector.permissions = permissions.open_fixer(logdir, config)
+    run = telemetry.new_run("boot_stop")
+    pool = scheduler.IngredientScheduler(
+        workers=config['General'].getint('Workers', fallback=4),
+        locks=uiconfig.LOCKS,
+        interactive=uiconfig.INTERACTIVE,
+        names={i: d["name"] for i, d in uiconfig.REGISTRY.items()},
+        costs=uiconfig.COSTS,
+        on_done=stopped)
+    try:
+        results = pool.run([entry for boot, entry in queue], stop, idle=idle)
+    finally:
+        # one write for all the stopped traces.
+        store.commit()
+    report_results(results, prompts)
+
+    history = telemetry.open_history(config)
+    logging.info("Post-processing output directory...")
+    produced = {} # output directory -> its zip file(s), or the directory itself when not zipped
+    for logdir, tracer in tracer_of.items():
+        mine = [r for r in results if boot_of[r.id].location == logdir]
+        telemetry.save_run(logdir, telemetry.finish_run(dict(run, ingredients=[]), mine, logdir), history)
         tracer.chmod(logdir)
         tracer.cleanup()
-
-        logging.info("Post-processing done.")
-
-        config = load_config()
+        sitlog.end_session()
+        produced[logdir] = [logdir]
         if config['General']['ZipOutput'].lower() == "true":
-            zipfolder(logdir)
-        
-        # pop up message for opening folder.
-        logging.info("Task completed. Asking user if open folder...")
-        promptdir = messagebox.askyesno(title='Info',
-            message="All tasks completed. Please attach the resulting zip file to IPS issue attachment. Do you want to open the folder now?")
-        if promptdir:
-            logging.info("Opening directory with explorer.exe ...")
-            os.system("explorer /select, \"{}\"".format(logdir))
-        else:
-            logging.info("User denied. Done.")
+            produced[logdir] = zipfolder(logdir, known=tracer.collector.digests) or [logdir]
+        elif tracer.collector.algorithm is not None:
+            checksums.write_folder(logdir, tracer.collector.digests, tracer.collector.algorithm, exclude=[journal.NAME])
+    logging.info("Post-processing done.")
+
+    # pop up message for opening the folder of every output directory.
+    outputs = "\n".join(path for paths in produced.values() for path in paths)
+    logging.info(f"Task completed, produced: {outputs}. Asking user if open folder...")
+    promptdir = prompts.yesno(title='Info',
+        message=f"All tasks completed. Please attach the resulting zip file(s) to IPS issue attachment:\n{outputs}\nDo you want to open the folder(s) now?",
+        key="open_folder")
+    if promptdir:
+        for paths in produced.values():
+            logging.info(f"Opening \"{paths[0]}\" with explorer.exe ...")
+            os.system("explorer /select, \"{}\"".format(paths[0]))
+    else:
+        logging.info("User denied. Done.")
+    return produced
+
+def resume_unfinished(prompts=None, idle=None, cancel=None, tracker=None):
+    r"""Offers to resume the runs that crashed or hung before they finished (see journal.py).
+    A resumed run continues in its output directory, with the ingredients that did not succeed.
+    Args:
+        prompts (TkPrompts or ScriptedPrompts): asks the user, Tk dialogs by default.
+        idle (callable): called periodically while waiting on commands, e.g. Tk.update.
+        cancel (threading.Event): stops the resumed run when set.
+        tracker (progress.ProgressTracker): receives the progress of the resumed runs.
+    Returns:
+        list (dict): the summary of every resumed run, see execute.
+    """
+    prompts = prompts if prompts is not None else TkPrompts()
+    summaries = []
+    for j in journal.find_unfinished(os.getcwd()):
+        queue = [uiconfig.REGISTRY[i] for i in j.remaining() if i in uiconfig.REGISTRY]
+        logging.info(f"Found unfinished run {j}, asking user...")
+        todo = ", ".join(x["name"] for x in queue) if queue else "only zipping the outputs"
+        if not prompts.yesno(title="Resume",
+                message=f"The collection into \"{os.path.basename(j.logdir)}\" did not finish. Resume it now? ({todo})",
+                key="resume"):
+            logging.info("User denied resuming.")
+            journal.discard(j)
+            continue
+        summaries.append(execute(j.customer, queue, time=j.time, idle=idle, cancel=cancel, prompts=prompts, resume=j,
+            tracker=tracker))
+    return summaries
 
 
 def main():
     global _codec
+    # --profile-startup: write startup_profile.json and exit once the window is drawn.
+    profile = "--profile-startup" in sys.argv
+    argv = [a for a in sys.argv[1:] if not a.startswith("--")]
+    startup = PhaseTimer("Startup", start=_launched)
+    startup.phases.append(("imports", 0.0, _imported - _launched))
+
     # 0. init logging
-    logging.basicConfig(
-        format='%(asctime)s [%(levelname)s] [%(funcName)s] %(message)s', 
-        # datefmt='%d-%b-%y %H:%M:%S',
-        level=logging.INFO, # INFO
-        handlers=[
-            logging.FileHandler("sit.log", mode="a", encoding=_codec),
-            logging.StreamHandler(sys.stderr)
-        ]
-        )
+    with startup.phase("logging"):
+        # written by a background thread, rotated and compressed (see sitlog.py).
+        sitlog.setup(codec=_codec, config=load_config())
 
     logging.info('Logger initialized succussfully.')
 
     # 1. try to kill the splash screen by pid passed in by launch.bat
-    if len(sys.argv) > 1:
-        try:
-            logging.info(f'PID passed as {sys.argv[1]} for splashscreen.')
-            splash_pid = int(sys.argv[1])
-            if len(sys.argv) > 2:
-                _codec = str(sys.argv[2])
-            p = psutil.Process(splash_pid)
-            if p.name() == "mshta.exe":
-                logging.info('Terminating mshta.exe ...')
-                subprocess.call("@taskkill /PID {} /F >nul 2>&1".format(splash_pid), shell=True)
-                logging.info('Successfully terminated mshta.exe (splash screen).')
-        except:
-            raise
+    if len(argv) > 0:
+        with startup.phase("splash"):
+            try:
+                logging.info(f'PID passed as {argv[0]} for splashscreen.')
+                splash_pid = int(argv[0])
+                if len(argv) > 1:
+                    _codec = str(argv[1])
+                p = psutil.Process(splash_pid)
+                if p.name() == "mshta.exe":
+                    logging.info('Terminating mshta.exe ...')
+                    subprocess.call("@taskkill /PID {} /F >nul 2>&1".format(splash_pid), shell=True)
+                    logging.info('Successfully terminated mshta.exe (splash screen).')
+            except:
+                raise
 
     # 1. checkini
     logging.info('Loading configuration from settings.ini ...')
-    config = load_config()
+    with startup.phase("config"):
+        config = load_config()
     #### debug function: if debug mode, set resource dir to dist/resource
     global resrc_path
     if 'debug' in config['General']:
@@ -782,29 +1051,37 @@ def main():
         resrc_path = pjoin(os.path.abspath(os.path.dirname(__file__)), "dist", "resource")
 
     # 2. init UI
-    win = SITInterface()
+    with startup.phase("ui"):
+        win = SITInterface(profiler=startup)
 
-    # 3. handle boot trace
-    if len(config['BootTraces']) > 0:
-        handle_boot_traces(config['BootTraces'])
-        logging.info('Successfully handled boot traces')
-    else:
+    # 3. handle boot trace, then resume the runs interrupted by a crash or a hang,
+    # on the worker thread once the window runs its event loop (see run_startup).
+    boottraces = statestore.get_store().active_boot_traces()
+    if len(boottraces) == 0:
         logging.info('Successfully loaded config.')
 
-    
-        
     # 4. detect cpuinfo
     logging.info('Detecting cpu info ...')
-    cpuinfo = platform.processor()
+    with startup.phase("cpuinfo"):
+        cpuinfo = platform.processor()
     logging.info(f'CPU info: {cpuinfo}')
-    if "intel" not in cpuinfo.lower():
+    if "intel" not in cpuinfo.lower() and not profile:
         logging.error('CPU info does not contain intel. Aborting...')
         messagebox.showerror(title="Error", 
             message="The system is detected to be \""+cpuinfo+"\". This tool only supports Intel® platform.")
         return
     logging.info('Successfully found Intel cpu.')
 
-    # 5. enter UI main loop
+    # 5. report startup time once the window is drawn, then enter UI main loop
+    def first_frame():
+        win.update_idletasks()
+        startup.mark("first frame")
+        startup.report("startup_profile.json" if profile else None)
+        if profile:
+            win.destroy()
+    win.after_idle(first_frame)
+    if not profile:
+        win.after_idle(lambda: win.run_startup(boottraces))
     win.mainloop()
    
 
@@ -0,0 +1,153 @@
+r"""
+Disassembly of dumped ACPI tables (acpidump -b), in parallel and cached.
+
+Every table is disassembled by its own iasl process. The .dsl of a table is
+kept in a cache keyed by the hash of the table (and of the iasl binary), so
+tables that did not change since an earlier run, usually most of them on the
+same BIOS, are not disassembled again.
+"""
+import os
+from os.path import join as pjoin
+import csv
+import glob
+import time
+import shutil
+import struct
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+HEADER = struct.Struct("<4sIBB6s8sI4sI") # the standard ACPI table header, 36 bytes
+
+def parse_header(path):
+    """Returns the header fields of an ACPI table file, None if it is too short."""
+    with open(path, "rb") as f:
+        data = f.read(HEADER.size)
+    if len(data) < HEADER.size:
+        return None
+    sig, length, rev, checksum, oem, table, oem_rev, creator, creator_rev = HEADER.unpack(data)
+    text = lambda b: b.decode("ascii", "replace").rstrip("\x00 ")
+    return {
+        "signature": text(sig),
+        "length": length,
+        "revision": rev,
+        "oem_id": text(oem),
+        "oem_table_id": text(table),
+        "oem_revision": f"0x{oem_rev:08X}",
+        "creator_id": text(creator),
+        "creator_revision": f"0x{creator_rev:08X}",
+    }
+
+class AcpiCache(object):
+    def __init__(self, root, max_age_days=7):
+        r"""
+        Cache of disassembled tables, <root>/<hash>.dsl.
+        Args:
+            root (str): directory of the cache.
+            max_age_days (float): entries unused for longer than this are evicted.
+        """
+        self.root = os.path.abspath(root)
+        self.max_age = max_age_days * 86400
+        os.makedirs(self.root, exist_ok=True)
+
+    def path(self, digest):
+        return pjoin(self.root, f"{digest}.dsl")
+
+    def get(self, digest, tgt):
+        """copies the cached .dsl to tgt, returns False if not cached."""
+        src = self.path(digest)
+        try:
+            shutil.copyfile(src, tgt)
+            os.utime(src) # last used, for eviction
+            return True
+        except OSError:
+            return False
+
+    def put(self, digest, dsl):
+        # one temporary file per thread: identical tables (e.g. duplicate SSDTs) are put at the same time.
+        tmp = f"{self.path(digest)}.{os.getpid()}.{threading.get_ident()}.tmp"
+        shutil.copyfile(dsl, tmp)
+        try:
+            os.replace(tmp, self.path(digest))
+        except OSError:
+            # the same entry, being replaced by another thread on Windows.
+            os.remove(tmp)
+            if not os.path.isfile(self.path(digest)):
+                raise
+
+    def evict(self):
+        now = time.time()
+        n = 0
+        for f in glob.glob(pjoin(self.root, "*.dsl")):
+            try:
+                if now - os.path.getmtime(f) > self.max_age:
+                    os.remove(f)
+                    n += 1
+            except OSError:
+                pass
+        logging.info(f"ACPI cache: evicted {n} table(s).")
+
+def _digest(path, salt):
+    h = hashlib.blake2b(salt, digest_size=20)
+    with open(path, "rb") as f:
+        h.update(f.read())
+    return h.hexdigest()
+
+def disassemble(folder, iasl, run, cache=None, workers=None):
+    r"""Disassembles every .dat table in `folder`, next to it, and writes index.csv.
+    Args:
+        folder (str): directory holding the tables dumped by acpidump -b.
+        iasl (str): path of iasl.exe.
+        run (callable): run(cmd, cwd) runs a command, e.g. Traces.runat.
+        cache (AcpiCache): reuse the .dsl of unchanged tables, if given.
+        workers (int): number of iasl processes at the same time, default the cpu count.
+    Returns:
+        list (dict): the index, one row per table.
+    """
+    tables = sorted(glob.glob(pjoin(folder, "*.dat")))
+    try:
+        st = os.stat(iasl)
+        salt = f"{st.st_size}-{st.st_mtime_ns}".encode()
+    except OSError:
+        salt = b""
+
+    def one(dat):
+        row = {"file": os.path.basename(dat)}
+        row.update(parse_header(dat) or {"signature": "?"})
+        row["hash"] = _digest(dat, salt)
+        dsl = os.path.splitext(dat)[0] + ".dsl"
+        row["cached"] = cache is not None and cache.get(row["hash"], dsl)
+        if not row["cached"]:
+            # iasl writes the .dsl next to the input.
+            run(f"\"{iasl}\" -d \"{dat}\"", os.path.dirname(iasl))
+            if cache is not None and os.path.isfile(dsl):
+                cache.put(row["hash"], dsl)
+        row["disassembled"] = os.path.isfile(dsl)
+        return row
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 4, thread_name_prefix="iasl") as pool:
+        index = list(pool.map(one, tables))
+
+    with open(pjoin(folder, "index.csv"), "w", newline="", encoding="utf8") as f:
+        fields = ["file", "signature", "oem_id", "oem_table_id", "oem_revision", "revision",
+            "length", "creator_id", "creator_revision", "hash", "cached", "disassembled"]
+        writer = csv.DictWriter(f, fieldnames=fields, restval="")
+        writer.writeheader()
+        writer.writerows(index)
+
+    hits = sum(1 for r in index if r["cached"])
+    logging.info(f"Disassembled {len(index)} ACPI table(s) in {time.perf_counter() - start:.1f}s, "
+        f"{hits} from cache.")
+    return index
+
+def open_cache(config):
+    r"""Creates the ACPI cache under the content store directory, None if the cache is disabled.
+    Uses `Cache`, `CacheDir` and `CacheMaxAgeDays` of the [General] section of settings.ini, as dedup.open_store.
+    """
+    general = config['General']
+    if not general.getboolean('Cache', fallback=True):
+        return None
+    return AcpiCache(pjoin(general.get('CacheDir', fallback=".sitcache"), "acpi"),
+        max_age_days=general.getfloat('CacheMaxAgeDays', fallback=7))
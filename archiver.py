@@ -0,0 +1,370 @@
+import os
+from os.path import join as pjoin
+import logging
+import fnmatch
+import struct
+import tempfile
+import threading
+import time
+import zlib
+import importlib.util
+from concurrent.futures import ThreadPoolExecutor
+from lazyimport import lazy_import
+
+import checksums
+import progress
+
+zstandard = lazy_import("zstandard") # optional, for ArchiveMethod = zstd
+
+# already compressed or incompressible artifacts are stored as-is.
+STORED_PATTERNS = ["*.etl.*", "*.dmp", "*.dmpz", "*.dmpz.*", "*.zip", "*.cab", "*.7z", "*.gz", "*.zst"]
+
+ZIP_STORED = 0
+ZIP_DEFLATED = 8
+ZIP_ZSTANDARD = 93
+ZIP64_LIMIT = 0xFFFFFFFF - 1
+
+CHUNK = 1 << 20
+
+def _dostime(mtime):
+    t = time.localtime(mtime)
+    if t.tm_year < 1980:
+        return 0, (0 << 9) | (1 << 5) | 1
+    dostime = (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2)
+    dosdate = ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+    return dostime, dosdate
+
+class VolumeFile(object):
+    """
+    Write-only file that rolls over to "<path>.001", "<path>.002", ... every
+    `size` bytes. The volumes concatenate back into a single zip (7-Zip opens
+    "<path>.001" directly). With size=0 it writes a single file at `path`.
+    With `algorithm`, each volume is hashed as it is written, in `digests`.
+    """
+    def __init__(self, path, size=0, algorithm=None):
+        self.path = path
+        self.size = size
+        self.algorithm = algorithm
+        self.volumes = []
+        self.digests = {} # volume -> checksum
+        self._pos = 0
+        self._left = 0
+        self._f = None
+        self._h = None
+        if not self.size:
+            self._open(path)
+
+    def _open(self, name):
+        if self._f is not None:
+            self._close()
+        self._f = open(name, "wb")
+        self._h = checksums.new(self.algorithm) if self.algorithm else None
+        self.volumes.append(name)
+
+    def _close(self):
+        self._f.close()
+        self._f = None
+        if self._h is not None:
+            self.digests[self.volumes[-1]] = self._h.hexdigest()
+
+    def _next_volume(self):
+        self._open(f"{self.path}.{len(self.volumes) + 1:03d}")
+        self._left = self.size
+
+    def _put(self, data):
+        self._f.write(data)
+        if self._h is not None:
+            self._h.update(data)
+
+    def write(self, data):
+        self._pos += len(data)
+        if not self.size:
+            self._put(data)
+            return
+        view = memoryview(data)
+        while len(view):
+            if self._left == 0:
+                self._next_volume()
+            n = min(self._left, len(view))
+            self._put(view[:n])
+            self._left -= n
+            view = view[n:]
+
+    def tell(self):
+        return self._pos
+
+    def close(self):
+        if self._f is not None:
+            self._close()
+
+class _Entry(object):
+    def __init__(self, arcname, method, mtime, isdir=False):
+        self.arcname = arcname
+        self.method = method
+        self.mtime = mtime
+        self.isdir = isdir
+        self.flags = 0x800 # utf-8 names
+        self.crc = 0
+        self.usize = 0
+        self.csize = 0
+        self.offset = 0
+
+    @property
+    def zip64(self):
+        return self.usize > ZIP64_LIMIT or self.csize > ZIP64_LIMIT
+
+    @property
+    def version(self):
+        if self.method == ZIP_ZSTANDARD:
+            return 63
+        return 45 if self.zip64 or self.offset > ZIP64_LIMIT else 20
+
+class ArchiveWriter(object):
+    def __init__(self, path, method="deflate", level=6, workers=None, volume_size=0, algorithm=None):
+        r"""
+        Zip writer that compresses entries in parallel.
+
+        Each entry is compressed by a worker thread into a temporary spool file,
+        then appended to the archive. Entries matching STORED_PATTERNS are copied
+        without compression. Files can be added while other files are still
+        being produced, the archive is finalized by close().
+
+        With `algorithm`, every entry is also hashed as it is read, and the list
+        of checksums is written as the last entry (see checksums.py). Files the
+        Collector already hashed while copying them (`known`) are checked against
+        it, to catch files that changed or got corrupted in the output directory.
+
+        Args:
+            path (str): path of the zip file.
+            method (str): one of "deflate", "zstd", "store".
+            level (int): compression level.
+            workers (int): number of compression threads, defaults to the cpu count.
+            volume_size (int): split the output into volumes of this many bytes, 0 to disable.
+            algorithm (str): checksums of the entries, one of checksums.SUMS, None to disable.
+        """
+        if method == "zstd" and importlib.util.find_spec("zstandard") is None:
+            logging.warning("zstandard is not installed, falling back to deflate.")
+            method = "deflate"
+        self.path = path
+        self.method = {"deflate": ZIP_DEFLATED, "zstd": ZIP_ZSTANDARD, "store": ZIP_STORED}[method]
+        self.level = level
+        self.out = VolumeFile(path, volume_size)
+        self.entries = []
+        self.added = set()
+        self.exclude = set() # arcnames never written, e.g. the journal of the run
+        self.algorithm = algorithm
+        self.digests = {} # arcname -> checksum
+        self.known = {} # source file -> checksum computed when it was collected
+        self.mismatched = []
+        self._spool_dir = os.path.dirname(os.path.abspath(path))
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1,
+            thread_name_prefix="archive")
+        self._futures = []
+        logging.info(f"Creating archive \"{path}\" (method={method}, volume_size={volume_size})")
+
+    def _compressor(self):
+        if self.method == ZIP_ZSTANDARD:
+            return zstandard.ZstdCompressor(level=self.level).compressobj()
+        return zlib.compressobj(self.level, zlib.DEFLATED, -15)
+
+    def add(self, src, arcname):
+        """Queues the file or directory `src` to be written as `arcname`."""
+        if os.path.isdir(src):
+            for root, dirs, files in os.walk(src):
+                rel = os.path.relpath(root, src)
+                base = arcname if rel == "." else f"{arcname}/{rel.replace(os.sep, '/')}"
+                if not dirs and not files:
+                    self._submit(root, base + "/")
+                for f in files:
+                    self._submit(pjoin(root, f), f"{base}/{f}")
+        elif os.path.isfile(src):
+            self._submit(src, arcname)
+        else:
+            logging.warning(f"\"{src}\" ignore for not existing.")
+
+    def add_tree(self, root):
+        """Queues everything under `root` that has not been added yet."""
+        for name in sorted(os.listdir(root)):
+            self.add(pjoin(root, name), name)
+
+    def _submit(self, src, arcname):
+        if arcname in self.added or arcname in self.exclude or (self.algorithm is not None and arcname in checksums.SUMS.values()):
+            return # the list of checksums is written by close()
+        self.added.add(arcname)
+        if not arcname.endswith("/") and os.path.isfile(src):
+            progress.expect_zip(os.path.getsize(src))
+        self._futures.append(self._pool.submit(self._write_entry, src, arcname))
+
+    def _write_entry(self, src, arcname):
+        try:
+            mtime = os.path.getmtime(src)
+            if arcname.endswith("/"):
+                entry = _Entry(arcname, ZIP_STORED, mtime, isdir=True)
+                with self._lock:
+                    self._write_local(entry, b"")
+                    self.entries.append(entry)
+            elif self.method == ZIP_STORED or any(fnmatch.fnmatch(arcname.lower(), p) for p in STORED_PATTERNS):
+                self._write_stored(src, _Entry(arcname, ZIP_STORED, mtime))
+            else:
+                self._write_compressed(src, _Entry(arcname, self.method, mtime))
+        except Exception:
+            logging.exception(f"Failed to archive \"{src}\"")
+            return
+        known = self.known.get(os.path.abspath(src))
+        if known is not None and arcname in self.digests and self.digests[arcname] != known:
+            logging.error(f"\"{src}\" changed since it was collected, checksum {self.digests[arcname]} instead of {known}.")
+            with self._lock:
+                self.mismatched.append(arcname)
+
+    def _hasher(self):
+        return checksums.new(self.algorithm) if self.algorithm else None
+
+    def _write_compressed(self, src, entry):
+        comp = self._compressor()
+        crc = 0
+        h = self._hasher()
+        with tempfile.TemporaryFile(dir=self._spool_dir) as spool:
+            with open(src, "rb") as f:
+                for chunk in iter(lambda: f.read(CHUNK), b""):
+                    crc = zlib.crc32(chunk, crc)
+                    if h is not None:
+                        h.update(chunk)
+                    entry.usize += len(chunk)
+                    spool.write(comp.compress(chunk))
+                    progress.record_bytes("zipped", len(chunk))
+            spool.write(comp.flush())
+            entry.crc = crc
+            entry.csize = spool.tell()
+            spool.seek(0)
+            with self._lock:
+                self._write_local(entry, b"")
+                for chunk in iter(lambda: spool.read(CHUNK), b""):
+                    self.out.write(chunk)
+                self.entries.append(entry)
+                if h is not None:
+                    self.digests[entry.arcname] = h.hexdigest()
+
+    def _write_stored(self, src, entry):
+        # the crc is not known until the file is read, so it follows the data
+        # in a data descriptor instead of a second read pass.
+        entry.flags |= 0x08
+        entry.usize = entry.csize = size = os.path.getsize(src)
+        crc = n = 0
+        h = self._hasher()
+        with self._lock:
+            # the local header and the descriptor agree on zip64, whatever the file became since.
+            zip64 = entry.zip64
+            self._write_local(entry, b"")
+            with open(src, "rb") as f:
+                # a file still written to (e.g. a running .etl) is stored as it was when the entry began.
+                while n < size:
+                    chunk = f.read(min(CHUNK, size - n))
+                    if not chunk:
+                        break
+                    crc = zlib.crc32(chunk, crc)
+                    if h is not None:
+                        h.update(chunk)
+                    self.out.write(chunk)
+                    n += len(chunk)
+                    progress.record_bytes("zipped", len(chunk))
+            if n != size:
+                logging.warning(f"\"{src}\" shrank to {n} bytes while it was archived.")
+            entry.crc = crc
+            entry.usize = entry.csize = n
+            if h is not None:
+                self.digests[entry.arcname] = h.hexdigest()
+            fmt = "<IIQQ" if zip64 else "<IIII"
+            self.out.write(struct.pack(fmt, 0x08074b50, entry.crc, entry.csize, entry.usize))
+            self.entries.append(entry)
+
+    def _write_sums(self):
+        """writes the list of checksums of the entries, as the last entry."""
+        data = checksums.sums_text(self.digests).encode("utf8")
+        entry = _Entry(checksums.SUMS[self.algorithm], ZIP_DEFLATED, time.time())
+        comp = zlib.compressobj(6, zlib.DEFLATED, -15)
+        cdata = comp.compress(data) + comp.flush()
+        entry.crc = zlib.crc32(data)
+        entry.usize, entry.csize = len(data), len(cdata)
+        self._write_local(entry, b"")
+        self.out.write(cdata)
+        self.entries.append(entry)
+        logging.info(f"Checksums ({self.algorithm}) of {len(self.digests)} file(s) written to {entry.arcname}"
+            + (f", {len(self.mismatched)} changed since collected." if self.mismatched else "."))
+
+    def _write_local(self, entry, extra):
+        """writes the local file header, the caller must hold the lock."""
+        entry.offset = self.out.tell()
+        name = entry.arcname.encode("utf8")
+        usize, csize = entry.usize, entry.csize
+        if entry.zip64:
+            extra = struct.pack("<HHQQ", 0x0001, 16, usize, csize) + extra
+            usize = csize = 0xFFFFFFFF
+        crc = 0 if entry.flags & 0x08 else entry.crc
+        dostime, dosdate = _dostime(entry.mtime)
+        self.out.write(struct.pack("<IHHHHHIIIHH", 0x04034b50, entry.version, entry.flags,
+            entry.method, dostime, dosdate, crc, csize, usize, len(name), len(extra)))
+        self.out.write(name)
+        self.out.write(extra)
+
+    def _write_central(self, entry):
+        name = entry.arcname.encode("utf8")
+        usize, csize, offset = entry.usize, entry.csize, entry.offset
+        fields = []
+        if usize > ZIP64_LIMIT:
+            fields.append(usize)
+            usize = 0xFFFFFFFF
+        if csize > ZIP64_LIMIT:
+            fields.append(csize)
+            csize = 0xFFFFFFFF
+        if offset > ZIP64_LIMIT:
+            fields.append(offset)
+            offset = 0xFFFFFFFF
+        extra = struct.pack(f"<HH{len(fields)}Q", 0x0001, 8 * len(fields), *fields) if fields else b""
+        dostime, dosdate = _dostime(entry.mtime)
+        attr = 0x10 if entry.isdir else 0
+        self.out.write(struct.pack("<IHHHHHHIIIHHHHHII", 0x02014b50, entry.version, entry.version,
+            entry.flags, entry.method, dostime, dosdate, entry.crc, csize, usize,
+            len(name), len(extra), 0, 0, 0, attr, offset))
+        self.out.write(name)
+        self.out.write(extra)
+
+    def close(self):
+        """Waits for all queued entries, then writes the central directory."""
+        for f in self._futures:
+            f.result()
+        self._pool.shutdown()
+        if self.algorithm is not None:
+            self._write_sums()
+
+        start = self.out.tell()
+        for entry in self.entries:
+            self._write_central(entry)
+        end = self.out.tell()
+        count, size = len(self.entries), end - start
+
+        if count >= 0xFFFF or start > ZIP64_LIMIT or size > ZIP64_LIMIT:
+            self.out.write(struct.pack("<IQHHIIQQQQ", 0x06064b50, 44, 45, 45, 0, 0,
+                count, count, size, start))
+            self.out.write(struct.pack("<IIQI", 0x07064b50, 0, end, 1))
+            count, size, start = min(count, 0xFFFF), min(size, 0xFFFFFFFF), min(start, 0xFFFFFFFF)
+        self.out.write(struct.pack("<IHHHHIIH", 0x06054b50, 0, 0, count, count, size, start, 0))
+        self.out.close()
+        logging.info(f"Archive completed: {', '.join(self.out.volumes)}")
+        return self.out.volumes
+
+def open_archive(folder, config):
+    r"""Creates the archive writer for `folder` from the [General] section of settings.ini.
+    - `ArchiveMethod`: one of deflate, zstd, store (default deflate).
+    - `ArchiveLevel`: compression level.
+    - `ArchiveVolumeMB`: split the zip into volumes of this size, 0 to disable.
+    - `ArchiveWorkers`: number of compression threads, 0 for the cpu count.
+    - `Checksum`: checksums of the entries, see checksums.algorithm.
+    """
+    general = config['General']
+    method = general.get('ArchiveMethod', fallback="deflate").lower()
+    level = general.getint('ArchiveLevel', fallback=3 if method == "zstd" else 6)
+    volume = general.getint('ArchiveVolumeMB', fallback=0) * (1 << 20)
+    workers = general.getint('ArchiveWorkers', fallback=0) or None
+    return ArchiveWriter(folder + ".zip", method=method, level=level, workers=workers, volume_size=volume,
+        algorithm=checksums.algorithm(config))
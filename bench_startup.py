@@ -0,0 +1,69 @@
+r"""
+Import-time budget for the UI.
+
+Runs `python -X importtime -c "import UI"` in a fresh interpreter and reports
+the modules that take the longest to import. Fails (exit code 1) when the
+total import time is over the budget, or when a module that should only be
+loaded on demand (see lazyimport.py) is imported at startup.
+
+usage: python bench_startup.py [--budget-ms 300] [--runs 3] [--top 15]
+"""
+import os
+import sys
+import argparse
+import subprocess
+
+# modules that must not be imported when UI is imported
+DEFERRED = ["PIL", "psutil", "winreg", "zstandard", "tracers", "archiver", "dedup", "incremental", "scheduler", "acpitables", "checksums", "journal", "permissions", "progress", "registry", "shellpool", "dumpstream"]
+
+def measure(module="UI"):
+    r"""Imports `module` in a new interpreter.
+    Returns:
+        list of (self us, cumulative us, module name), in import order.
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=here, capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{proc.stderr}")
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        fields = line[len("import time:"):].split("|")
+        rows.append((int(fields[0]), int(fields[1]), fields[2].rstrip()))
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description="Checks the import time of UI.py against a budget.")
+    parser.add_argument("--budget-ms", type=float, default=300, help="maximum import time of UI (default 300)")
+    parser.add_argument("--runs", type=int, default=3, help="number of runs, the fastest is kept (default 3)")
+    parser.add_argument("--top", type=int, default=15, help="number of modules to list (default 15)")
+    args = parser.parse_args()
+
+    best = None
+    for _ in range(max(1, args.runs)):
+        rows = measure()
+        total = sum(r[0] for r in rows)
+        if best is None or total < best[0]:
+            best = (total, rows)
+    total, rows = best
+
+    print(f"{'self ms':>9} {'cumul ms':>9}  module")
+    for self_us, cumul_us, name in sorted(rows, key=lambda r: r[0], reverse=True)[:args.top]:
+        print(f"{self_us / 1000:9.1f} {cumul_us / 1000:9.1f}  {name.strip()}")
+    print(f"total: {total / 1000:.1f} ms, budget: {args.budget_ms:.0f} ms")
+
+    failed = False
+    loaded = {name.strip() for _, _, name in rows}
+    eager = [m for m in DEFERRED if m in loaded or any(n.startswith(m + ".") for n in loaded)]
+    if eager:
+        print(f"FAIL: imported at startup, should be deferred: {', '.join(eager)}")
+        failed = True
+    if total / 1000 > args.budget_ms:
+        print("FAIL: over budget")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
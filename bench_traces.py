@@ -0,0 +1,167 @@
+r"""
+Collection benchmark on a simulated Windows machine (see simenv.py).
+
+Runs UI.execute end to end for every issue type (all of its ingredients),
+or for the given ingredients one by one, against stub tools with realistic
+latencies and output sizes. Boot traces are started, then stopped as after
+a reboot. Reports the latency and throughput of every ingredient (from the
+run manifests, see telemetry.py) and of every scenario, the best of
+`--repeat` runs.
+
+usage: python bench_traces.py [--issues "BIOS related" ...] [--ingredients 3 4 ...] [--repeat 3]
+                              [--scale 0.1] [--time-scale 0.1] [--workdir DIR] [--json bench.json]
+"""
+import os
+from os.path import join as pjoin
+import sys
+import json
+import glob
+import time
+import shutil
+import logging
+import argparse
+import tempfile
+import threading
+
+import simenv
+
+def scenarios(issues=None, ingredients=None):
+    """(name, [ingredient ids]) to run: the given ingredients one by one, else the issue types."""
+    import uiconfig
+    import headless
+    if ingredients:
+        return [(name, [conf["id"]]) for name, conf in (headless.find_ingredient(i) for i in ingredients)]
+    found = []
+    for issue, conf in uiconfig.ISSUETYPES.items():
+        if issues and issue not in issues:
+            continue
+        ids = [i for i in conf["ingredients"] if i in uiconfig.AVAILABLE]
+        if ids:
+            found.append((issue, ids))
+    return found
+
+def run_scenario(name, ids, machine, answers):
+    r"""Runs the ingredients, then stops the boot traces they started.
+    Returns:
+        dict: wall time of the scenario, of the collection and of the boot trace stop,
+            and the ingredient metrics of the run manifests.
+    """
+    import UI
+    import uiconfig
+    import statestore
+    from prompts import ScriptedPrompts
+
+    machine.populate() # the files moved away by an earlier run
+    queue = [uiconfig.REGISTRY[i] for i in ids]
+    prompts = ScriptedPrompts(answers, wait=float(answers["display.duration"]), cancel=threading.Event())
+    customer = "BENCH-" + "".join(c if c.isalnum() else "_" for c in name)
+
+    start = time.perf_counter()
+    summary = UI.execute(customer, queue, time=time.strftime("%H-%M-%S") + f"-{time.perf_counter_ns()}", prompts=prompts)
+    collected = time.perf_counter()
+    boottraces = statestore.get_store().active_boot_traces()
+    if boottraces:
+        UI.handle_boot_traces(boottraces, prompts=prompts)
+    stopped = time.perf_counter()
+
+    try:
+        with open(pjoin(summary["logdir"], "manifest.json"), "r", encoding="utf8") as f:
+            runs = json.load(f)["runs"]
+    except (OSError, ValueError):
+        runs = []
+    metrics = [m for run in runs for m in run["ingredients"]]
+    # the zip of the run, or of the boot trace stop, and its volumes.
+    zips = glob.glob(summary["logdir"] + ".z*")
+    archive = sum(os.path.getsize(p) for p in zips)
+    shutil.rmtree(summary["logdir"], ignore_errors=True)
+    for p in zips:
+        os.remove(p)
+    return {"wall": stopped - start, "collect": collected - start, "boot_stop": stopped - collected,
+        "archive_bytes": archive, "ok": all(m["ok"] for m in metrics), "ingredients": metrics}
+
+def summarize(name, ids, runs):
+    """the best of the runs of a scenario, by wall time, with per ingredient latency and throughput."""
+    best = min(runs, key=lambda r: r["wall"])
+    per = {}
+    for m in best["ingredients"]:
+        p = per.setdefault(m["name"], {"name": m["name"], "id": m["id"], "ok": True, "wall": 0.0,
+            "processes": 0, "bytes": 0})
+        p["ok"] = p["ok"] and m["ok"]
+        p["wall"] += m["wall"] # start, then stop after the reboot
+        p["processes"] += m["processes"]
+        p["bytes"] += max(m["bytes"], m["output_bytes"])
+    for p in per.values():
+        p["wall"] = round(p["wall"], 3)
+        p["mb_s"] = round(p["bytes"] / (1 << 20) / p["wall"], 1) if p["wall"] else 0.0
+    total = sum(p["bytes"] for p in per.values())
+    return {
+        "scenario": name, "ingredients": ids, "ok": all(r["ok"] for r in runs),
+        "wall": round(best["wall"], 3), "collect": round(best["collect"], 3), "boot_stop": round(best["boot_stop"], 3),
+        "walls": [round(r["wall"], 3) for r in runs], "bytes": total, "archive_bytes": best["archive_bytes"],
+        "mb_s": round(total / (1 << 20) / best["wall"], 1) if best["wall"] else 0.0,
+        "per_ingredient": sorted(per.values(), key=lambda p: p["id"]),
+    }
+
+def report(results):
+    print(f"{'scenario / ingredient':<44} {'wall s':>8} {'MB':>9} {'MB/s':>8}  ok")
+    for s in results:
+        print(f"{s['scenario']:<44} {s['wall']:8.2f} {s['bytes'] / (1 << 20):9.2f} {s['mb_s']:8.1f}  {'yes' if s['ok'] else 'NO'}")
+        for p in s["per_ingredient"]:
+            print(f"  {p['name']:<42} {p['wall']:8.2f} {p['bytes'] / (1 << 20):9.2f} {p['mb_s']:8.1f}  {'yes' if p['ok'] else 'NO'}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks collections on a simulated Windows machine.")
+    parser.add_argument("--issues", nargs="+", help="issue types to run (default all)")
+    parser.add_argument("--ingredients", nargs="+", help="run these ingredients (ids or names) one by one instead")
+    parser.add_argument("--repeat", type=int, default=3, help="runs of every scenario, the fastest is kept (default 3)")
+    parser.add_argument("--scale", type=float, default=1.0, help="multiplies the file sizes (default 1.0)")
+    parser.add_argument("--time-scale", type=float, default=1.0, help="multiplies the tool latencies (default 1.0)")
+    parser.add_argument("--trace-seconds", type=float, default=10, help="answer to \"press OK to stop the trace\" (default 10)")
+    parser.add_argument("--workdir", help="where the machine and the outputs are (default a temp dir, deleted)")
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("--verbose", action="store_true", help="log the runs to stderr")
+    args = parser.parse_args()
+
+    if os.name == "nt":
+        sys.exit("The simulated machine runs the stubs through /bin/sh, run this outside of Windows.")
+    logging.basicConfig(format='%(asctime)s [%(levelname)s] [%(funcName)s] %(message)s',
+        level=logging.INFO if args.verbose else logging.CRITICAL)
+
+    workdir = os.path.abspath(args.workdir) if args.workdir else tempfile.mkdtemp(prefix="sitbench-")
+    jsonpath = os.path.abspath(args.json) if args.json else None
+    machine = simenv.SimulatedMachine(pjoin(workdir, "machine"), scale=args.scale, time_scale=args.time_scale)
+    machine.build()
+    print(f"simulated machine: {machine.base}, {machine.size() / (1 << 20):.1f} MB on the system drive")
+
+    # settings.ini, sitstate.json, the outputs and the history go into the work directory.
+    rundir = pjoin(workdir, "runs")
+    os.makedirs(rundir, exist_ok=True)
+    os.chdir(rundir)
+    if not os.path.isfile("settings.ini"):
+        with open("settings.ini", "w", encoding="utf8") as f:
+            f.write("[General]\nzipoutput = True\n")
+
+    answers = {"highloading.timeout": max(1, round(args.trace_seconds)), "display.duration": args.trace_seconds,
+        "acpi2.duration": args.trace_seconds,
+        "tbt.duration": args.trace_seconds, "video.duration": args.trace_seconds, "open_folder": False, "stop_boot": True}
+    results = []
+    try:
+        with machine.activate():
+            import UI
+            UI.resrc_path = machine.resource
+            for name, ids in scenarios(args.issues, args.ingredients):
+                runs = [run_scenario(name, ids, machine, answers) for _ in range(max(1, args.repeat))]
+                results.append(summarize(name, ids, runs))
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report(results)
+    if jsonpath:
+        with open(jsonpath, "w", encoding="utf8") as f:
+            json.dump({"scale": args.scale, "time_scale": args.time_scale, "trace_seconds": args.trace_seconds,
+                "repeat": args.repeat, "scenarios": results}, f, indent=2)
+    sys.exit(0 if all(s["ok"] for s in results) else 1)
+
+if __name__ == "__main__":
+    main()
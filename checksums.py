@@ -0,0 +1,289 @@
+r"""
+Checksums of the collected files, for checking a bundle after it was moved.
+
+The files are hashed while their bytes are already being read: by the
+Collector when it copies them, and by the ArchiveWriter when it compresses
+them into the zip. The archive holds the list as its last entry, `B2SUMS`
+(BLAKE2b-512) or `SHA256SUMS`, in the format of b2sum/sha256sum, so the
+extracted files can also be checked with `b2sum -c B2SUMS`.
+
+    python checksums.py SITE-PROJ-SoftwareIssueTracer-2026-10-18-10-00.zip
+
+streams every entry of the zip (or of its volumes, .zip.001, ...) and
+compares it with the list. Exit code: 0 intact, 1 mismatches, 2 no list.
+"""
+import os
+from os.path import join as pjoin
+import io
+import sys
+import glob
+import time
+import struct
+import hashlib
+import logging
+import zipfile
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from lazyimport import lazy_import
+
+zstandard = lazy_import("zstandard") # for archives written with ArchiveMethod = zstd
+
+SUMS = {"blake2b": "B2SUMS", "sha256": "SHA256SUMS"}
+CHUNK = 1 << 20
+
+def new(algorithm):
+    """A hash object of `algorithm`, one of SUMS."""
+    if algorithm == "blake2b":
+        return hashlib.blake2b() # 64 bytes, as b2sum
+    return hashlib.new(algorithm)
+
+def sums_text(digests):
+    """The list in b2sum/sha256sum format, from {name: hex digest}."""
+    return "".join(f"{digest}  {name}\n" for name, digest in sorted(digests.items()))
+
+def parse_sums(text):
+    """{name: hex digest} from a list in b2sum/sha256sum format."""
+    digests = {}
+    for line in text.splitlines():
+        digest, sep, name = line.partition("  ")
+        if sep:
+            digests[name.lstrip("*")] = digest.lower()
+    return digests
+
+def hash_file(path, algorithm):
+    h = new(algorithm)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def write_folder(folder, digests, algorithm, exclude=()):
+    r"""Writes the list of checksums of an output directory that is not zipped.
+    Files renamed into it (or written by the tools) were never read, they are hashed now.
+    Args:
+        digests (dict): absolute path -> checksum of the files hashed while collected, e.g. Collector.digests.
+        exclude (list (str)): names of files not listed, relative to folder.
+    """
+    folder = os.path.abspath(folder)
+    listname = SUMS[algorithm]
+    rel = {}
+    hashed = 0
+    for root, dirs, files in os.walk(folder):
+        for f in files:
+            path = pjoin(root, f)
+            name = os.path.relpath(path, folder).replace(os.sep, "/")
+            if name == listname or name in exclude:
+                continue
+            rel[name] = digests.get(path)
+            if rel[name] is None:
+                rel[name] = hash_file(path, algorithm)
+                hashed += 1
+    with open(pjoin(folder, listname), "w", encoding="utf8", newline="\n") as f:
+        f.write(sums_text(rel))
+    logging.info(f"Checksums of {len(rel)} file(s) written to \"{pjoin(folder, listname)}\", "
+        f"{len(rel) - hashed} hashed while collected.")
+
+def algorithm(config):
+    r"""The checksum algorithm from the [General] section of settings.ini, None if disabled.
+    - `Checksum`: blake2b (default), sha256, or none.
+    """
+    name = config['General'].get('Checksum', fallback="blake2b").lower()
+    if name == "none":
+        return None
+    if name not in SUMS:
+        logging.warning(f"Unknown checksum \"{name}\", using blake2b.")
+        return "blake2b"
+    return name
+
+class VolumeReader(io.RawIOBase):
+    """Read-only file over the volumes of a split zip (see archiver.VolumeFile), as one file."""
+    def __init__(self, paths):
+        self.paths = paths
+        self.sizes = [os.path.getsize(p) for p in paths]
+        self.size = sum(self.sizes)
+        self._files = [None] * len(paths)
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._pos, io.SEEK_END: self.size}[whence]
+        self._pos = max(0, base + offset)
+        return self._pos
+
+    def readinto(self, buf):
+        n = 0
+        view = memoryview(buf)
+        start = 0
+        for i, size in enumerate(self.sizes):
+            if n == len(view) or self._pos >= self.size:
+                break
+            if self._pos >= start + size:
+                start += size
+                continue
+            if self._files[i] is None:
+                self._files[i] = open(self.paths[i], "rb")
+            f = self._files[i]
+            f.seek(self._pos - start)
+            k = f.readinto(view[n:n + min(len(view) - n, start + size - self._pos)])
+            n += k
+            self._pos += k
+            start += size
+        return n
+
+    def close(self):
+        for f in self._files:
+            if f is not None:
+                f.close()
+        super().close()
+
+def open_raw(path):
+    """The zip at `path`, or its volumes <path>.001, ... as one file."""
+    volumes = sorted(glob.glob(glob.escape(path) + ".[0-9][0-9][0-9]"))
+    if os.path.isfile(path) or not volumes:
+        return open(path, "rb")
+    return io.BufferedReader(VolumeReader(volumes), CHUNK)
+
+class VerifyResult(object):
+    def __init__(self, algorithm=None):
+        self.algorithm = algorithm
+        self.ok = []
+        self.mismatch = [] # (name, expected, actual)
+        self.missing = [] # listed, not in the bundle
+        self.unlisted = [] # in the bundle, not listed
+        self.bytes = 0
+        self.elapsed = 0.0
+
+    @property
+    def intact(self):
+        return self.algorithm is not None and not self.mismatch and not self.missing
+
+    def __repr__(self):
+        return (f"<{self.algorithm}: {len(self.ok)} ok, {len(self.mismatch)} mismatch(es), {len(self.missing)} missing, "
+            f"{len(self.unlisted)} unlisted, {self.bytes / (1 << 20):.1f} MB in {self.elapsed:.1f}s>")
+
+def _raw_zstd(f, info):
+    """the decompressed chunks of a zstd entry, which zipfile cannot read, from its own file `f`."""
+    f.seek(info.header_offset)
+    namelen, extralen = struct.unpack("<HH", f.read(30)[26:30])
+    f.seek(info.header_offset + 30 + namelen + extralen)
+    left = info.compress_size
+    d = zstandard.ZstdDecompressor().decompressobj()
+    while left > 0:
+        data = f.read(min(CHUNK, left))
+        if not data:
+            raise EOFError(f"\"{info.filename}\" is truncated")
+        left -= len(data)
+        yield d.decompress(data)
+
+def _chunks(zf, info, reopen):
+    if info.compress_type == 93:
+        with reopen() as f:
+            yield from _raw_zstd(f, info)
+        return
+    with zf.open(info) as f: # checks the crc at the end
+        for chunk in iter(lambda: f.read(CHUNK), b""):
+            yield chunk
+
+def verify(path, workers=None):
+    r"""Checks every file of a bundle against its list of checksums.
+    Args:
+        path (str): a zip written by SIT, or an output directory.
+        workers (int): number of entries checked at the same time.
+    Returns:
+        VerifyResult
+    """
+    start = time.perf_counter()
+    result = VerifyResult()
+    if os.path.isdir(path):
+        names = {n: a for a, n in SUMS.items() if os.path.isfile(pjoin(path, n))}
+        if not names:
+            return result
+        listname = next(iter(names))
+        result.algorithm = names[listname]
+        with open(pjoin(path, listname), "r", encoding="utf8") as f:
+            expected = parse_sums(f.read())
+        def read(name):
+            with open(pjoin(path, *name.split("/")), "rb") as f:
+                yield from iter(lambda: f.read(CHUNK), b"")
+        present = set()
+        for root, dirs, files in os.walk(path):
+            for f in files:
+                present.add(os.path.relpath(pjoin(root, f), path).replace(os.sep, "/"))
+        zf = None
+    else:
+        raw = open_raw(path)
+        zf = zipfile.ZipFile(raw)
+        infos = {i.filename: i for i in zf.infolist() if not i.is_dir()}
+        names = {n: a for a, n in SUMS.items() if n in infos}
+        if not names:
+            zf.close()
+            raw.close()
+            return result
+        listname = next(iter(names))
+        result.algorithm = names[listname]
+        expected = parse_sums(zf.read(listname).decode("utf8"))
+        read = lambda name: _chunks(zf, infos[name], lambda: open_raw(path))
+        present = set(infos)
+
+    def check(name):
+        h = new(result.algorithm)
+        n = 0
+        try:
+            for chunk in read(name):
+                h.update(chunk)
+                n += len(chunk)
+        except Exception as e: # e.g. a bad crc, or a truncated volume
+            logging.error(f"Cannot read \"{name}\": {e}")
+            return name, f"unreadable ({e})", n
+        return name, h.hexdigest(), n
+
+    todo = [n for n in expected if n in present]
+    result.missing = sorted(n for n in expected if n not in present)
+    result.unlisted = sorted(n for n in present if n not in expected and n != listname)
+    try:
+        with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 4, thread_name_prefix="verify") as pool:
+            for name, digest, n in pool.map(check, todo):
+                result.bytes += n
+                if digest == expected[name]:
+                    result.ok.append(name)
+                else:
+                    result.mismatch.append((name, expected[name], digest))
+    finally:
+        if zf is not None:
+            zf.close()
+            raw.close()
+    result.elapsed = time.perf_counter() - start
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description="Checks a SIT zip (or output directory) against its checksums.")
+    parser.add_argument("bundle", help="the zip, its first volume, or an output directory")
+    parser.add_argument("--workers", type=int, help="entries checked at the same time (default the cpu count)")
+    args = parser.parse_args()
+
+    path = args.bundle
+    if path.endswith(".001") and not os.path.isfile(path[:-4]):
+        path = path[:-4]
+    result = verify(path, args.workers)
+    if result.algorithm is None:
+        print(f"{args.bundle}: no list of checksums ({', '.join(SUMS.values())}) found.")
+        sys.exit(2)
+    for name, expected, actual in result.mismatch:
+        print(f"MISMATCH {name}")
+    for name in result.missing:
+        print(f"MISSING  {name}")
+    for name in result.unlisted:
+        print(f"UNLISTED {name}")
+    print(f"{args.bundle}: {result}")
+    sys.exit(0 if result.intact else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,263 @@
+import os
+from os.path import join as pjoin
+import logging
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import telemetry
+import progress
+import checksums
+from journal import CHUNK_BYTES
+
+class CollectStats(object):
+    def __init__(self, label=""):
+        self.label = label
+        self.files = 0
+        self.bytes = 0
+        self.errors = 0
+        self.elapsed = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, nbytes):
+        with self._lock:
+            self.files += 1
+            self.bytes += nbytes
+
+    def fail(self):
+        with self._lock:
+            self.errors += 1
+
+    @property
+    def rate(self):
+        """bytes per second"""
+        return self.bytes / self.elapsed if self.elapsed > 0 else 0.0
+
+    def __repr__(self):
+        return (f"<{self.label}: {self.files} file(s), {self.bytes / (1 << 20):.1f} MB in {self.elapsed:.1f}s"
+            f" ({self.rate / (1 << 20):.1f} MB/s), {self.errors} error(s)>")
+
+class Collector(object):
+    def __init__(self, workers=8, bufsize=8 << 20, store=None, algorithm=None):
+        r"""
+        Copies or moves a manifest of files concurrently.
+
+        A source copied more than once by the same collector (e.g. the event
+        logs by both "optane" and "sysinfo") is only read the first time, later
+        copies are hardlinked to the first one.
+
+        Args:
+            workers (int): number of files copied at the same time.
+            bufsize (int): size of the read/write buffer for each copy.
+            store (ContentStore): reuse unchanged files from earlier runs, if given.
+            algorithm (str): hash the copied files while copying them (see checksums.py), None to disable.
+
+        With a `journal` (see journal.py), copied files are recorded so a resumed
+        run skips them, and large copies continue from their last recorded chunk.
+
+        Copies inherit the permission of the directory they are created in.
+        Files moved in keep their own, they are added to `permissions`
+        (a PermissionFixer, see permissions.py) to be fixed at the end of the run.
+        """
+        self.workers = workers
+        self.bufsize = bufsize
+        self.store = store
+        self.algorithm = algorithm
+        self.digests = {} # target -> checksum, of the files copied in this run
+        self.collected = {} # source -> (first target, copied event), for this run
+        self.journal = None
+        self.permissions = None
+        self._lock = threading.Lock()
+
+    def resolve(self, src, tgt):
+        r"""Expands one manifest entry into (src file, tgt file) pairs, with the
+        same target naming as shutil.copytree/shutil.copy2:
+        - a directory is copied to `tgt`, keeping the tree below it.
+        - a file is copied into `tgt` if it is a directory, else to `tgt`.
+        Empty directories are returned with a tgt file of None.
+        """
+        if os.path.isdir(src):
+            pairs = []
+            for root, dirs, files in os.walk(src):
+                rel = os.path.relpath(root, src)
+                tgtroot = tgt if rel == "." else pjoin(tgt, rel)
+                if not files and not dirs:
+                    pairs.append((root, tgtroot, None))
+                for f in files:
+                    pairs.append((pjoin(root, f), tgtroot, pjoin(tgtroot, f)))
+            return pairs
+        if os.path.isdir(tgt):
+            tgt = pjoin(tgt, os.path.basename(src))
+        return [(src, os.path.dirname(tgt), tgt)]
+
+    def _digest(self, tgt, digest):
+        if digest is not None:
+            with self._lock:
+                self.digests[os.path.abspath(tgt)] = digest
+
+    def copyfile(self, src, tgt):
+        """copies one file with a large buffer and keeps its metadata. Returns the number of bytes."""
+        n = 0
+        h = checksums.new(self.algorithm) if self.algorithm else None
+        offset = self.journal.resume_offset(src, tgt) if self.journal is not None else 0
+        with open(src, "rb") as fsrc, open(tgt, "r+b" if offset else "wb") as fdst:
+            buf = bytearray(self.bufsize)
+            view = memoryview(buf)
+            if offset:
+                # continue an interrupted copy, the bytes already copied only go into the checksum.
+                logging.info(f"Resuming the copy of \"{src}\" at {offset / (1 << 20):.0f} MB.")
+                left = offset if h is not None else 0
+                while left > 0:
+                    k = fdst.readinto(view[:min(len(buf), left)])
+                    if not k:
+                        break
+                    h.update(view[:k])
+                    left -= k
+                fsrc.seek(offset)
+                fdst.seek(offset)
+                fdst.truncate()
+            mark = offset + CHUNK_BYTES
+            while True:
+                k = fsrc.readinto(buf)
+                if not k:
+                    break
+                if h is not None:
+                    h.update(view[:k])
+                fdst.write(view[:k])
+                n += k
+                progress.record_bytes("copied", k)
+                if self.journal is not None and offset + n >= mark:
+                    fdst.flush()
+                    os.fsync(fdst.fileno())
+                    self.journal.chunk(src, tgt, offset + n)
+                    mark = offset + n + CHUNK_BYTES
+        shutil.copystat(src, tgt)
+        self._digest(tgt, h and h.hexdigest())
+        return n
+
+    def copyrange(self, src, tgt, offset, length):
+        """copies `length` bytes of src from `offset` into a new file, hashed like copyfile. Returns the number of bytes."""
+        n = 0
+        h = checksums.new(self.algorithm) if self.algorithm else None
+        with open(src, "rb") as fsrc, open(tgt, "wb") as fdst:
+            buf = bytearray(self.bufsize)
+            view = memoryview(buf)
+            fsrc.seek(offset)
+            while n < length:
+                k = fsrc.readinto(view[:min(len(buf), length - n)])
+                if not k:
+                    break
+                if h is not None:
+                    h.update(view[:k])
+                fdst.write(view[:k])
+                n += k
+                progress.record_bytes("copied", k)
+        self._digest(tgt, h and h.hexdigest())
+        return n
+
+    def copy_once(self, src, tgt):
+        """copies src, unless it was already collected in this run. Returns the number of bytes read."""
+        key = os.path.normcase(os.path.abspath(src))
+        with self._lock:
+            first, done = self.collected.setdefault(key, (tgt, threading.Event()))
+        if first != tgt:
+            done.wait()
+            if os.path.isfile(first):
+                logging.info(f"\"{src}\" already collected to \"{first}\", linking.")
+                try:
+                    os.link(first, tgt)
+                    self._digest(tgt, self.digests.get(os.path.abspath(first)))
+                    return 0
+                except OSError:
+                    pass
+        try:
+            if self.store is not None:
+                n, digest = self.store.fetch(src, tgt, self.algorithm)
+                progress.record_bytes("copied", n)
+                self._digest(tgt, digest)
+                return n
+            return self.copyfile(src, tgt)
+        finally:
+            done.set()
+
+    def _foreign(self, path):
+        if self.permissions is not None:
+            self.permissions.add(path)
+
+    def _transfer(self, src, tgtdir, tgt, move, stats):
+        try:
+            os.makedirs(tgtdir, exist_ok=True)
+            if tgt is None:
+                return
+            if not move and self.journal is not None and self.journal.collected(src, tgt):
+                logging.info(f"\"{src}\" already collected before the run was interrupted, skipping.")
+                return
+            if move:
+                n = os.path.getsize(src)
+                try:
+                    os.replace(src, tgt)
+                    progress.record_bytes("copied", n)
+                    self._foreign(tgt)
+                except OSError:
+                    # different volume, copy then delete
+                    n = self.copyfile(src, tgt)
+                    os.remove(src)
+            else:
+                n = self.copy_once(src, tgt)
+                if self.journal is not None:
+                    self.journal.file(src, tgt)
+            stats.add(n)
+        except Exception:
+            stats.fail()
+            logging.exception(f"Exception occurred while collecting \"{src}\"")
+
+    def collect(self, manifest, label=""):
+        r"""Copies or moves all entries of the manifest.
+        Args:
+            manifest (list (tuple)): (src, tgt) or (src, tgt, move) entries. Missing sources are ignored.
+            label (str): name used in the log, usually the ingredient.
+        Returns:
+            CollectStats
+        """
+        stats = CollectStats(label)
+        start = time.perf_counter()
+        jobs = []
+        for entry in manifest:
+            src, tgt = entry[0], entry[1]
+            move = len(entry) > 2 and entry[2]
+            if not os.path.exists(src):
+                logging.warning(f"\"{src}\" ignore for not existing.")
+                continue
+            logging.info(f"{'Moving' if move else 'Copying'}: \"{src}\" -> \"{tgt}\"")
+            if move and os.path.isdir(src) and os.path.isdir(tgt):
+                # like shutil.move, a directory moved to an existing directory goes inside it.
+                tgt = pjoin(tgt, os.path.basename(os.path.normpath(src)))
+            if move and os.path.isdir(src) and not os.path.exists(tgt):
+                # whole directories are renamed at once when on the same volume.
+                try:
+                    os.makedirs(os.path.dirname(os.path.abspath(tgt)), exist_ok=True)
+                    os.rename(src, tgt)
+                    self._foreign(tgt)
+                    continue
+                except OSError:
+                    pass
+            jobs.extend((s, d, t, move) for s, d, t in self.resolve(src, tgt))
+
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="collect") as pool:
+            for job in jobs:
+                pool.submit(self._transfer, *job, stats)
+
+        # remove the directories left empty by moving files out of them
+        for entry in manifest:
+            if len(entry) > 2 and entry[2] and os.path.isdir(entry[0]):
+                for root, dirs, files in os.walk(entry[0], topdown=False):
+                    try:
+                        os.rmdir(root)
+                    except OSError:
+                        pass
+
+        stats.elapsed = time.perf_counter() - start
+        logging.info(f"Collected {stats}")
+        telemetry.record_collect(stats)
+        return stats
@@ -0,0 +1,220 @@
+import os
+from os.path import join as pjoin
+import json
+import hashlib
+import logging
+import shutil
+import stat
+import threading
+import time
+
+import checksums
+
+READ_ONLY = stat.S_IREAD | stat.S_IRGRP | stat.S_IROTH
+LIVE = (".evtx", ".etl") # written in place by the system, their mtime is only updated lazily
+
+def _unlink(path):
+    """removes a file, even a read-only one."""
+    try:
+        os.remove(path)
+    except PermissionError:
+        os.chmod(path, stat.S_IREAD | stat.S_IWRITE)
+        os.remove(path)
+
+class ContentStore(object):
+    def __init__(self, root, max_age_days=7, max_bytes=8 << 30, bufsize=8 << 20, live=LIVE):
+        r"""
+        Local content-addressed store of collected files.
+
+        Every copied file is stored once under objects/<hash>, and hardlinked
+        into the output directory. A source whose size and mtime did not change
+        since it was last stored is linked without being read again, except for
+        live files (e.g. event logs), whose mtime cannot be trusted: they are
+        stored again, and their hash compared, in one read.
+
+        The objects are read-only, so that a linked output cannot be changed
+        in place, and with it the stored copy. Their permission is the one of
+        the store directory, see permissions.py.
+
+        The store must be on the same volume as the output directories for
+        hardlinks to work, otherwise the files are copied from the store.
+
+        Args:
+            root (str): directory of the store.
+            max_age_days (float): objects unused for longer than this are evicted.
+            max_bytes (int): objects are evicted, least recently used first, above this total size.
+            bufsize (int): size of the read/write buffer.
+            live (tuple (str)): extensions of the live files.
+        """
+        self.root = os.path.abspath(root)
+        self.objects = pjoin(self.root, "objects")
+        self.index_path = pjoin(self.root, "index.json")
+        self.max_age = max_age_days * 86400
+        self.max_bytes = max_bytes
+        self.bufsize = bufsize
+        self.live = tuple(x.lower() for x in live)
+        self._lock = threading.Lock()
+        os.makedirs(self.objects, exist_ok=True)
+        try:
+            with open(self.index_path, "r", encoding="utf8") as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            index = {}
+        self.sources = index.get("sources", {}) # source path -> {size, mtime, hash}
+        self.used = index.get("used", {}) # hash -> last used time
+        self.hits = self.misses = 0
+
+    def _key(self, src):
+        return os.path.normcase(os.path.abspath(src))
+
+    def _object(self, digest):
+        return pjoin(self.objects, digest[:2], digest)
+
+    def _lookup(self, src, st):
+        """the record of src if it is unchanged since it was stored, and still in the store."""
+        with self._lock:
+            rec = self.sources.get(self._key(src))
+        if rec is None or rec["size"] != st.st_size or rec["mtime"] != st.st_mtime_ns:
+            return None
+        obj = self._object(rec["hash"])
+        try:
+            if os.path.getsize(obj) != st.st_size:
+                return None
+        except OSError:
+            return None
+        return rec
+
+    def _store(self, src, st, algorithm=None):
+        """copies src into the store while hashing it, returns its record."""
+        h = hashlib.blake2b(digest_size=20)
+        check = checksums.new(algorithm) if algorithm else None
+        tmp = pjoin(self.objects, f"tmp-{threading.get_ident()}-{time.time_ns()}")
+        with open(src, "rb") as fsrc, open(tmp, "wb") as fdst:
+            buf = bytearray(self.bufsize)
+            view = memoryview(buf)
+            while True:
+                k = fsrc.readinto(buf)
+                if not k:
+                    break
+                h.update(view[:k])
+                if check is not None:
+                    check.update(view[:k])
+                fdst.write(view[:k])
+        shutil.copystat(src, tmp)
+        digest = h.hexdigest()
+        obj = self._object(digest)
+        os.makedirs(os.path.dirname(obj), exist_ok=True)
+        if os.path.exists(obj):
+            os.remove(tmp) # same content from another source
+        else:
+            os.chmod(tmp, READ_ONLY)
+            try:
+                os.replace(tmp, obj)
+            except OSError:
+                # stored by another thread in the meantime, read-only so it cannot be replaced on Windows.
+                _unlink(tmp)
+                if not os.path.exists(obj):
+                    raise
+        rec = {"size": st.st_size, "mtime": st.st_mtime_ns, "hash": digest}
+        if check is not None:
+            rec["sums"] = {algorithm: check.hexdigest()} # for the checksums of the bundle
+        with self._lock:
+            self.sources[self._key(src)] = rec
+        return rec
+
+    def fetch(self, src, tgt, algorithm=None):
+        r"""Places the content of `src` at `tgt`, reusing the stored copy when
+        the source is unchanged.
+        Args:
+            algorithm (str): also hash the content with this checksums algorithm, while it is stored.
+        Returns:
+            (int, str): the number of bytes read from `src` to store it, and the
+                checksum of the content if it was asked for and is known.
+        """
+        st = os.stat(src)
+        rec = self._lookup(src, st)
+        nread = 0
+        if rec is not None and src.lower().endswith(self.live):
+            # the content is checked while it is stored again, in one read of the file.
+            old = rec["hash"]
+            rec = self._store(src, st, algorithm)
+            nread = st.st_size
+            if rec["hash"] == old:
+                self.hits += 1
+            else:
+                self.misses += 1
+                logging.info(f"\"{src}\" changed without its modification time, stored again.")
+        elif rec is None:
+            self.misses += 1
+            rec = self._store(src, st, algorithm)
+            nread = st.st_size
+        else:
+            self.hits += 1
+        digest = rec["hash"]
+        obj = self._object(digest)
+        if os.path.exists(tgt):
+            _unlink(tgt)
+        try:
+            os.link(obj, tgt)
+        except OSError:
+            # a writable copy, with the times of the source.
+            shutil.copyfile(obj, tgt)
+            ost = os.stat(obj)
+            os.utime(tgt, ns=(ost.st_atime_ns, ost.st_mtime_ns))
+        with self._lock:
+            self.used[digest] = time.time()
+        return nread, rec.get("sums", {}).get(algorithm)
+
+    def evict(self):
+        """Removes objects unused for longer than max_age, then the least recently used above max_bytes."""
+        now = time.time()
+        sizes = {}
+        for sub in os.listdir(self.objects):
+            d = pjoin(self.objects, sub)
+            if not os.path.isdir(d):
+                continue
+            for digest in os.listdir(d):
+                sizes[digest] = os.path.getsize(pjoin(d, digest))
+
+        order = sorted(sizes, key=lambda d: self.used.get(d, 0))
+        total = sum(sizes.values())
+        removed = set()
+        for digest in order:
+            if now - self.used.get(digest, 0) <= self.max_age and total <= self.max_bytes:
+                break
+            try:
+                _unlink(self._object(digest))
+            except OSError:
+                continue
+            total -= sizes[digest]
+            removed.add(digest)
+
+        live = set(sizes) - removed
+        with self._lock:
+            self.used = {d: t for d, t in self.used.items() if d in live}
+            self.sources = {k: v for k, v in self.sources.items() if v["hash"] in live}
+        logging.info(f"Content store: evicted {len(removed)} object(s), {total / (1 << 20):.1f} MB left.")
+
+    def save(self):
+        """Writes the index atomically."""
+        with self._lock:
+            index = {"sources": self.sources, "used": self.used}
+        tmp = self.index_path + ".tmp"
+        with open(tmp, "w", encoding="utf8") as f:
+            json.dump(index, f)
+        os.replace(tmp, self.index_path)
+        logging.info(f"Content store: {self.hits} hit(s), {self.misses} miss(es).")
+
+def open_store(config):
+    r"""Creates the content store from the [General] section of settings.ini, None if disabled.
+    - `Cache`: False to disable (default True).
+    - `CacheDir`: location of the store, on the same volume as the output (default .sitcache).
+    - `CacheMaxAgeDays`: evict objects unused for this many days (default 7).
+    - `CacheMaxMB`: evict least recently used objects above this size (default 8192).
+    """
+    general = config['General']
+    if not general.getboolean('Cache', fallback=True):
+        return None
+    return ContentStore(general.get('CacheDir', fallback=".sitcache"),
+        max_age_days=general.getfloat('CacheMaxAgeDays', fallback=7),
+        max_bytes=general.getint('CacheMaxMB', fallback=8192) << 20)
@@ -0,0 +1,451 @@
+r"""
+Streaming capture of a live memory dump, compressed while it is written.
+
+_LiveDumpFile.cmd writes memory.dmp, as large as the memory of the machine,
+to the NTFS_LIVEKD_MEMORY_DMP folder of a USB device. A DumpStream follows
+the file as it grows: each new segment is split into data and zero runs, the
+data is compressed by a pool of threads, and the records are written in
+order to `<name>.dmpz` in the output directory, split into volumes
+(.dmpz.001, .dmpz.002, ...) that fit on FAT32. The volumes are hashed as
+they are written, for the checksums of the bundle, and the dump itself is
+hashed as it is read. Once a segment is written its range of memory.dmp is
+deallocated (a sparse hole on NTFS), so the USB device only holds the part
+not compressed yet, and memory.dmp is deleted at the end.
+
+Dump writers fill in the header last, so the first HEADER bytes are only
+read once the dump is complete, and written as the last records. The rest
+must be appended: a dump that grows faster than APPEND_RATE was presized
+(e.g. SetEndOfFile to the size of the memory) and may be written in any
+order, so it is only read once complete, and nothing is deallocated.
+
+    python dumpstream.py memory.dmp.dmpz.001 -o memory.dmp
+
+rebuilds memory.dmp from the volumes (or checks them with --check).
+
+Format, little-endian: MAGIC, the length and the json of the header, then
+records of a type byte:
+- "D" offset (Q), length (I), compressed length (I), crc32 (I), data.
+- "Z" offset (Q), length (Q): zeros.
+- "E" size of the dump (Q), length and json of the trailer (digest, counts).
+"""
+import os
+import sys
+import json
+import time
+import zlib
+import struct
+import logging
+import argparse
+import importlib.util
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from lazyimport import lazy_import
+
+import checksums
+import progress
+from archiver import VolumeFile
+
+zstandard = lazy_import("zstandard") # optional, for LiveDumpMethod = zstd
+
+MAGIC = b"SITDUMP1"
+SEGMENT = 4 << 20 # bytes read and compressed at once
+BLOCK = 64 << 10 # granularity of the zero runs
+HEADER = 1 << 20 # read when the dump is complete
+APPEND_RATE = 4 << 30 # bytes per second, faster than a USB device: the dump was presized
+FAT32_VOLUME = (4 << 30) - (1 << 20)
+
+_DATA = struct.Struct("<QIII")
+_ZERO = struct.Struct("<QQ")
+_ZEROS = bytes(BLOCK)
+
+def _is_zero(block):
+    return block == _ZEROS[:len(block)]
+
+if os.name == "nt":
+    import ctypes
+    import msvcrt
+    from ctypes import wintypes
+
+    FSCTL_SET_SPARSE = 0x000900C4
+    FSCTL_SET_ZERO_DATA = 0x000980C8
+    _kernel32 = ctypes.WinDLL("kernel32", use_last_error=True)
+    _kernel32.DeviceIoControl.argtypes = [wintypes.HANDLE, wintypes.DWORD, ctypes.c_void_p, wintypes.DWORD,
+        ctypes.c_void_p, wintypes.DWORD, ctypes.POINTER(wintypes.DWORD), ctypes.c_void_p]
+    _kernel32.DeviceIoControl.restype = wintypes.BOOL
+else:
+    import ctypes
+
+    FALLOC_FL_KEEP_SIZE = 0x01
+    FALLOC_FL_PUNCH_HOLE = 0x02
+    _fallocate = getattr(ctypes.CDLL(None, use_errno=True), "fallocate", None)
+    if _fallocate is not None:
+        _fallocate.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_longlong, ctypes.c_longlong]
+
+class HolePuncher(object):
+    def __init__(self, f):
+        r"""
+        Deallocates ranges of the open file `f`, already read: FSCTL_SET_ZERO_DATA on a
+        sparse NTFS file, fallocate(PUNCH_HOLE) on Linux. Disabled after the first failure.
+        """
+        self.f = f
+        self.punched = 0
+        self.enabled = self._setup()
+
+    def _ioctl(self, code, buf=None):
+        handle = msvcrt.get_osfhandle(self.f.fileno())
+        returned = wintypes.DWORD()
+        size = len(buf) if buf is not None else 0
+        return bool(_kernel32.DeviceIoControl(handle, code, buf, size, None, 0, ctypes.byref(returned), None))
+
+    def _setup(self):
+        if os.name == "nt":
+            ok = self._ioctl(FSCTL_SET_SPARSE)
+            if not ok:
+                logging.warning(f"Cannot make the dump a sparse file (error {ctypes.get_last_error()}), "
+                    "it is kept in full until it is compressed.")
+            return ok
+        return _fallocate is not None
+
+    def punch(self, offset, length):
+        if not self.enabled or length <= 0:
+            return
+        if os.name == "nt":
+            ok = self._ioctl(FSCTL_SET_ZERO_DATA, struct.pack("<qq", offset, offset + length))
+            error = ctypes.get_last_error()
+        else:
+            ok = _fallocate(self.f.fileno(), FALLOC_FL_PUNCH_HOLE | FALLOC_FL_KEEP_SIZE, offset, length) == 0
+            error = ctypes.get_errno()
+        if not ok:
+            logging.warning(f"Cannot deallocate the compressed part of the dump (error {error}), "
+                "it is kept in full until it is compressed.")
+            self.enabled = False
+            return
+        self.punched += length
+
+class DumpStream(object):
+    def __init__(self, path, method="deflate", level=1, volume_size=FAT32_VOLUME, workers=None, algorithm=None):
+        r"""
+        Writer of a dump as zero runs and compressed records, see the module.
+        Args:
+            path (str): the output, e.g. <logdir>\memory.dmp.dmpz, or the prefix of its volumes.
+            method (str): "deflate" or "zstd".
+            level (int): compression level.
+            volume_size (int): split the output into volumes of this many bytes, 0 to disable.
+            workers (int): compression threads, defaults to the cpu count.
+            algorithm (str): checksum of the dump and of the volumes, one of checksums.SUMS, None to disable.
+        """
+        if method == "zstd" and importlib.util.find_spec("zstandard") is None:
+            logging.warning("zstandard is not installed, falling back to deflate.")
+            method = "deflate"
+        self.path = path
+        self.method = method
+        self.level = level
+        self.volume_size = volume_size
+        self.workers = workers or os.cpu_count() or 1
+        self.algorithm = algorithm
+        self.source = None # the dump followed
+        self.size = 0 # bytes of the dump
+        self.zero = 0 # bytes of zero runs
+        self.written = 0 # bytes of the output
+        self.records = 0
+        self.digest = None # of the dump, in the order of the records
+        self.digests = {} # volume -> checksum
+        self.volumes = []
+        self.complete = False
+        self.presized = False
+        self.punched = 0 # bytes deallocated from the dump
+        self._out = None
+        self._hash = None
+
+    def _open(self):
+        self._out = VolumeFile(self.path, self.volume_size, self.algorithm)
+        self._hash = checksums.new(self.algorithm) if self.algorithm else None
+        header = json.dumps({"name": os.path.basename(self.source), "method": self.method, "level": self.level,
+            "block": BLOCK, "algorithm": self.algorithm, "created": time.time()}).encode("utf8")
+        self._out.write(MAGIC + struct.pack("<I", len(header)) + header)
+
+    def _compress(self, data):
+        if self.method == "zstd":
+            return zstandard.ZstdCompressor(level=self.level).compress(data)
+        comp = zlib.compressobj(self.level, zlib.DEFLATED, -15)
+        return comp.compress(data) + comp.flush()
+
+    def encode(self, offset, data):
+        r"""The records of `data`, read at `offset` of the dump. Run by the compression threads.
+        Returns:
+            (bytes, int, int): the records, the bytes of zero runs and the number of records.
+        """
+        out = []
+        zero = 0
+        view = memoryview(data)
+        i = 0
+        while i < len(data):
+            j = i
+            empty = _is_zero(data[i:i + BLOCK])
+            while j < len(data) and _is_zero(data[j:j + BLOCK]) == empty:
+                j = min(j + BLOCK, len(data))
+            if empty:
+                out.append(b"Z" + _ZERO.pack(offset + i, j - i))
+                zero += j - i
+            else:
+                cdata = self._compress(view[i:j])
+                out.append(b"D" + _DATA.pack(offset + i, j - i, len(cdata), zlib.crc32(view[i:j])) + cdata)
+            i = j
+        return b"".join(out), zero, len(out)
+
+    def _write(self, data, records, zero, count):
+        self._out.write(records)
+        self.records += count
+        if self._hash is not None:
+            self._hash.update(data)
+        self.zero += zero
+        self.written = self._out.tell()
+        progress.record_bytes("copied", len(data))
+
+    def follow(self, locate, done, poll=0.5):
+        r"""Compresses the dump while it is written, until `done` is set and the dump is read to its end.
+        Args:
+            locate (callable): returns the path of the dump, None while it does not exist yet.
+            done (threading.Event): set when the writer of the dump exited.
+            poll (float): seconds between two checks of the size of the dump.
+        """
+        try:
+            self._follow(locate, done, poll)
+        except Exception:
+            if self.punched:
+                logging.exception(f"Live dump streaming failed, \"{self.path}\" is incomplete.")
+                return
+            # the dump is still whole on the device.
+            logging.exception(f"Live dump streaming failed, \"{self.source}\" is left as it is.")
+            self.discard()
+
+    def discard(self):
+        """Removes the output written so far."""
+        if self._out is None:
+            return
+        self._out.close()
+        for path in self._out.volumes:
+            try:
+                os.remove(path)
+            except OSError:
+                logging.exception(f"Cannot remove \"{path}\"")
+        self._out = None
+
+    def _flush(self, pending, puncher):
+        offset, data, future = pending.popleft()
+        self._write(data, *future.result())
+        if puncher is not None:
+            puncher.punch(offset, len(data))
+            self.punched = puncher.punched
+
+    def _follow(self, locate, done, poll):
+        start = time.perf_counter()
+        while self.source is None:
+            finished = done.is_set()
+            self.source = locate()
+            if self.source is None:
+                if finished:
+                    logging.error("No live dump was written.")
+                    return
+                done.wait(poll)
+        logging.info(f"Compressing \"{self.source}\" into \"{self.path}\" while it is written "
+            f"(method={self.method}, volume_size={self.volume_size}).")
+        try:
+            f = open(self.source, "r+b")
+        except OSError:
+            # the writer shares read access only.
+            f = open(self.source, "rb")
+            logging.warning("The dump cannot be deallocated while it is written, it is kept in full until it is compressed.")
+        with f:
+            puncher = HolePuncher(f) if "+" in f.mode else None
+            self._open()
+            pos = HEADER
+            last, seen = 0, time.perf_counter() # size of the dump at the last poll, and when
+            pending = deque() # (offset, data, future), in the order of the dump
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="livedump") as pool:
+                while True:
+                    finished = done.is_set()
+                    size = os.fstat(f.fileno()).st_size
+                    now = time.perf_counter()
+                    if pos > HEADER and size < pos:
+                        raise RuntimeError(f"\"{self.source}\" was truncated to {size} bytes while it was read.")
+                    if not self.presized and size - last > APPEND_RATE * max(now - seen, poll):
+                        self.presized = True
+                        puncher = None
+                        logging.warning(f"\"{self.source}\" grew to {size / (1 << 20):.1f} MB at once, it was presized: "
+                            "it is compressed once complete, and kept in full until then.")
+                    last, seen = size, now
+                    if self.presized and not finished:
+                        done.wait(poll)
+                        continue
+                    # while it is written, only whole segments, after the header.
+                    end = size if finished else size - size % SEGMENT
+                    while pos < end:
+                        f.seek(pos)
+                        data = f.read(min(SEGMENT, end - pos))
+                        if not data:
+                            break
+                        pending.append((pos, data, pool.submit(self.encode, pos, data)))
+                        pos += len(data)
+                        if len(pending) >= 2 * self.workers:
+                            self._flush(pending, puncher)
+                    while pending:
+                        self._flush(pending, puncher)
+                    if finished:
+                        break
+                    done.wait(poll)
+            # the header, filled in by the writer once the dump was complete.
+            f.seek(0)
+            data = f.read(min(HEADER, size))
+            self._write(data, *self.encode(0, data))
+            self.size = size
+        self._finish()
+        logging.info(f"Live dump of {self.size / (1 << 20):.1f} MB compressed to {self.written / (1 << 20):.1f} MB "
+            f"({self.zero / (1 << 20):.1f} MB of zeros, {self.punched / (1 << 20):.1f} MB deallocated while written) "
+            f"in {time.perf_counter() - start:.1f}s: {', '.join(self.volumes)}")
+
+    def _finish(self):
+        self.digest = self._hash.hexdigest() if self._hash is not None else None
+        trailer = json.dumps({"size": self.size, "records": self.records, "zero": self.zero, "algorithm": self.algorithm,
+            "digest": self.digest}).encode("utf8")
+        self._out.write(b"E" + struct.pack("<QI", self.size, len(trailer)) + trailer)
+        self._out.close()
+        self.written = self._out.tell()
+        self.volumes = list(self._out.volumes)
+        self.digests = {os.path.abspath(p): d for p, d in self._out.digests.items()}
+        self.complete = True
+
+class RestoreResult(object):
+    def __init__(self):
+        self.size = 0
+        self.records = 0
+        self.zero = 0
+        self.algorithm = None
+        self.expected = None
+        self.digest = None
+        self.errors = [] # (offset, message)
+        self.complete = False # the trailer was read
+        self.elapsed = 0.0
+
+    @property
+    def intact(self):
+        return self.complete and not self.errors and self.expected == self.digest
+
+    def __repr__(self):
+        state = "intact" if self.intact else "INCOMPLETE" if not self.complete else "CORRUPT"
+        return (f"<{state}: {self.size / (1 << 20):.1f} MB in {self.records} record(s), "
+            f"{self.zero / (1 << 20):.1f} MB of zeros, {self.algorithm} {self.digest}, {self.elapsed:.1f}s>")
+
+def _read(f, n):
+    data = f.read(n)
+    if len(data) != n:
+        raise EOFError("truncated")
+    return data
+
+def restore(path, out=None):
+    r"""Reads the dump written by a DumpStream, and rebuilds it.
+    Args:
+        path (str): the .dmpz file, or the prefix of its volumes.
+        out (str): the dump to write, None to only check the records.
+    Returns:
+        RestoreResult
+    """
+    start = time.perf_counter()
+    result = RestoreResult()
+    h = None
+    src = checksums.open_raw(path)
+    dst = open(out, "wb") if out is not None else None
+    try:
+        if _read(src, len(MAGIC)) != MAGIC:
+            raise ValueError(f"\"{path}\" is not a live dump stream.")
+        header = json.loads(_read(src, struct.unpack("<I", _read(src, 4))[0]))
+        result.algorithm = header.get("algorithm")
+        h = checksums.new(result.algorithm) if result.algorithm else None
+        if header["method"] == "zstd":
+            decompress = lambda cdata, n: zstandard.ZstdDecompressor().decompress(cdata, max_output_size=n)
+        else:
+            decompress = lambda cdata, n: zlib.decompress(cdata, -15)
+        while True:
+            kind = src.read(1)
+            if kind == b"D":
+                offset, n, clen, crc = _DATA.unpack(_read(src, _DATA.size))
+                data = decompress(_read(src, clen), n)
+                if len(data) != n or zlib.crc32(data) != crc:
+                    result.errors.append((offset, "crc mismatch"))
+                if h is not None:
+                    h.update(data)
+                if dst is not None:
+                    dst.seek(offset)
+                    dst.write(data)
+            elif kind == b"Z":
+                offset, n = _ZERO.unpack(_read(src, _ZERO.size))
+                result.zero += n
+                if h is not None:
+                    for i in range(0, n, BLOCK):
+                        h.update(_ZEROS[:min(BLOCK, n - i)])
+            elif kind == b"E":
+                result.size, n = struct.unpack("<QI", _read(src, 12))
+                trailer = json.loads(_read(src, n))
+                result.expected = trailer.get("digest")
+                result.complete = True
+                break
+            elif not kind:
+                break
+            else:
+                result.errors.append((src.tell() - 1, f"unknown record {kind!r}"))
+                break
+            result.records += 1
+    except (EOFError, zlib.error) as e:
+        result.errors.append((None, str(e)))
+    finally:
+        if dst is not None:
+            if result.complete:
+                # zero runs at the end are not written.
+                dst.truncate(result.size)
+            dst.close()
+        src.close()
+    result.digest = h.hexdigest() if h is not None else None
+    result.elapsed = time.perf_counter() - start
+    return result
+
+def dump_options(config):
+    r"""Options of the live dump, from the [General] section of settings.ini.
+    - `LiveDumpStream`: `False` to keep the plain memory.dmp on the USB device (default `True`).
+    - `LiveDumpMethod`: deflate (default) or zstd.
+    - `LiveDumpLevel`: compression level (default 1 for deflate, 3 for zstd).
+    - `LiveDumpVolumeMB`: split the output into volumes of this size (default 4095, for FAT32), 0 to disable.
+    - `LiveDumpWorkers`: compression threads, 0 for the cpu count.
+    - `Checksum`: checksum of the dump and its volumes, see checksums.algorithm.
+    """
+    general = config['General']
+    method = general.get('LiveDumpMethod', fallback="deflate").lower()
+    return {
+        "stream": general.getboolean('LiveDumpStream', fallback=True),
+        "method": method,
+        "level": general.getint('LiveDumpLevel', fallback=3 if method == "zstd" else 1),
+        "volume_size": general.getint('LiveDumpVolumeMB', fallback=FAT32_VOLUME >> 20) << 20,
+        "workers": general.getint('LiveDumpWorkers', fallback=0) or None,
+        "algorithm": checksums.algorithm(config),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuilds a live dump compressed by SIT (memory.dmp.dmpz).")
+    parser.add_argument("stream", help="the .dmpz file, or its first volume")
+    parser.add_argument("-o", "--output", help="the dump to write (default: the name without .dmpz)")
+    parser.add_argument("--check", action="store_true", help="only check the records and the checksum")
+    args = parser.parse_args()
+
+    path = args.stream
+    if path.endswith(".001") and not os.path.isfile(path[:-4]):
+        path = path[:-4]
+    out = None if args.check else args.output or (path[:-5] if path.endswith(".dmpz") else path + ".dmp")
+    result = restore(path, out)
+    for offset, message in result.errors:
+        print(f"ERROR at {offset}: {message}")
+    if result.complete and result.expected != result.digest:
+        print(f"CHECKSUM MISMATCH: {result.digest} instead of {result.expected}")
+    print(f"{args.stream}: {result}" + (f" -> {out}" if out is not None else ""))
+    sys.exit(0 if result.intact else 1)
+
+if __name__ == "__main__":
+    main()
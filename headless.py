@@ -0,0 +1,192 @@
+r"""
+Headless entry point: runs a collection without the GUI, for test automation.
+
+    python headless.py --oem OEM --project PROJ --issue "Graphics related"
+    python headless.py --oem OEM --project PROJ --ingredients 3 16 "Idle ETL"
+    python headless.py --job job.json --result result.json
+
+Prompts are answered from `--answer KEY=VALUE` or the "answers" of the job
+file; unanswered questions are answered "no". Known keys:
+- `highloading.timeout`: timeout (sec) of "High Loading Activities".
+- `display.duration`, `acpi2.duration`, `tbt.duration`, `video.duration`: seconds to trace before stopping (default `--wait`).
+- `open_folder`: open the output directory in explorer when done.
+- `reset.confirm`: confirm the registry reset of `--reset`.
+- `stop_boot`: the active boot traces to stop, a list of names or true for all (`--stop-boot-traces`).
+  Each can also be answered by `stop_boot.<trace name>`.
+- `resume`: resume the runs that did not finish (`--resume`), declining discards their journal.
+  Unfinished runs are left alone without `--resume`.
+
+A job file holds the same settings as the arguments, e.g.
+    {"oem": "OEM", "project": "PROJ", "issue": "Graphics related",
+     "ingredients": [6, "Idle ETL"], "answers": {"display.duration": 120},
+     "wait": 60, "stop_boot_traces": false, "resume": false, "result": "result.json"}
+
+The result is printed to stdout as json, and written to `--result` if given.
+Exit code: 0 all ingredients succeeded, 1 some failed, 2 bad arguments, 3 cancelled, 4 unexpected error
+(the result has status "error" and the error).
+"""
+import os
+import sys
+import json
+import signal
+import logging
+import argparse
+import threading
+
+import UI
+import sitlog
+import uiconfig
+import statestore
+from prompts import ScriptedPrompts
+
+def find_ingredient(value):
+    """ingredient dict from its id or name (case insensitive)."""
+    for name, conf in uiconfig.INGREDIENTS.items():
+        if str(conf["id"]) == str(value) or name.lower() == str(value).lower():
+            return name, conf
+    raise ValueError(f"Unknown ingredient \"{value}\".")
+
+def build_queue(issue=None, ingredients=None):
+    r"""The ingredients to run, in the given order.
+    Args:
+        issue (str): issue type, its default ingredients are used when `ingredients` is empty.
+        ingredients (list): ingredient ids or names.
+    """
+    if not ingredients:
+        if issue not in uiconfig.ISSUETYPES:
+            raise ValueError(f"Unknown issue type \"{issue}\", one of: {', '.join(uiconfig.ISSUETYPES)}.")
+        ingredients = uiconfig.ISSUETYPES[issue]["default"]
+    queue = []
+    for value in ingredients:
+        name, conf = find_ingredient(value)
+        if conf["id"] not in uiconfig.AVAILABLE:
+            raise ValueError(f"Ingredient \"{name}\" is not available.")
+        if conf not in queue:
+            queue.append(conf)
+    return queue
+
+def load_job(args):
+    """merges the job file with the arguments, arguments first."""
+    job = {}
+    if args.job:
+        with open(args.job, "r", encoding="utf8") as f:
+            job = json.load(f)
+    answers = dict(job.get("answers", {}))
+    for a in args.answer:
+        key, sep, value = a.partition("=")
+        if not sep:
+            raise ValueError(f"--answer expects KEY=VALUE, got \"{a}\".")
+        answers[key] = value
+    return {
+        "oem": args.oem or job.get("oem", ""),
+        "project": args.project or job.get("project", ""),
+        "issue": args.issue or job.get("issue"),
+        "ingredients": args.ingredients or job.get("ingredients", []),
+        "answers": answers,
+        "wait": args.wait if args.wait is not None else job.get("wait", 60),
+        "reset": args.reset or job.get("reset", False),
+        "stop_boot_traces": args.stop_boot_traces or job.get("stop_boot_traces", False),
+        "resume": args.resume or job.get("resume", False),
+        "result": args.result or job.get("result"),
+    }
+
+def write_result(result, path=None):
+    text = json.dumps(result, indent=2)
+    print(text)
+    if path:
+        with open(path, "w", encoding="utf8") as f:
+            f.write(text)
+
+def run(job, cancel):
+    """Runs the job. Returns the result dict."""
+    prompts = ScriptedPrompts(job["answers"], wait=float(job["wait"]), cancel=cancel)
+    result = {"status": "ok", "customer": None, "logdir": None, "archive": [], "reboot": False,
+        "ingredients": [], "boot_traces": [], "resumed": [], "prompts": prompts.history}
+
+    config = UI.load_config()
+    if 'debug' in config['General']:
+        UI.resrc_path = os.path.join(os.path.abspath(os.path.dirname(__file__)), "dist", "resource")
+
+    if job["reset"]:
+        UI.execute("", [], reset=True, prompts=prompts)
+        return result
+
+    boottraces = statestore.get_store().active_boot_traces()
+    if boottraces:
+        result["boot_traces"] = [b.as_dict() for b in boottraces]
+        if job["stop_boot_traces"]:
+            prompts.answers.setdefault("stop_boot", True)
+        UI.handle_boot_traces(boottraces, prompts=prompts)
+
+    if job["resume"]:
+        prompts.answers.setdefault("resume", True)
+        for summary in UI.resume_unfinished(prompts=prompts):
+            result["resumed"].append({"logdir": summary["logdir"], "archive": summary["archive"],
+                "ingredients": [r.as_dict() for r in summary["results"]]})
+            if any(not r.ok for r in summary["results"]):
+                result["status"] = "failed"
+
+    if not job["issue"] and not job["ingredients"]:
+        return result
+    if not job["oem"] or not job["project"]:
+        raise ValueError("--oem and --project are required to collect.")
+    queue = build_queue(job["issue"], job["ingredients"])
+    result["customer"] = job["oem"] + "-" + job["project"]
+    logging.info(f"Customer name: {result['customer']}")
+    logging.info(f"Pending trace(s): {queue}")
+
+    summary = UI.execute(result["customer"], queue, cancel=cancel, prompts=prompts)
+    result["logdir"] = summary["logdir"]
+    result["archive"] = summary["archive"]
+    result["reboot"] = summary["reboot"]
+    result["ingredients"] = [r.as_dict() for r in summary["results"]]
+    if any(not r.ok for r in summary["results"]):
+        result["status"] = "failed"
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description="Runs a SIT collection without the GUI.",
+        epilog="See the top of headless.py for the prompt keys and the job file format.")
+    parser.add_argument("--job", help="json job file")
+    parser.add_argument("--oem", help="OEM name")
+    parser.add_argument("--project", help="project name")
+    parser.add_argument("--issue", help="issue type, runs its default ingredients")
+    parser.add_argument("--ingredients", nargs="+", default=[], help="ingredient ids or names")
+    parser.add_argument("--answer", action="append", default=[], metavar="KEY=VALUE", help="answer to a prompt")
+    parser.add_argument("--wait", type=float, help="seconds to trace for unanswered \"press OK to stop\" prompts (default 60)")
+    parser.add_argument("--reset", action="store_true", help="reset the registry keys modified by SIT")
+    parser.add_argument("--stop-boot-traces", action="store_true", help="stop and collect the active boot traces")
+    parser.add_argument("--resume", action="store_true", help="resume the runs that crashed or hung before they finished")
+    parser.add_argument("--result", help="also write the result json to this file")
+    args = parser.parse_args()
+
+    sitlog.setup(codec=UI._codec, config=UI.load_config())
+
+    try:
+        job = load_job(args)
+    except (OSError, ValueError) as e:
+        write_result({"status": "error", "error": str(e)}, args.result)
+        sys.exit(2)
+
+    # Ctrl+C kills the running commands, and skips the remaining ingredients.
+    cancel = threading.Event()
+    signal.signal(signal.SIGINT, lambda signum, frame: cancel.set())
+
+    try:
+        result = run(job, cancel)
+    except ValueError as e:
+        logging.error(str(e))
+        write_result({"status": "error", "error": str(e)}, job["result"])
+        sys.exit(2)
+    except Exception as e:
+        # still a result for the harness, e.g. an OSError or a KeyError from a bad ingredient.
+        logging.exception("Headless run failed.")
+        write_result({"status": "error", "error": repr(e)}, job["result"])
+        sys.exit(4)
+    if cancel.is_set():
+        result["status"] = "cancelled"
+    write_result(result, job["result"])
+    sys.exit({"ok": 0, "failed": 1, "cancelled": 3}[result["status"]])
+
+if __name__ == "__main__":
+    main()
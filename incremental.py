@@ -0,0 +1,207 @@
+r"""
+Incremental collection of event logs (winevt\Logs).
+
+For every file, the size, mtime, a hash of the header and a hash of the last
+block collected are recorded as a watermark. On the next run:
+- a file with the same watermark is not collected again. The header hash
+  catches a log that wrapped around at its maximum size: its new chunks are
+  written in the middle of the file, with the size, the last block and
+  (updated lazily) the mtime all left as they were.
+- a file that grew, with its last collected block unchanged, only gets the
+  appended range collected, plus its header (rewritten on every append).
+- any other file is collected in full.
+
+Each output directory gets an `eventlogs.json` manifest listing, per file,
+the parts (bundle, path, offset, length) it is rebuilt from, oldest first.
+`python incremental.py <manifest> <bundles dir> <output dir>` rebuilds the
+full set from the extracted bundles.
+
+The watermarks of a run are only kept once its bundle is complete (see
+`commit`), a failed or cancelled run is collected again from the last
+committed ones.
+"""
+import os
+from os.path import join as pjoin
+import sys
+import json
+import hashlib
+import logging
+import shutil
+import threading
+
+HEAD = 4096 # evtx file header, rewritten when chunks are appended
+BLOCK = 65536 # evtx chunk size, used as the checkpoint
+MAX_PARTS = 24 # collect in full when a file has been pieced together from this many parts
+COPY = 8 << 20
+
+def _checkpoint(path, size):
+    """hash of the block ending at `size`."""
+    start = max(HEAD, size - BLOCK) if size > HEAD else 0
+    with open(path, "rb") as f:
+        f.seek(start)
+        return hashlib.blake2b(f.read(size - start), digest_size=16).hexdigest()
+
+def _header(path):
+    """hash of the header, rewritten on every chunk written."""
+    with open(path, "rb") as f:
+        return hashlib.blake2b(f.read(HEAD), digest_size=16).hexdigest()
+
+def _copy_range(src, tgt, offset, length):
+    with open(src, "rb") as fsrc, open(tgt, "wb") as fdst:
+        fsrc.seek(offset)
+        left = length
+        while left > 0:
+            chunk = fsrc.read(min(COPY, left))
+            if not chunk:
+                break
+            fdst.write(chunk)
+            left -= len(chunk)
+
+class EventLogTracker(object):
+    def __init__(self, state_path="eventlog_state.json"):
+        r"""
+        Keeps the per-file watermarks of incrementally collected directories.
+        Args:
+            state_path (str): where the watermarks are stored between runs.
+        """
+        self.state_path = state_path
+        self.pending = {} # srcdir -> watermarks collected in this run, not committed yet
+        self._lock = threading.Lock()
+        try:
+            with open(state_path, "r", encoding="utf8") as f:
+                self.state = json.load(f)
+        except (OSError, ValueError):
+            self.state = {}
+
+    def save(self):
+        with self._lock:
+            tmp = self.state_path + ".tmp"
+            with open(tmp, "w", encoding="utf8") as f:
+                json.dump(self.state, f)
+            os.replace(tmp, self.state_path)
+
+    def commit(self):
+        """Keeps the watermarks of this run, once its bundle is complete."""
+        with self._lock:
+            if not self.pending:
+                return
+            self.state.update(self.pending)
+            self.pending = {}
+        self.save()
+
+    def collect(self, srcdir, tgtdir, bundle, collector=None):
+        r"""Collects what changed in `srcdir` since the last run into `tgtdir`.
+        Args:
+            srcdir (str): the event log directory.
+            tgtdir (str): target directory inside the output directory.
+            bundle (str): the output directory, parts are recorded relative to its parent.
+            collector (Collector): copies the files, with its hashing, journal and progress.
+        Returns:
+            the number of bytes collected.
+        """
+        key = os.path.normcase(os.path.abspath(srcdir))
+        with self._lock:
+            marks = dict(self.state.get(key, {}))
+        os.makedirs(tgtdir, exist_ok=True)
+        root = os.path.dirname(os.path.abspath(bundle))
+        manifest = {}
+        copies = [] # (rel, src, tgt) collected in full, all at once by the collector
+        total = full = partial = same = 0
+
+        for dirpath, dirs, files in os.walk(srcdir):
+            for name in files:
+                src = pjoin(dirpath, name)
+                rel = os.path.relpath(src, srcdir)
+                tgt = pjoin(tgtdir, rel)
+                try:
+                    st = os.stat(src)
+                    size = st.st_size
+                    mark = marks.get(rel)
+                    if (mark and mark["size"] == size and mark["mtime"] == st.st_mtime_ns
+                            and mark.get("header") == _header(src)
+                            and mark["checkpoint"] == _checkpoint(src, size)):
+                        same += 1
+                        manifest[rel] = {"size": size, "parts": mark["parts"]}
+                        continue
+
+                    os.makedirs(os.path.dirname(tgt), exist_ok=True)
+                    parts = []
+                    if (mark and size > mark["size"] > HEAD and len(mark["parts"]) < MAX_PARTS
+                            and mark["checkpoint"] == _checkpoint(src, mark["size"])):
+                        # appended: collect the header and the new range only.
+                        offset = mark["size"]
+                        copy_range = collector.copyrange if collector is not None else _copy_range
+                        copy_range(src, f"{tgt}.@0", 0, HEAD)
+                        copy_range(src, f"{tgt}.@{offset}", offset, size - offset)
+                        parts = list(mark["parts"])
+                        parts.append({"path": os.path.relpath(f"{tgt}.@{offset}", root), "offset": offset, "length": size - offset})
+                        parts.append({"path": os.path.relpath(f"{tgt}.@0", root), "offset": 0, "length": HEAD})
+                        total += HEAD + size - offset
+                        partial += 1
+                    elif collector is not None:
+                        copies.append((rel, src, tgt))
+                        parts = [{"path": os.path.relpath(tgt, root), "offset": 0, "length": size}]
+                        total += size
+                        full += 1
+                    else:
+                        shutil.copy2(src, tgt)
+                        parts = [{"path": os.path.relpath(tgt, root), "offset": 0, "length": size}]
+                        total += size
+                        full += 1
+
+                    manifest[rel] = {"size": size, "parts": parts}
+                    marks[rel] = {"size": size, "mtime": st.st_mtime_ns, "offset": size,
+                        "checkpoint": _checkpoint(src, size), "header": _header(src), "parts": parts}
+                except Exception:
+                    logging.exception(f"Exception occurred while collecting \"{src}\"")
+
+        if copies:
+            collector.collect([(src, tgt) for rel, src, tgt in copies], "eventlogs")
+            for rel, src, tgt in copies:
+                if not os.path.isfile(tgt):
+                    # failed, logged by the collector: keep the last watermark, without it in the manifest.
+                    manifest.pop(rel, None)
+                    if key in self.state and rel in self.state[key]:
+                        marks[rel] = self.state[key][rel]
+                    else:
+                        marks.pop(rel, None)
+
+        with self._lock:
+            self.pending[key] = marks
+
+        with open(pjoin(tgtdir, "eventlogs.json"), "w", encoding="utf8") as f:
+            json.dump({"source": srcdir, "files": manifest}, f, indent=2)
+        logging.info(f"Incremental collection of \"{srcdir}\": {full} full, {partial} appended, "
+            f"{same} unchanged, {total / (1 << 20):.1f} MB collected.")
+        return total
+
+def rebuild(manifest, bundles, outdir):
+    r"""Rebuilds the full event logs of `manifest` from the extracted bundles.
+    Args:
+        manifest (str): an eventlogs.json file.
+        bundles (str): directory holding the extracted output directories of earlier runs.
+        outdir (str): directory to write the event logs into.
+    """
+    with open(manifest, "r", encoding="utf8") as f:
+        files = json.load(f)["files"]
+    for rel, entry in files.items():
+        tgt = pjoin(outdir, rel)
+        os.makedirs(os.path.dirname(tgt), exist_ok=True)
+        with open(tgt, "wb") as fdst:
+            fdst.truncate(entry["size"])
+            for part in entry["parts"]:
+                src = pjoin(bundles, part["path"])
+                if not os.path.isfile(src):
+                    logging.error(f"Missing part \"{src}\" of \"{rel}\".")
+                    continue
+                fdst.seek(part["offset"])
+                with open(src, "rb") as fsrc:
+                    shutil.copyfileobj(fsrc, fdst, COPY)
+    logging.info(f"Rebuilt {len(files)} file(s) at \"{outdir}\".")
+
+if __name__ == "__main__":
+    logging.basicConfig(format='%(asctime)s [%(levelname)s] %(message)s', level=logging.INFO)
+    if len(sys.argv) != 4:
+        print("usage: python incremental.py <eventlogs.json> <bundles dir> <output dir>")
+        sys.exit(1)
+    rebuild(*sys.argv[1:])
@@ -0,0 +1,199 @@
+r"""
+Write-ahead journal of a collection, for resuming it after a crash or a hang.
+
+Every output directory being collected holds `.sitjournal`, one json record
+per line, appended before moving on:
+- `begin`: customer, timestamp of the directory, and the queued ingredient ids.
+- `start`/`done`: an ingredient started, and whether it succeeded.
+- `file`: a file copied completely into the output directory.
+- `chunk`: a large copy reached `offset`, its bytes up to there are on disk.
+- `finish`: the run is complete, the journal is then deleted.
+
+Records are flushed when written, so they survive a crash of the tool. They
+are synced to disk at the ingredient boundaries and at most every
+`sync_interval` seconds otherwise: a power loss or a hard hang can only lose
+the last moment of work, which is then done again.
+
+On the next launch find_unfinished() lists the directories with a journal.
+Resuming one runs only the ingredients that did not succeed, skips the files
+already copied, and continues interrupted copies from their last chunk.
+"""
+import os
+from os.path import join as pjoin
+import json
+import glob
+import time
+import logging
+import threading
+
+NAME = ".sitjournal"
+CHUNK_BYTES = 64 << 20 # a `chunk` record every this many bytes of a copy
+
+class Journal(object):
+    def __init__(self, logdir, sync_interval=1.0):
+        r"""
+        Journal of the output directory `logdir`, loaded if it exists.
+        Args:
+            logdir (str): the output directory.
+            sync_interval (float): seconds between two syncs to disk of the records.
+        """
+        self.logdir = os.path.abspath(logdir)
+        self.path = pjoin(self.logdir, NAME)
+        self.sync_interval = sync_interval
+        self.customer = None
+        self.time = None
+        self.queue = [] # ingredient ids, in order
+        self.done = {} # ingredient id -> succeeded
+        self.files = {} # (src, tgt) -> (size, mtime_ns) of the source when copied
+        self.chunks = {} # tgt -> (src, size, mtime_ns, offset)
+        self.finished = False
+        self._lock = threading.Lock()
+        self._f = None
+        self._synced = 0.0
+        if os.path.isfile(self.path):
+            self._load()
+
+    def _load(self):
+        with open(self.path, "r", encoding="utf8") as f:
+            for line in f:
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    break # the last record, cut by the crash
+                self._apply(rec)
+
+    def _apply(self, rec):
+        op = rec["op"]
+        if op == "begin":
+            self.customer, self.time, self.queue = rec["customer"], rec["time"], rec["queue"]
+        elif op == "done":
+            self.done[rec["id"]] = rec["ok"]
+        elif op == "file":
+            self.files[(rec["src"], rec["tgt"])] = (rec["size"], rec["mtime"])
+            self.chunks.pop(rec["tgt"], None)
+        elif op == "chunk":
+            self.chunks[rec["tgt"]] = (rec["src"], rec["size"], rec["mtime"], rec["offset"])
+        elif op == "finish":
+            self.finished = True
+
+    def _append(self, rec, sync=False):
+        with self._lock:
+            self._apply(rec)
+            if self._f is None:
+                os.makedirs(self.logdir, exist_ok=True)
+                self._f = open(self.path, "a", encoding="utf8")
+            self._f.write(json.dumps(rec) + "\n")
+            self._f.flush()
+            now = time.monotonic()
+            if sync or now - self._synced > self.sync_interval:
+                os.fsync(self._f.fileno())
+                self._synced = now
+
+    def begin(self, customer, timestamp, queue):
+        r"""Records a new run.
+        Args:
+            customer (str): customer name of the output directory.
+            timestamp (str): datetime string of the output directory.
+            queue (list (int)): ids of the queued ingredients.
+        """
+        self._append({"op": "begin", "customer": customer, "time": timestamp, "queue": list(queue),
+            "started": time.strftime("%Y-%m-%d %H:%M:%S")}, sync=True)
+
+    def start(self, id):
+        self._append({"op": "start", "id": id})
+
+    def finish_ingredient(self, id, ok):
+        self._append({"op": "done", "id": id, "ok": bool(ok)}, sync=True)
+
+    def remaining(self):
+        """ids of the queued ingredients that did not succeed, in order."""
+        return [i for i in self.queue if not self.done.get(i)]
+
+    def _stat(self, src):
+        st = os.stat(src)
+        return st.st_size, st.st_mtime_ns
+
+    def file(self, src, tgt):
+        """Records a completely copied file."""
+        try:
+            size, mtime = self._stat(src)
+        except OSError:
+            return # moved, nothing to skip next time
+        self._append({"op": "file", "src": os.path.abspath(src), "tgt": os.path.abspath(tgt),
+            "size": size, "mtime": mtime})
+
+    def chunk(self, src, tgt, offset):
+        """Records that the first `offset` bytes of a copy are on disk (the caller synced them)."""
+        size, mtime = self._stat(src)
+        self._append({"op": "chunk", "src": os.path.abspath(src), "tgt": os.path.abspath(tgt),
+            "size": size, "mtime": mtime, "offset": offset})
+
+    def collected(self, src, tgt):
+        """True if `src` was already copied to `tgt`, and neither changed since."""
+        rec = self.files.get((os.path.abspath(src), os.path.abspath(tgt)))
+        if rec is None:
+            return False
+        try:
+            return self._stat(src) == rec and os.path.getsize(tgt) == rec[0]
+        except OSError:
+            return False
+
+    def resume_offset(self, src, tgt):
+        """Where an interrupted copy of `src` to `tgt` can continue, 0 to copy it again."""
+        rec = self.chunks.get(os.path.abspath(tgt))
+        if rec is None or rec[0] != os.path.abspath(src):
+            return 0
+        try:
+            if self._stat(src) != rec[1:3] or os.path.getsize(tgt) < rec[3]:
+                return 0
+        except OSError:
+            return 0
+        return rec[3]
+
+    def finish(self):
+        """The run is complete: nothing to resume, the journal is deleted."""
+        with self._lock:
+            self.finished = True
+            if self._f is not None:
+                self._f.close()
+                self._f = None
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+    def close(self):
+        with self._lock:
+            if self._f is not None:
+                self._f.close()
+                self._f = None
+
+    def __repr__(self):
+        return (f"<Journal {self.logdir}: {len(self.done)} of {len(self.queue)} ingredient(s) done, "
+            f"{len(self.files)} file(s) copied>")
+
+def find_unfinished(root="."):
+    """Journals of the unfinished runs in the output directories under `root`, oldest first."""
+    found = []
+    for path in glob.glob(pjoin(glob.escape(os.path.abspath(root)), "*", NAME)):
+        try:
+            j = Journal(os.path.dirname(path))
+        except (OSError, KeyError):
+            logging.exception(f"Cannot read the journal \"{path}\", ignoring it.")
+            continue
+        if j.customer is not None and not j.finished:
+            found.append(j)
+    return sorted(found, key=lambda j: os.path.getmtime(j.path))
+
+def discard(j):
+    """Forgets an unfinished run that the user does not want to resume."""
+    logging.info(f"Discarding the journal of \"{j.logdir}\".")
+    j.finish()
+
+def open_journal(logdir, config):
+    r"""Creates the journal of `logdir` from the [General] section of settings.ini, None if disabled.
+    - `Journal`: False to disable (default True).
+    """
+    if not config['General'].getboolean('Journal', fallback=True):
+        return None
+    return Journal(logdir)
@@ -0,0 +1,39 @@
+import importlib
+import threading
+import types
+
+class LazyModule(types.ModuleType):
+    """
+    Placeholder for a module that is imported on first attribute access.
+    Used for heavy or rarely needed modules (PIL, psutil, winreg, ...) so that
+    they do not slow down the startup of the tool.
+    """
+    _lock = threading.Lock()
+
+    def __init__(self, name):
+        super().__init__(name)
+        self.__dict__["_lazy_module"] = None
+
+    def _load(self):
+        module = self.__dict__["_lazy_module"]
+        if module is None:
+            with LazyModule._lock:
+                module = self.__dict__["_lazy_module"]
+                if module is None:
+                    module = importlib.import_module(self.__name__)
+                    self.__dict__["_lazy_module"] = module
+        return module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __dir__(self):
+        return dir(self._load())
+
+    def __repr__(self):
+        state = "loaded" if self.__dict__["_lazy_module"] is not None else "not loaded"
+        return f"<lazy module '{self.__name__}' ({state})>"
+
+def lazy_import(name):
+    """Returns a module that is only imported when one of its attributes is used."""
+    return LazyModule(name)
@@ -0,0 +1,162 @@
+r"""
+Access to the output directory for everyone.
+
+The output directory is given one inheritable ACL when the run starts
+(prepare), so every file and directory created in it, by SIT or by the
+tools, can be opened by everyone without a pass over the tree afterwards.
+Only what keeps its own ACL has to be fixed: files and directories moved in
+from elsewhere on the same volume. The Collector adds them to a
+PermissionFixer, which resets them to the inherited ACL in batches, in
+parallel, at the end of the run. Files hardlinked from the content store
+share the ACL of the stored copy, so the store directory is prepared like
+the output directory instead of fixing them (which would change the store).
+
+The work is done by a backend: IcaclsBackend on Windows, PosixBackend
+elsewhere (e.g. on the simulated machine of bench_traces.py), which only
+changes the mode bits and records the batches it was given.
+"""
+import os
+from os.path import join as pjoin
+import logging
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+class PermissionBackend(object):
+    def prepare(self, root):
+        """Lets everyone access everything created under `root` from now on."""
+        raise NotImplementedError
+
+    def fix(self, files, trees):
+        r"""Resets the permission of paths to the one inherited from their parent.
+        Args:
+            files (list (str)): files.
+            trees (list (str)): directories, with everything under them.
+        """
+        raise NotImplementedError
+
+    def batches(self, files):
+        """splits the files to fix into the batches given to fix()."""
+        for i in range(0, len(files), 256):
+            yield files[i:i + 256]
+
+class IcaclsBackend(PermissionBackend):
+    GRANT = "everyone:(OI)(CI)F"
+    MAX_CHARS = 24000 # of the paths of one icacls command line, below the 32767 of CreateProcess
+
+    def _icacls(self, paths, *args):
+        cmd = ["icacls", *paths, *args]
+        proc = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+            creationflags=getattr(subprocess, "CREATE_NO_WINDOW", 0))
+        if proc.returncode != 0:
+            logging.warning(f"icacls {' '.join(args)} returned {proc.returncode} for {len(paths)} path(s): "
+                f"{proc.stdout.decode('utf8', 'replace').strip()}")
+
+    def prepare(self, root):
+        self._icacls([root], "/grant:r", self.GRANT, "/q")
+
+    def fix(self, files, trees):
+        if files:
+            self._icacls(files, "/reset", "/c", "/q")
+        for tree in trees:
+            self._icacls([tree], "/reset", "/t", "/c", "/q")
+
+    def batches(self, files):
+        """splits the files so that each icacls command line stays short enough."""
+        batch, chars = [], 0
+        for p in files:
+            if batch and chars + len(p) + 3 > self.MAX_CHARS:
+                yield batch
+                batch, chars = [], 0
+            batch.append(p)
+            chars += len(p) + 3
+        if batch:
+            yield batch
+
+class PosixBackend(PermissionBackend):
+    def __init__(self):
+        r"""
+        Mode bits instead of ACLs, for running outside of Windows. The calls
+        are kept in `prepared` and `fixed` (one (files, trees) per batch).
+        """
+        self.prepared = []
+        self.fixed = []
+        self._lock = threading.Lock()
+
+    def prepare(self, root):
+        os.chmod(root, 0o777)
+        with self._lock:
+            self.prepared.append(root)
+
+    def _open(self, path):
+        try:
+            os.chmod(path, 0o777 if os.path.isdir(path) else 0o666)
+        except OSError as e:
+            logging.warning(f"Cannot change the permission of \"{path}\": {e}")
+
+    def fix(self, files, trees):
+        for f in files:
+            self._open(f)
+        for tree in trees:
+            for root, dirs, names in os.walk(tree):
+                self._open(root)
+                for name in names:
+                    self._open(pjoin(root, name))
+        with self._lock:
+            self.fixed.append((list(files), list(trees)))
+
+class PermissionFixer(object):
+    def __init__(self, root, backend=None, workers=4):
+        r"""
+        Collects the paths placed under `root` that keep their own permission,
+        and resets them all in fix().
+        Args:
+            root (str): the output directory, prepared right away.
+            backend (PermissionBackend): defaults to icacls on Windows, mode bits elsewhere.
+            workers (int): number of batches fixed at the same time.
+        """
+        self.root = os.path.abspath(root)
+        self.backend = backend if backend is not None else default_backend()
+        self.workers = workers
+        self.pending = set()
+        self._lock = threading.Lock()
+        os.makedirs(self.root, exist_ok=True)
+        self.backend.prepare(self.root)
+
+    def add(self, path):
+        """`path` was moved or linked in, and kept the permission it had (thread safe)."""
+        with self._lock:
+            self.pending.add(os.path.abspath(path))
+
+    def fix(self):
+        """Resets the paths added since the last call. Returns their number."""
+        with self._lock:
+            pending, self.pending = sorted(self.pending), set()
+        # a tree already covers everything below it.
+        trees = [p for p in pending if os.path.isdir(p)]
+        inside = lambda p: any(p.startswith(t + os.sep) for t in trees)
+        trees = [t for t in trees if not inside(t)]
+        files = [p for p in pending if os.path.isfile(p) and not inside(p)]
+        jobs = [(batch, []) for batch in self.backend.batches(files)] + [([], [t]) for t in trees]
+        if not jobs:
+            return 0
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="permissions") as pool:
+            for future in [pool.submit(self.backend.fix, f, t) for f, t in jobs]:
+                try:
+                    future.result()
+                except Exception:
+                    logging.exception("Exception occurred while fixing permissions")
+        logging.info(f"Permission fixed on {len(files)} file(s) and {len(trees)} directory tree(s) "
+            f"moved into \"{self.root}\", in {len(jobs)} batch(es).")
+        return len(files) + len(trees)
+
+def default_backend():
+    return IcaclsBackend() if os.name == "nt" else PosixBackend()
+
+def open_fixer(root, config):
+    r"""Prepares the output directory `root` from the [General] section of settings.ini, None if disabled.
+    - `FixPermissions`: False to leave the permissions as they are (default True).
+    """
+    if not config['General'].getboolean('FixPermissions', fallback=True):
+        return None
+    return PermissionFixer(root)
@@ -0,0 +1,283 @@
+import os
+import logging
+import signal
+import subprocess
+import threading
+import time
+from collections import deque
+
+import telemetry
+
+if os.name == "nt":
+    import ctypes
+    from ctypes import wintypes
+
+    class _IO_COUNTERS(ctypes.Structure):
+        _fields_ = [(n, ctypes.c_ulonglong) for n in ("ReadOperationCount", "WriteOperationCount",
+            "OtherOperationCount", "ReadTransferCount", "WriteTransferCount", "OtherTransferCount")]
+
+    class _JOBOBJECT_BASIC_AND_IO_ACCOUNTING_INFORMATION(ctypes.Structure):
+        _fields_ = [
+            ("TotalUserTime", ctypes.c_longlong),
+            ("TotalKernelTime", ctypes.c_longlong),
+            ("ThisPeriodTotalUserTime", ctypes.c_longlong),
+            ("ThisPeriodTotalKernelTime", ctypes.c_longlong),
+            ("TotalPageFaultCount", wintypes.DWORD),
+            ("TotalProcesses", wintypes.DWORD),
+            ("ActiveProcesses", wintypes.DWORD),
+            ("TotalTerminatedProcesses", wintypes.DWORD),
+            ("IoInfo", _IO_COUNTERS),
+        ]
+
+    _kernel32 = ctypes.WinDLL("kernel32", use_last_error=True)
+    _kernel32.CreateJobObjectW.restype = wintypes.HANDLE
+    _kernel32.CreateJobObjectW.argtypes = [ctypes.c_void_p, wintypes.LPCWSTR]
+    _kernel32.AssignProcessToJobObject.argtypes = [wintypes.HANDLE, wintypes.HANDLE]
+    _kernel32.QueryInformationJobObject.argtypes = [wintypes.HANDLE, ctypes.c_int, ctypes.c_void_p,
+        wintypes.DWORD, ctypes.c_void_p]
+    _kernel32.CloseHandle.argtypes = [wintypes.HANDLE]
+
+class _Accounting(object):
+    r"""
+    CPU time, number of processes and I/O of a command and all of its children,
+    through a job object on Windows. On other systems, only the CPU time of
+    the command (and of the children it waited for) is measured, when it is
+    reaped by ProcessRunner.
+    """
+    def __init__(self, p):
+        self.job = None
+        if os.name != "nt":
+            return
+        try:
+            job = _kernel32.CreateJobObjectW(None, None)
+            if job and _kernel32.AssignProcessToJobObject(job, int(p._handle)):
+                self.job = job
+            elif job:
+                _kernel32.CloseHandle(job)
+        except (OSError, AttributeError):
+            pass
+
+    def sample(self):
+        """(cpu seconds, processes, bytes read, bytes written) so far, None if not measured."""
+        if self.job is None:
+            return None
+        info = _JOBOBJECT_BASIC_AND_IO_ACCOUNTING_INFORMATION()
+        # JobObjectBasicAndIoAccountingInformation = 8, times are in 100 ns units.
+        if not _kernel32.QueryInformationJobObject(self.job, 8, ctypes.byref(info), ctypes.sizeof(info), None):
+            return None
+        return ((info.TotalUserTime + info.TotalKernelTime) / 1e7, info.TotalProcesses,
+            info.IoInfo.ReadTransferCount, info.IoInfo.WriteTransferCount)
+
+    def finish(self, status):
+        if self.job is None:
+            return
+        sample = self.sample()
+        if sample is not None:
+            status.cpu, status.processes, status.io_read, status.io_write = sample
+        _kernel32.CloseHandle(self.job)
+        self.job = None
+
+class ProcessStatus(object):
+    """
+    Result of a command run by ProcessRunner. Only the last `tail` lines of
+    stdout/stderr are kept, the full output has already been streamed to the log.
+    """
+    def __init__(self, cmd):
+        self.cmd = cmd
+        self.pid = None
+        self.returncode = None
+        self.stdout = deque()
+        self.stderr = deque()
+        self.lines = 0
+        self.elapsed = 0.0
+        self.timed_out = False
+        self.cancelled = False
+        self.cpu = None # seconds of CPU time, None if not measured
+        self.processes = None # number of processes, including children, None if not measured
+        self.io_read = None # bytes, None if not measured
+        self.io_write = None
+
+    @property
+    def ok(self):
+        return self.returncode == 0 and not self.timed_out and not self.cancelled
+
+    def as_dict(self):
+        """the format returned by Traces.runbg"""
+        return {
+            "stdout": "\n".join(self.stdout),
+            "stderr": "\n".join(self.stderr),
+            "return": self.returncode,
+            "timeout": self.timed_out,
+            "cancelled": self.cancelled,
+            "elapsed": round(self.elapsed, 3),
+        }
+
+    def __repr__(self):
+        return (f"<return={self.returncode} elapsed={self.elapsed:.1f}s lines={self.lines}"
+            f" timeout={self.timed_out} cancelled={self.cancelled}>")
+
+class ProcessRunner(object):
+    def __init__(self, codec="utf8", tail=200, console=None, poll=0.1, max_lines=1000, max_chars=4096):
+        r"""
+        Runs shell commands without buffering their output in memory.
+
+        Output is read line by line by background threads and written to the
+        log (and to `console` if given) as it arrives. The caller waits in a
+        polling loop, so commands can be timed out or cancelled, and the Tk
+        event loop can be kept alive through `idle`.
+
+        Only the first `max_lines` lines of each stream go to the log. The rest
+        is written to `<spill_dir>/<pid>.<stream>.log` when `spill_dir` is set,
+        and only counted otherwise.
+
+        Args:
+            codec (str): codec of the command output.
+            tail (int): number of lines of stdout/stderr to keep for the caller.
+            console (callable): called with (stream name, line) for every line of output.
+            poll (float): seconds between checks for exit, timeout and cancellation.
+            max_lines (int): lines of each stream written to the log, 0 for all.
+            max_chars (int): longer lines are cut in the log, 0 for no limit.
+        """
+        self.codec = codec
+        self.tail = tail
+        self.console = console
+        self.poll = poll
+        self.max_lines = max_lines
+        self.max_chars = max_chars
+        self.spill_dir = None # where the output beyond max_lines goes, e.g. the output directory
+        self.drain = 10 # seconds to wait for remaining output after exit
+        self.idle = None # called periodically while waiting on the main thread, e.g. Tk.update
+        self.cancel_event = threading.Event()
+
+    def _reader(self, stream, name, status, lines, extra):
+        n = 0
+        spill = None
+        for raw in iter(stream.readline, b""):
+            line = raw.decode(self.codec, errors="replace").rstrip("\r\n")
+            lines.append(line)
+            if len(lines) > self.tail:
+                lines.popleft()
+            status.lines += 1
+            n += 1
+            if not self.max_lines or n <= self.max_lines:
+                shown = line if not self.max_chars or len(line) <= self.max_chars else \
+                    f"{line[:self.max_chars]} ... ({len(line)} chars)"
+                logging.info(f"[{name}:{status.pid}] {shown}", extra=extra)
+            elif spill is None and self.spill_dir is not None:
+                path = os.path.join(self.spill_dir, f"{status.pid}.{name}.log")
+                try:
+                    os.makedirs(self.spill_dir, exist_ok=True)
+                    spill = open(path, "w", encoding="utf8")
+                    logging.info(f"[{name}:{status.pid}] more than {self.max_lines} lines, continued in \"{path}\"", extra=extra)
+                except OSError:
+                    logging.exception(f"Cannot write \"{path}\"")
+                    self.spill_dir = None
+            if spill is not None:
+                spill.write(line + "\n")
+            if self.console is not None:
+                self.console(name, line)
+        stream.close()
+        if spill is not None:
+            spill.close()
+        elif self.max_lines and n > self.max_lines:
+            logging.info(f"[{name}:{status.pid}] {n - self.max_lines} more line(s) not logged", extra=extra)
+
+    def _reap(self, p, status):
+        """like p.poll(), also records the CPU time of the exited process outside of Windows."""
+        if os.name == "nt" or p.returncode is not None:
+            return p.poll()
+        try:
+            pid, code, usage = os.wait4(p.pid, os.WNOHANG)
+        except ChildProcessError:
+            return p.poll()
+        if pid == 0:
+            return None
+        p.returncode = os.waitstatus_to_exitcode(code)
+        status.cpu = usage.ru_utime + usage.ru_stime
+        return p.returncode
+
+    def start(self, cmd, cwd, shell=True):
+        r"""Starts `cmd` in `cwd`. Returns (Popen, ProcessStatus, reader threads)."""
+        status = ProcessStatus(cmd)
+        kwargs = {}
+        if os.name == "nt":
+            kwargs["creationflags"] = subprocess.CREATE_NEW_PROCESS_GROUP
+        else:
+            kwargs["start_new_session"] = True
+        p = subprocess.Popen(cmd, cwd=cwd, shell=shell, stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, **kwargs)
+        status.pid = p.pid
+        # the output is logged by the readers, as part of the ingredient that started the command.
+        metrics = telemetry.current()
+        extra = {"ingredient": metrics.name, "ingredient_id": metrics.id} if metrics is not None else {}
+        readers = [
+            threading.Thread(target=self._reader, args=(p.stdout, "stdout", status, status.stdout, extra), daemon=True),
+            threading.Thread(target=self._reader, args=(p.stderr, "stderr", status, status.stderr, extra), daemon=True),
+        ]
+        for t in readers:
+            t.start()
+        return p, status, readers
+
+    def kill(self, p):
+        """Kills the process and all of its children."""
+        if p.poll() is not None:
+            return
+        logging.warning(f"Killing process tree of PID={p.pid} ...")
+        try:
+            if os.name == "nt":
+                subprocess.call(f"taskkill /T /F /PID {p.pid}", stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            else:
+                os.killpg(p.pid, signal.SIGTERM)
+                try:
+                    p.wait(2)
+                except subprocess.TimeoutExpired:
+                    os.killpg(p.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            pass
+        p.kill()
+
+    def run(self, cmd, cwd, timeout=None, cancel=None):
+        r"""Runs `cmd` in `cwd` and waits for it.
+        Args:
+            cmd (str): the shell command.
+            cwd (str): working directory.
+            timeout (float): seconds until the command is killed, None to wait forever.
+            cancel (threading.Event): kills the command when set, defaults to the runner's own event.
+        Returns:
+            ProcessStatus
+        """
+        cancel = cancel if cancel is not None else self.cancel_event
+        if cancel.is_set():
+            logging.warning(f"Cancelled, not running \"{cmd}\"")
+            status = ProcessStatus(cmd)
+            status.cancelled = True
+            return status
+        start = time.perf_counter()
+        p, status, readers = self.start(cmd, cwd)
+        accounting = _Accounting(p)
+        on_main = threading.current_thread() is threading.main_thread()
+        while self._reap(p, status) is None:
+            if cancel.is_set():
+                status.cancelled = True
+                self.kill(p)
+                break
+            if timeout is not None and time.perf_counter() - start > timeout:
+                status.timed_out = True
+                logging.warning(f"Command timed out after {timeout}s: \"{cmd}\"")
+                self.kill(p)
+                break
+            if on_main and self.idle is not None:
+                self.idle()
+            cancel.wait(self.poll)
+        status.returncode = p.wait()
+        # a detached grandchild may hold the pipes open, so do not wait forever.
+        for t in readers:
+            t.join(self.drain)
+        status.elapsed = time.perf_counter() - start
+        accounting.finish(status)
+        telemetry.record_process(status)
+        return status
+
+    def cancel(self):
+        """Cancels the running commands, and any command run after this call."""
+        self.cancel_event.set()
@@ -0,0 +1,41 @@
+import json
+import logging
+import time
+from contextlib import contextmanager
+
+class PhaseTimer(object):
+    """
+    Records how long each phase of a sequence (e.g. the startup) takes.
+    """
+    def __init__(self, name, start=None):
+        self.name = name
+        self.start = start if start is not None else time.perf_counter()
+        self.phases = [] # (phase, offset from start, duration), in order
+        self._depth = 0
+
+    @contextmanager
+    def phase(self, name):
+        begin = time.perf_counter()
+        self._depth += 1
+        try:
+            yield
+        finally:
+            self._depth -= 1
+            end = time.perf_counter()
+            self.phases.append(("  " * self._depth + name, begin - self.start, end - begin))
+
+    def mark(self, name):
+        """records a point in time, e.g. the first frame drawn."""
+        self.phases.append((name, time.perf_counter() - self.start, 0.0))
+
+    def report(self, path=None):
+        """Logs the phases, ordered by start time. Also written as json to `path`, if given."""
+        phases = sorted(self.phases, key=lambda p: p[1])
+        logging.info(f"{self.name} timing report:")
+        for name, offset, duration in phases:
+            logging.info(f"  {offset * 1000:8.1f} ms  {duration * 1000:8.1f} ms  {name}")
+        if path is not None:
+            with open(path, "w", encoding="utf8") as f:
+                json.dump([{"phase": n.strip(), "start_ms": round(o * 1000, 1), "duration_ms": round(d * 1000, 1)}
+                    for n, o, d in phases], f, indent=2)
+        return phases
@@ -0,0 +1,189 @@
+r"""
+Progress of the running collection, for the progress panel of the GUI.
+
+The engine reports events as they happen: the scheduler when an ingredient
+starts and ends, execute when the phase changes, the Collector and the
+ArchiveWriter for every chunk of bytes they copy or compress. Events only
+update counters under a lock, nothing is drawn: the panel takes a snapshot()
+at a fixed rate, which computes the throughput and the ETA.
+
+The ETA comes from the durations of the same ingredients in earlier runs on
+this machine (see telemetry.estimate), else from uiconfig.COSTS.
+
+The output lines of the commands (ProcessRunner.console) are kept the same
+way, the last CONSOLE_LINES of them, until the panel takes them.
+"""
+import time
+import threading
+from collections import deque
+
+CONSOLE_LINES = 500
+
+class ProgressSnapshot(object):
+    def __init__(self):
+        self.phase = "idle"
+        self.running = [] # names of the ingredients running
+        self.done = 0 # ingredients finished
+        self.total = 0
+        self.failed = 0
+        self.copied = 0 # bytes
+        self.zipped = 0
+        self.to_zip = 0 # bytes queued for the zip
+        self.rate = 0.0 # bytes per second, copied and zipped, over the last seconds
+        self.elapsed = 0.0
+        self.eta = None # seconds, None if unknown
+        self.fraction = None # 0 to 1, None if unknown
+
+    def __repr__(self):
+        return (f"<{self.phase}: {self.done}/{self.total} ingredient(s), running {self.running}, "
+            f"{self.copied / (1 << 20):.1f} MB copied, {self.zipped / (1 << 20):.1f} MB zipped, "
+            f"{self.rate / (1 << 20):.1f} MB/s, eta {self.eta}>")
+
+class ProgressTracker(object):
+    def __init__(self, window=5.0):
+        r"""
+        Args:
+            window (float): seconds over which the throughput is averaged.
+        """
+        self.window = window
+        self._lock = threading.Lock()
+        self._samples = deque() # (time, bytes), one per snapshot
+        self._lines = deque(maxlen=CONSOLE_LINES) # (stream name, line) not taken yet
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.phase = "idle"
+            self.started = None
+            self.workers = 1
+            self.names = {} # id -> name, of the queued ingredients
+            self.estimates = {} # id -> seconds
+            self.running = {} # id -> start time
+            self.finished = {} # id -> succeeded
+            self.bytes = {"copied": 0, "zipped": 0}
+            self.to_zip = 0
+            self._samples.clear()
+
+    def begin(self, names, estimates=None, workers=1):
+        r"""A run starts.
+        Args:
+            names (dict): ingredient id -> name, of the queued ingredients.
+            estimates (dict): ingredient id -> expected seconds.
+            workers (int): ingredients running at the same time.
+        """
+        self.reset()
+        with self._lock:
+            self.phase = "collecting"
+            self.started = time.monotonic()
+            self.workers = max(1, workers)
+            self.names = dict(names)
+            self.estimates = dict(estimates or {})
+
+    def set_phase(self, phase):
+        with self._lock:
+            self.phase = phase
+
+    def start(self, id):
+        with self._lock:
+            self.running[id] = time.monotonic()
+
+    def done(self, id, ok=True):
+        with self._lock:
+            self.running.pop(id, None)
+            self.finished[id] = ok
+
+    def add(self, kind, nbytes):
+        """`kind` is "copied" or "zipped"."""
+        with self._lock:
+            self.bytes[kind] += nbytes
+
+    def expect_zip(self, nbytes):
+        with self._lock:
+            self.to_zip += nbytes
+
+    def finish(self):
+        self.set_phase("done")
+
+    def add_line(self, name, line):
+        """A line of output of a command, `name` is "stdout" or "stderr". Used as ProcessRunner.console."""
+        with self._lock:
+            self._lines.append((name, line))
+
+    def take_lines(self):
+        """The lines added since the last call, oldest first."""
+        with self._lock:
+            lines = list(self._lines)
+            self._lines.clear()
+        return lines
+
+    def _eta(self, now, rate):
+        if self.phase == "collecting":
+            left = [max(0.0, self.estimates.get(i, 0) - (now - t)) for i, t in self.running.items()]
+            left += [self.estimates.get(i, 0) for i in self.names if i not in self.running and i not in self.finished]
+            if not left:
+                return None
+            return max(max(left), sum(left) / self.workers)
+        if self.phase == "zipping" and rate > 0 and self.to_zip:
+            return max(0.0, self.to_zip - self.bytes["zipped"]) / rate
+        return None
+
+    def snapshot(self):
+        """The progress now. Called at a fixed rate by the panel, which also sets the throughput resolution."""
+        s = ProgressSnapshot()
+        now = time.monotonic()
+        with self._lock:
+            s.phase = self.phase
+            s.running = [self.names.get(i, str(i)) for i in self.running]
+            s.done = len(self.finished)
+            s.failed = sum(1 for ok in self.finished.values() if not ok)
+            s.total = len(self.names)
+            s.copied, s.zipped, s.to_zip = self.bytes["copied"], self.bytes["zipped"], self.to_zip
+            if self.started is None:
+                return s
+            s.elapsed = now - self.started
+            moved = s.copied + s.zipped
+            self._samples.append((now, moved))
+            while len(self._samples) > 2 and now - self._samples[1][0] >= self.window:
+                self._samples.popleft()
+            t0, b0 = self._samples[0]
+            s.rate = (moved - b0) / (now - t0) if now > t0 else 0.0
+            if s.phase == "done":
+                s.eta, s.fraction = 0.0, 1.0
+                return s
+            s.eta = self._eta(now, s.rate)
+        if s.eta is not None:
+            if s.phase == "zipping":
+                s.fraction = s.zipped / s.to_zip if s.to_zip else None
+            else:
+                s.fraction = s.elapsed / (s.elapsed + s.eta) if s.elapsed + s.eta > 0 else None
+        return s
+
+_current = None
+
+def activate(tracker):
+    """Routes the events of the engine to `tracker` (None to stop), one run at a time."""
+    global _current
+    _current = tracker
+
+def current():
+    return _current
+
+def record_bytes(kind, nbytes):
+    tracker = _current
+    if tracker is not None:
+        tracker.add(kind, nbytes)
+
+def expect_zip(nbytes):
+    tracker = _current
+    if tracker is not None:
+        tracker.expect_zip(nbytes)
+
+def format_duration(sec):
+    if sec is None:
+        return "unknown"
+    sec = int(round(sec))
+    if sec < 60:
+        return f"{sec}s"
+    if sec < 3600:
+        return f"{sec // 60}m {sec % 60:02d}s"
+    return f"{sec // 3600}h {sec % 3600 // 60:02d}m"
@@ -0,0 +1,220 @@
+r"""
+Questions and messages to the user, shown as Tk dialogs or answered from a script.
+
+Every prompt has a `key` naming what is asked (e.g. "highloading.timeout"),
+so a headless run can answer it from its job file. See headless.py.
+
+The GUI collects on a worker thread, its prompts go through a PromptBroker
+that shows them from the Tk event loop and hands the answers back.
+"""
+import queue
+import logging
+import threading
+from concurrent.futures import Future, CancelledError
+from lazyimport import lazy_import
+
+# Tk is only loaded when a dialog is actually shown.
+tk = lazy_import("tkinter")
+messagebox = lazy_import("tkinter.messagebox")
+simpledialog = lazy_import("tkinter.simpledialog")
+tkhelper = lazy_import("tkhelper")
+
+class TkPrompts(object):
+    """Shows every prompt as a Tk dialog, blocking until the user answers."""
+    interactive = True
+
+    def info(self, title, message, key=None):
+        messagebox.showinfo(title=title, message=message)
+
+    def warning(self, title, message, key=None):
+        messagebox.showwarning(title=title, message=message)
+
+    def error(self, title, message, key=None):
+        messagebox.showerror(title=title, message=message)
+
+    def yesno(self, title, message, key=None):
+        return messagebox.askyesno(title=title, message=message)
+
+    def ask(self, title, message, key=None):
+        """Returns the string entered, None if the user cancelled."""
+        return simpledialog.askstring(title, message)
+
+    def wait(self, title, message, key=None):
+        """Blocks while a trace is running, until the user presses OK."""
+        messagebox.showwarning(title=title, message=message)
+
+    def choose(self, title, message, options, key=None):
+        """Returns the options the user keeps checked (all are checked at first), [] if cancelled."""
+        parent = tk._default_root
+        if parent is None:
+            # no window to attach the dialog to, ask one by one.
+            return [o for o in options if messagebox.askyesno(title=title, message=f"{message}\n\n{o}")]
+        dialog = tkhelper.FilterDialog(parent, title=title, options=options, precheck=options, message=message)
+        if dialog.result is None:
+            return []
+        return [o for o in options if o not in dialog.result]
+
+class ScriptedPrompts(object):
+    interactive = False
+
+    def __init__(self, answers=None, wait=60, cancel=None):
+        r"""
+        Answers prompts without a user, for headless runs.
+        Args:
+            answers (dict): key -> answer. For `wait` prompts the answer is the number of seconds to wait.
+            wait (float): seconds to wait for `wait` prompts without an answer.
+            cancel (threading.Event): stops waiting when set.
+        Unanswered questions are answered "no" / cancelled. Every prompt is
+        logged and recorded in `self.history`.
+        """
+        self.answers = dict(answers or {})
+        self.default_wait = wait
+        self.cancel = cancel if cancel is not None else threading.Event()
+        self.history = [] # {"key", "kind", "title", "message", "answer"}
+        self._lock = threading.Lock()
+
+    def _record(self, kind, title, message, key, answer=None):
+        logging.info(f"[{kind}] {title}: {message} (key={key}, answer={answer!r})")
+        with self._lock:
+            self.history.append({"key": key, "kind": kind, "title": title, "message": message, "answer": answer})
+        return answer
+
+    def info(self, title, message, key=None):
+        self._record("info", title, message, key)
+
+    def warning(self, title, message, key=None):
+        self._record("warning", title, message, key)
+
+    def error(self, title, message, key=None):
+        self._record("error", title, message, key)
+
+    def yesno(self, title, message, key=None):
+        answer = self.answers.get(key, False)
+        if isinstance(answer, str):
+            answer = answer.lower() in ("1", "true", "yes", "y")
+        return self._record("yesno", title, message, key, bool(answer))
+
+    def ask(self, title, message, key=None):
+        answer = self.answers.get(key)
+        return self._record("ask", title, message, key, None if answer is None else str(answer))
+
+    def wait(self, title, message, key=None):
+        sec = float(self.answers.get(key, self.default_wait))
+        self._record("wait", title, message, key, sec)
+        self.cancel.wait(sec)
+
+    def choose(self, title, message, options, key=None):
+        r"""The answer to `key` is a list of options, or True for all of them.
+        Otherwise each option is answered by `<key>.<option>` (default no).
+        """
+        answer = self.answers.get(key)
+        if isinstance(answer, str):
+            answer = answer.lower() in ("1", "true", "yes", "y", "all") or [a.strip() for a in answer.split(",")]
+        if answer is True:
+            chosen = list(options)
+        elif isinstance(answer, list):
+            chosen = [o for o in options if o in answer]
+        else:
+            chosen = [o for o in options if self.yesno(title, f"{message} {o}", key=f"{key}.{o}")]
+        return self._record("choose", title, message, key, chosen)
+
+class PromptBroker(object):
+    def __init__(self, root, backend=None, poll_ms=50):
+        r"""
+        Prompts for a collection running on a worker thread, while `root` (the
+        Tk window) keeps running its event loop.
+
+        A prompt asked from the worker is queued, shown by the Tk loop through
+        `backend`, and its answer handed back to the waiting worker. Prompts
+        asked on the Tk thread itself are shown directly. A backend that does
+        not show dialogs (e.g. ScriptedPrompts) is called on the asking thread.
+
+        Args:
+            root (tk.Tk): the window whose event loop shows the prompts.
+            backend (TkPrompts or ScriptedPrompts): shows or answers the prompts, Tk dialogs by default.
+            poll_ms (int): milliseconds between two checks for queued prompts.
+        """
+        self.root = root
+        self.backend = backend if backend is not None else TkPrompts()
+        self.poll_ms = poll_ms
+        self._requests = queue.SimpleQueue()
+        self._closed = False
+
+    @property
+    def interactive(self):
+        return self.backend.interactive
+
+    def start(self):
+        """Starts serving the queued prompts from the Tk loop."""
+        self.root.after(self.poll_ms, self._pump)
+
+    def _pump(self):
+        while True:
+            try:
+                future, fn, args, kwargs = self._requests.get_nowait()
+            except queue.Empty:
+                break
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except BaseException as e:
+                future.set_exception(e)
+        if not self._closed:
+            self.root.after(self.poll_ms, self._pump)
+
+    def post(self, fn, *args, **kwargs):
+        """Runs fn on the Tk thread, without waiting for it. Returns a Future."""
+        future = Future()
+        if self._closed:
+            future.cancel()
+        else:
+            self._requests.put((future, fn, args, kwargs))
+        return future
+
+    def call(self, fn, *args, **kwargs):
+        """Runs fn on the Tk thread, and waits for its result."""
+        if threading.current_thread() is threading.main_thread():
+            return fn(*args, **kwargs)
+        future = self.post(fn, *args, **kwargs)
+        try:
+            return future.result()
+        except CancelledError:
+            raise RuntimeError("The window was closed while waiting for an answer.")
+
+    def close(self):
+        """Stops serving prompts, the workers waiting for an answer get an error."""
+        self._closed = True
+        while True:
+            try:
+                future, fn, args, kwargs = self._requests.get_nowait()
+            except queue.Empty:
+                break
+            future.cancel()
+
+    def _ask(self, kind, *args, **kwargs):
+        method = getattr(self.backend, kind)
+        if not self.backend.interactive:
+            return method(*args, **kwargs)
+        return self.call(method, *args, **kwargs)
+
+    def info(self, title, message, key=None):
+        self._ask("info", title, message, key=key)
+
+    def warning(self, title, message, key=None):
+        self._ask("warning", title, message, key=key)
+
+    def error(self, title, message, key=None):
+        self._ask("error", title, message, key=key)
+
+    def yesno(self, title, message, key=None):
+        return self._ask("yesno", title, message, key=key)
+
+    def ask(self, title, message, key=None):
+        return self._ask("ask", title, message, key=key)
+
+    def wait(self, title, message, key=None):
+        self._ask("wait", title, message, key=key)
+
+    def choose(self, title, message, options, key=None):
+        return self._ask("choose", title, message, options, key=key)
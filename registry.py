@@ -0,0 +1,397 @@
+r"""
+Registry operations of the traces, in process and in batches.
+
+Deleting a key, exporting keys to a .reg file and importing a .reg file
+used to be one `reg`/`regedit` process each: a console window, a UAC check
+and a process start per key. A Registry does them from SIT itself, and a
+whole list of keys in one batch: winreg opens each key once per batch, and
+the simulated registry is locked and rewritten once per batch.
+
+The work is done by a backend: WinregBackend on Windows, MemoryBackend
+elsewhere, or the registry of the simulated machine while it is active
+(see simenv.SimulatedMachine.activate and set_default_backend).
+
+Values are (type, data), with the REG_* types of winreg and the data as
+winreg returns it: str (REG_SZ, REG_EXPAND_SZ), int (REG_DWORD, REG_QWORD),
+list of str (REG_MULTI_SZ), bytes (anything else).
+"""
+import os
+import re
+import codecs
+import logging
+from lazyimport import lazy_import
+
+winreg = lazy_import("winreg")
+
+# the REG_* constants of winreg, which only exists on Windows.
+REG_NONE, REG_SZ, REG_EXPAND_SZ, REG_BINARY, REG_DWORD = 0, 1, 2, 3, 4
+REG_MULTI_SZ, REG_QWORD = 7, 11
+
+ROOTS = {"HKLM": "HKEY_LOCAL_MACHINE", "HKCU": "HKEY_CURRENT_USER", "HKCR": "HKEY_CLASSES_ROOT",
+    "HKU": "HKEY_USERS", "HKCC": "HKEY_CURRENT_CONFIG"}
+HEADER = "Windows Registry Editor Version 5.00"
+
+def normalize(key):
+    r"""`key` with its root in full, e.g. HKLM\SYSTEM -> HKEY_LOCAL_MACHINE\SYSTEM."""
+    root, sep, rest = key.strip().strip("\\").partition("\\")
+    return ROOTS.get(root.upper(), root.upper()) + sep + rest
+
+class RegistryBackend(object):
+    def read(self, keys):
+        r"""Reads keys with all their subkeys.
+        Args:
+            keys (list (str)): normalized keys.
+        Returns:
+            dict: key -> {subkey: {value name: (type, data)}}, subkeys including the key itself.
+            Keys that do not exist are left out.
+        """
+        raise NotImplementedError
+
+    def apply(self, ops):
+        r"""Applies a batch of changes, in order.
+        Args:
+            ops (list (tuple)): ("delete", key) deletes the key and its subkeys,
+                ("create", key) creates it if needed, ("set", key, name, type, data)
+                and ("unset", key, name) set and delete a value, of a key created if needed.
+        Returns:
+            list (bool): for each op, False if what it deletes did not exist.
+        """
+        raise NotImplementedError
+
+class MemoryBackend(RegistryBackend):
+    def __init__(self, keys=None):
+        r"""
+        A registry in a dict, for running outside of Windows and for tests.
+        Args:
+            keys (dict): initial content, key -> {value name: (type, data)}.
+        """
+        self.keys = {}
+        for key, values in (keys or {}).items():
+            self.keys[normalize(key)] = dict(values)
+
+    def _find(self, keys, key):
+        """the key and its subkeys in `keys`, case insensitive as the registry."""
+        key = key.lower()
+        return [k for k in keys if k.lower() == key or k.lower().startswith(key + "\\")]
+
+    def _key(self, keys, key):
+        """the stored name of `key`, created with its parents if needed."""
+        found = {k.lower(): k for k in keys}
+        parts = key.split("\\")
+        for i in range(1, len(parts) + 1):
+            name = "\\".join(parts[:i])
+            if name.lower() not in found:
+                keys[name] = {}
+                found[name.lower()] = name
+        return found[key.lower()]
+
+    def read(self, keys):
+        out = {}
+        for key in keys:
+            found = self._find(self.keys, key)
+            if found:
+                out[key] = {k: dict(self.keys[k]) for k in found}
+        return out
+
+    def apply(self, ops):
+        store = self.keys
+        results = []
+        for op in ops:
+            if op[0] == "delete":
+                found = self._find(store, op[1])
+                for k in found:
+                    del store[k]
+                results.append(bool(found))
+            elif op[0] == "create":
+                self._key(store, op[1])
+                results.append(True)
+            elif op[0] == "set":
+                store[self._key(store, op[1])][op[2]] = (op[3], op[4])
+                results.append(True)
+            elif op[0] == "unset":
+                values = store[self._key(store, op[1])]
+                match = [n for n in values if n.lower() == op[2].lower()]
+                for n in match:
+                    del values[n]
+                results.append(bool(match))
+            else:
+                raise ValueError(f"Unknown registry operation {op[0]!r}")
+        return results
+
+class WinregBackend(RegistryBackend):
+    def __init__(self, view=None):
+        r"""
+        The registry of this machine, through winreg.
+        Args:
+            view (int): access flag of the registry view, the 64-bit one by default
+                (as reg.exe and regedit.exe on a 64-bit Windows).
+        """
+        self.view = view if view is not None else winreg.KEY_WOW64_64KEY
+
+    def _split(self, key):
+        root, _, path = key.partition("\\")
+        return getattr(winreg, root), path
+
+    def _read_tree(self, root, path, out, prefix):
+        try:
+            h = winreg.OpenKeyEx(root, path, 0, winreg.KEY_READ | self.view)
+        except FileNotFoundError:
+            return False
+        with h:
+            info = winreg.QueryInfoKey(h)
+            values = {}
+            for i in range(info[1]):
+                name, data, type = winreg.EnumValue(h, i)
+                values[name] = (type, data)
+            out[prefix] = values
+            subkeys = [winreg.EnumKey(h, i) for i in range(info[0])]
+        for sub in subkeys:
+            self._read_tree(root, f"{path}\\{sub}" if path else sub, out, f"{prefix}\\{sub}")
+        return True
+
+    def read(self, keys):
+        out = {}
+        for key in keys:
+            root, path = self._split(key)
+            tree = {}
+            if self._read_tree(root, path, tree, key):
+                out[key] = tree
+        return out
+
+    def _delete_tree(self, root, path):
+        try:
+            with winreg.OpenKeyEx(root, path, 0, winreg.KEY_READ | self.view) as h:
+                subkeys = [winreg.EnumKey(h, i) for i in range(winreg.QueryInfoKey(h)[0])]
+        except FileNotFoundError:
+            return False
+        for sub in subkeys:
+            self._delete_tree(root, f"{path}\\{sub}")
+        winreg.DeleteKeyEx(root, path, self.view, 0)
+        return True
+
+    def apply(self, ops):
+        handles = {} # key -> open handle, reused by the ops of the batch on the same key
+        def opened(key):
+            if key not in handles:
+                root, path = self._split(key)
+                handles[key] = winreg.CreateKeyEx(root, path, 0, winreg.KEY_READ | winreg.KEY_WRITE | self.view)
+            return handles[key]
+        results = []
+        try:
+            for op in ops:
+                if op[0] == "delete":
+                    for k in [k for k in handles if k.lower() == op[1].lower() or k.lower().startswith(op[1].lower() + "\\")]:
+                        handles.pop(k).Close()
+                    results.append(self._delete_tree(*self._split(op[1])))
+                elif op[0] == "create":
+                    opened(op[1])
+                    results.append(True)
+                elif op[0] == "set":
+                    winreg.SetValueEx(opened(op[1]), op[2], 0, op[3], op[4])
+                    results.append(True)
+                elif op[0] == "unset":
+                    try:
+                        winreg.DeleteValue(opened(op[1]), op[2])
+                        results.append(True)
+                    except FileNotFoundError:
+                        results.append(False)
+                else:
+                    raise ValueError(f"Unknown registry operation {op[0]!r}")
+        finally:
+            for h in handles.values():
+                h.Close()
+        return results
+
+_default = None
+
+def set_default_backend(backend):
+    """Makes `backend` the one of the Registry objects created from now on (None for the default). Returns the previous one."""
+    global _default
+    previous, _default = _default, backend
+    return previous
+
+def default_backend():
+    if _default is not None:
+        return _default
+    return WinregBackend() if os.name == "nt" else MemoryBackend()
+
+def _unescape(s):
+    return s.replace("\\\\", "\0").replace("\\\"", "\"").replace("\0", "\\")
+
+def _escape(s):
+    return s.replace("\\", "\\\\").replace("\"", "\\\"")
+
+_VALUE = re.compile(r'^(@|"(?:[^"\\]|\\.)*")\s*=\s*(.*)$', re.S)
+
+def _parse_data(text):
+    """(type, data) of the right side of a value line, None to delete the value."""
+    if text == "-":
+        return None
+    if text.startswith("\""):
+        return REG_SZ, _unescape(text[1:text.rindex("\"")])
+    if text.lower().startswith("dword:"):
+        return REG_DWORD, int(text[6:], 16)
+    m = re.match(r"^hex(?:\(([0-9a-fA-F]+)\))?:(.*)$", text, re.S)
+    if m is None:
+        raise ValueError(f"Cannot parse the registry value {text!r}")
+    type = int(m.group(1), 16) if m.group(1) else REG_BINARY
+    raw = bytes(int(b, 16) for b in m.group(2).replace(" ", "").split(",") if b)
+    if type in (REG_SZ, REG_EXPAND_SZ):
+        return type, raw.decode("utf-16-le").split("\0", 1)[0]
+    if type == REG_MULTI_SZ:
+        return type, [s for s in raw.decode("utf-16-le").split("\0") if s]
+    if type == REG_DWORD and len(raw) == 4:
+        return type, int.from_bytes(raw, "little")
+    if type == REG_QWORD and len(raw) == 8:
+        return type, int.from_bytes(raw, "little")
+    return type, raw
+
+def parse_reg(text):
+    r"""The changes of a .reg file, as a batch for RegistryBackend.apply.
+    Args:
+        text (str): content of the file, "Windows Registry Editor Version 5.00" or "REGEDIT4".
+    """
+    # join the values continued on the next line with "\".
+    lines = []
+    for line in text.splitlines():
+        if lines and lines[-1].endswith("\\") and not lines[-1].startswith("["):
+            lines[-1] = lines[-1][:-1] + line.strip()
+        else:
+            lines.append(line.strip())
+    ops = []
+    key = None
+    for line in lines:
+        if not line or line.startswith(";") or line in (HEADER, "REGEDIT4"):
+            continue
+        if line.startswith("[") and line.endswith("]"):
+            if line.startswith("[-"):
+                ops.append(("delete", normalize(line[2:-1])))
+                key = None
+            else:
+                key = normalize(line[1:-1])
+                ops.append(("create", key))
+            continue
+        m = _VALUE.match(line)
+        if m is None or key is None:
+            logging.warning(f"Ignoring the line {line!r} of a .reg file.")
+            continue
+        name = "" if m.group(1) == "@" else _unescape(m.group(1)[1:-1])
+        value = _parse_data(m.group(2).strip())
+        ops.append(("unset", key, name) if value is None else ("set", key, name) + value)
+    return ops
+
+def _hex(prefix, raw):
+    """`raw` as regedit writes it: comma separated bytes, 80 characters per line at most."""
+    out, line = [], prefix
+    for i, b in enumerate(raw):
+        item = f"{b:02x}" + ("," if i < len(raw) - 1 else "")
+        if len(line) + len(item) > 77 and i:
+            out.append(line + "\\")
+            line = "  "
+        line += item
+    out.append(line)
+    return "\r\n".join(out)
+
+def format_value(name, type, data):
+    """One value, as a line of a .reg file."""
+    left = "@" if name == "" else f"\"{_escape(name)}\""
+    if type == REG_SZ and isinstance(data, str) and "\0" not in data:
+        return f"{left}=\"{_escape(data)}\""
+    if type == REG_DWORD and isinstance(data, int):
+        return f"{left}=dword:{data & 0xffffffff:08x}"
+    if isinstance(data, str):
+        raw = (data + "\0").encode("utf-16-le")
+    elif isinstance(data, int):
+        raw = data.to_bytes(8 if type == REG_QWORD else 4, "little")
+    elif isinstance(data, list):
+        raw = "".join(s + "\0" for s in data).encode("utf-16-le") + b"\0\0"
+    else:
+        raw = bytes(data or b"")
+    return _hex(f"{left}={'hex' if type == REG_BINARY else f'hex({type:x})'}:", raw)
+
+def format_reg(trees):
+    """A .reg file of {subkey: {value name: (type, data)}}, parents first."""
+    lines = [HEADER, ""]
+    for key in sorted(trees, key=lambda k: k.lower().split("\\")):
+        lines.append(f"[{key}]")
+        lines.extend(format_value(name, *value) for name, value in sorted(trees[key].items()))
+        lines.append("")
+    return "\r\n".join(lines) + "\r\n"
+
+def read_reg_file(path):
+    """the text of a .reg file: UTF-16 with a BOM as written by regedit, else ANSI as REGEDIT4."""
+    with open(path, "rb") as f:
+        raw = f.read()
+    if raw.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        return raw.decode("utf-16")
+    if raw.startswith(codecs.BOM_UTF8):
+        return raw[3:].decode("utf8")
+    return raw.decode("mbcs" if os.name == "nt" else "latin-1")
+
+class Registry(object):
+    def __init__(self, backend=None):
+        r"""
+        Deletes, exports and imports registry keys in batches.
+        Args:
+            backend (RegistryBackend): defaults to default_backend().
+        """
+        self.backend = backend if backend is not None else default_backend()
+
+    def delete(self, keys):
+        r"""Deletes keys with their subkeys, in one batch, as `reg delete KEY /f` for each.
+        Returns:
+            list (str): the keys that existed.
+        """
+        keys = [normalize(k) for k in keys]
+        try:
+            found = self.backend.apply([("delete", k) for k in keys])
+        except OSError:
+            # e.g. not run as administrator, as a failed reg command it does not stop the trace.
+            logging.exception(f"Cannot delete the registry keys {keys}")
+            return []
+        deleted = [k for k, ok in zip(keys, found) if ok]
+        logging.info(f"Deleted {len(deleted)} of {len(keys)} registry key(s): {deleted}")
+        return deleted
+
+    def export(self, exports):
+        r"""Writes keys with their subkeys to .reg files, reading them in one batch, as `reg export KEY FILE` for each.
+        Args:
+            exports (list (tuple)): (key, path of the .reg file).
+        Returns:
+            list (str): the files written, the keys that do not exist are skipped.
+        """
+        exports = [(normalize(k), path) for k, path in exports]
+        try:
+            trees = self.backend.read(list(dict.fromkeys(k for k, _ in exports)))
+        except OSError:
+            logging.exception(f"Cannot read the registry keys {[k for k, _ in exports]}")
+            return []
+        written = []
+        for key, path in exports:
+            if key not in trees:
+                logging.warning(f"Registry key \"{key}\" not found, not exported.")
+                continue
+            with open(path, "w", encoding="utf-16", newline="") as f:
+                f.write(format_reg(trees[key]))
+            written.append(path)
+        logging.info(f"Exported {len(written)} registry key(s) to .reg files.")
+        return written
+
+    def import_files(self, paths):
+        r"""Applies .reg files, all in one batch, as `regedit /s FILE` for each.
+        Returns:
+            int: number of changes made.
+        """
+        ops = []
+        for path in paths:
+            try:
+                ops.extend(parse_reg(read_reg_file(path)))
+            except (OSError, ValueError) as e:
+                logging.error(f"Cannot read \"{path}\": {e}")
+        try:
+            self.backend.apply(ops)
+        except OSError:
+            logging.exception(f"Cannot import {paths}")
+            return 0
+        logging.info(f"Imported {len(paths)} .reg file(s), {len(ops)} change(s): {[os.path.basename(p) for p in paths]}")
+        return len(ops)
@@ -0,0 +1,109 @@
+r"""
+Bounded capture of a log file that a polling script keeps appending to.
+
+The script (e.g. runtime_acpi.bat) reopens its output file for every append,
+so between two appends the file can be renamed away. Every `poll` seconds
+the file is moved into a ring directory as a snapshot; the script creates a
+new one on its next append. Snapshots beyond `max_bytes` in total, or older
+than `max_age` seconds, are deleted oldest first. When the capture stops, the
+remaining snapshots are joined, oldest first, into the output file.
+"""
+import os
+from os.path import join as pjoin
+import time
+import shutil
+import logging
+import threading
+from collections import deque
+
+class RingCapture(object):
+    def __init__(self, src, ringdir, max_bytes=64 << 20, max_age=0, poll=1.0):
+        r"""
+        Args:
+            src (str): the file the script appends to.
+            ringdir (str): directory holding the snapshots while capturing.
+            max_bytes (int): maximum total size of the snapshots kept, 0 for no limit.
+            max_age (float): snapshots older than this (sec) are deleted, 0 for no limit.
+            poll (float): seconds between two snapshots.
+        """
+        self.src = src
+        self.ringdir = ringdir
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.poll = poll
+        self.snapshots = deque() # (path, size, time), oldest first
+        self.total = 0
+        self.dropped = 0 # bytes deleted from the ring
+        self._seq = 0
+        self._lock = threading.Lock()
+        os.makedirs(ringdir, exist_ok=True)
+
+    def handover(self):
+        """Moves the current file into the ring. Returns False if the script still holds it (or there is none)."""
+        with self._lock:
+            if not os.path.isfile(self.src):
+                return False
+            tgt = pjoin(self.ringdir, f"{self._seq:08d}.log")
+            try:
+                os.replace(self.src, tgt)
+            except OSError:
+                return False # in use, next time
+            self._seq += 1
+            size = os.path.getsize(tgt)
+            self.snapshots.append((tgt, size, time.time()))
+            self.total += size
+            self._prune()
+            return True
+
+    def _prune(self):
+        now = time.time()
+        while len(self.snapshots) > 1:
+            path, size, t = self.snapshots[0]
+            if not ((self.max_bytes and self.total > self.max_bytes) or (self.max_age and now - t > self.max_age)):
+                break
+            self.snapshots.popleft()
+            self.total -= size
+            self.dropped += size
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def run(self, stop):
+        """Takes snapshots until `stop` (threading.Event) is set."""
+        while not stop.wait(self.poll):
+            self.handover()
+
+    def finish(self, out, timeout=10.0):
+        r"""Takes the last snapshot, as soon as the script released the file, and joins the ring into `out`.
+        Args:
+            out (str): the output file.
+            timeout (float): seconds to wait for the file to be released.
+        """
+        deadline = time.perf_counter() + timeout
+        while os.path.isfile(self.src) and not self.handover():
+            if time.perf_counter() > deadline:
+                logging.error(f"\"{self.src}\" is still in use after {timeout}s, the end of the capture is lost.")
+                break
+            time.sleep(0.1)
+
+        with open(out, "wb") as fdst:
+            for path, size, t in self.snapshots:
+                with open(path, "rb") as fsrc:
+                    shutil.copyfileobj(fsrc, fdst, 1 << 20)
+        shutil.rmtree(self.ringdir, ignore_errors=True)
+        logging.info(f"Captured {self.total / (1 << 20):.1f} MB to \"{out}\" from {self._seq} snapshot(s), "
+            f"{self.dropped / (1 << 20):.1f} MB older output dropped.")
+
+def ring_options(config):
+    r"""Options of the runtime ACPI capture, from the [General] section of settings.ini.
+    - `RuntimeAcpiInterval`: whole seconds between two polls of runtime_acpi.bat (default 10).
+    - `RuntimeAcpiMaxMB`: keep at most the last this many MB of output (default 64, 0 for no limit).
+    - `RuntimeAcpiMaxMinutes`: keep at most the last this many minutes of output (default 0, no limit).
+    """
+    general = config['General']
+    return {
+        "interval": max(1, general.getint('RuntimeAcpiInterval', fallback=10)),
+        "max_bytes": general.getint('RuntimeAcpiMaxMB', fallback=64) << 20,
+        "max_age": general.getfloat('RuntimeAcpiMaxMinutes', fallback=0) * 60,
+    }
@@ -0,0 +1,121 @@
+import logging
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import telemetry
+
+class IngredientResult(object):
+    """
+    Outcome of a single ingredient run, reported back to the UI.
+    """
+    def __init__(self, name, id):
+        self.name = name
+        self.id = id
+        self.elapsed = 0.0
+        self.error = None
+        self.traceback = None
+        self.metrics = None # telemetry.IngredientMetrics
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def as_dict(self):
+        return {"name": self.name, "id": self.id, "ok": self.ok,
+            "elapsed": round(self.elapsed, 3), "error": None if self.ok else str(self.error),
+            "metrics": self.metrics.as_dict() if self.metrics is not None else None}
+
+    def __repr__(self):
+        state = "ok" if self.ok else f"failed ({self.error})"
+        return f"<{self.name}: {state} in {self.elapsed:.1f}s>"
+
+class IngredientScheduler(object):
+    def __init__(self, workers=4, locks=None, interactive=(), names=None, costs=None, on_done=None, on_start=None):
+        r"""
+        Runs the queued ingredients on a bounded worker pool.
+
+        Args:
+            workers (int): maximum number of ingredients running at the same time.
+            locks (dict): ingredient id -> list of resource names. Ingredients that
+                share a resource (e.g. the "GfxEvents" directory) never overlap.
+            interactive (list (int)): ingredient ids that prompt the user. These run
+                on the calling thread in queue order, while the others run on the pool.
+            names (dict): ingredient id -> display name, used for logging and results.
+            costs (dict): ingredient id -> estimated run time. The longest ingredients
+                are started first, so a long one does not start last and hold up the run.
+            on_done (callable): called with an IngredientResult after each ingredient.
+            on_start (callable): called with the ingredient id when it starts, once its locks are held.
+        """
+        self.workers = max(1, int(workers))
+        self.locks = locks if locks is not None else {}
+        self.interactive = set(interactive)
+        self.names = names if names is not None else {}
+        self.costs = costs if costs is not None else {}
+        self.on_done = on_done
+        self.on_start = on_start
+        self._resources = {}
+        self._guard = threading.Lock()
+
+    def _resource_locks(self, id):
+        with self._guard:
+            names = sorted(set(self.locks.get(id, [])))
+            return [self._resources.setdefault(n, threading.Lock()) for n in names]
+
+    def _run_one(self, x, job):
+        result = IngredientResult(self.names.get(x["id"], str(x["id"])), x["id"])
+        held = self._resource_locks(x["id"])
+        # always acquired in sorted order, so two ingredients cannot deadlock.
+        for lock in held:
+            lock.acquire()
+        start = time.perf_counter()
+        try:
+            logging.info(f"Starting ingredient \"{result.name}\" ...")
+            if self.on_start is not None:
+                self.on_start(x["id"])
+            with telemetry.measure(result.name, result.id) as result.metrics:
+                job(x)
+        except Exception as e:
+            logging.exception(f"Ingredient \"{result.name}\" failed.")
+            result.error = e
+            result.traceback = traceback.format_exc()
+            # on_start or telemetry.measure itself may have failed before the metrics were assigned.
+            if result.metrics is not None:
+                result.metrics.error = repr(e)
+        finally:
+            result.elapsed = time.perf_counter() - start
+            for lock in reversed(held):
+                lock.release()
+        logging.info(f"Ingredient \"{result.name}\" returned in {result.elapsed:.1f}s: {result.metrics}")
+        if self.on_done is not None:
+            try:
+                self.on_done(result)
+            except Exception:
+                logging.exception("Exception occurred in on_done callback")
+        return result
+
+    def run(self, queue, job, idle=None):
+        r"""Runs job(x) for every ingredient x in queue.
+        `idle` is called periodically while waiting for the pool, e.g. Tk.update.
+        Returns a list of IngredientResult in queue order.
+        """
+        results = [None] * len(queue)
+        background = [(i, x) for i, x in enumerate(queue) if x["id"] not in self.interactive]
+        background.sort(key=lambda ix: self.costs.get(ix[1]["id"], 0), reverse=True)
+        foreground = [(i, x) for i, x in enumerate(queue) if x["id"] in self.interactive]
+
+        logging.info(f"Scheduling {len(background)} ingredient(s) on {self.workers} worker(s), "
+            f"{len(foreground)} interactive ingredient(s) in order.")
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="ingredient") as pool:
+            futures = [(i, pool.submit(self._run_one, x, job)) for i, x in background]
+            for i, x in foreground:
+                results[i] = self._run_one(x, job)
+            pending = [f for i, f in futures]
+            while pending:
+                done, pending = wait(pending, timeout=0.1)
+                if idle is not None:
+                    idle()
+            for i, f in futures:
+                results[i] = f.result()
+        return results
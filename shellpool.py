@@ -0,0 +1,332 @@
+r"""
+Long-lived command shells, one per working directory and concurrent caller.
+
+Starting cmd.exe for every command costs a process creation (and a console
+window for runat) each time: the 23 iasl of the ACPI tables, the 4 Rstcli64
+of rst, ... A ShellSession keeps one shell (cmd.exe on Windows, /bin/sh
+elsewhere) running in a directory, writes the commands to its stdin, and
+after each one has the shell print a marker with its exit code, on stdout
+and on stderr. The output before the markers is the output of the command,
+logged line by line as ProcessRunner does, and each command, a "step" of a
+recipe, gets its own ProcessStatus.
+
+Each command runs in a scope of its own, a batch file starting with
+setlocal on cmd.exe and a subshell on /bin/sh, so the directory, variables
+and exit code it leaves behind do not leak into the next command, of the
+same recipe or of the next caller of the session.
+
+Commands get NUL as stdin, so they cannot read the next commands. A step
+that times out or is cancelled kills the shell with its children, and the
+next step starts a new one. The ShellPool hands out an idle session of the
+directory, or starts one, and keeps up to `max_idle` of them for later.
+"""
+import os
+import uuid
+import logging
+import tempfile
+import threading
+import subprocess
+import time
+from collections import deque
+
+import telemetry
+from procrunner import ProcessStatus, _Accounting
+
+class _Step(object):
+    def __init__(self, status, extra):
+        self.status = status
+        self.extra = extra
+        self.done = {"stdout": threading.Event(), "stderr": threading.Event()}
+        self.lines = {"stdout": 0, "stderr": 0}
+        self.spill = {}
+
+class ShellSession(object):
+    def __init__(self, cwd, runner):
+        r"""
+        Starts a shell in `cwd`.
+        Args:
+            cwd (str): working directory of the commands.
+            runner (ProcessRunner): its codec, output limits, poll interval, idle
+                callback and cancel event are used for the commands.
+        """
+        self.cwd = os.path.abspath(cwd)
+        self.runner = runner
+        self.mark = f"__SIT_{uuid.uuid4().hex}__"
+        self.dead = False
+        self._step = None
+        self._script = None
+        kwargs = {}
+        if os.name == "nt":
+            argv = ["cmd.exe", "/Q", "/D"]
+            kwargs["creationflags"] = subprocess.CREATE_NEW_PROCESS_GROUP | getattr(subprocess, "CREATE_NO_WINDOW", 0)
+            self._null, self._status, self._nl = "NUL", "%errorlevel%", "\r\n"
+            fd, self._script = tempfile.mkstemp(prefix="sitstep", suffix=".cmd")
+            os.close(fd)
+        else:
+            argv = ["/bin/sh"]
+            kwargs["start_new_session"] = True
+            self._null, self._status, self._nl = "/dev/null", "$?", "\n"
+        self.proc = subprocess.Popen(argv, cwd=self.cwd, stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, **kwargs)
+        self.pid = self.proc.pid
+        self.accounting = _Accounting(self.proc)
+        self._readers = [threading.Thread(target=self._reader, args=(getattr(self.proc, name), name),
+            name=f"shell-{self.pid}-{name}", daemon=True) for name in ("stdout", "stderr")]
+        for t in self._readers:
+            t.start()
+        logging.info(f"Shell session PID={self.pid} started at \"{self.cwd}\".")
+
+    @property
+    def alive(self):
+        return not self.dead and self.proc.poll() is None
+
+    def _log(self, step, name, line):
+        runner = self.runner
+        if step is None:
+            # between two commands, e.g. from a child left running.
+            logging.info(f"[{name}:{self.pid}] {line}")
+            return
+        extra = step.extra
+        lines = step.status.stdout if name == "stdout" else step.status.stderr
+        lines.append(line)
+        if len(lines) > runner.tail:
+            lines.popleft()
+        step.status.lines += 1
+        step.lines[name] += 1
+        n = step.lines[name]
+        if not runner.max_lines or n <= runner.max_lines:
+            shown = line if not runner.max_chars or len(line) <= runner.max_chars else \
+                f"{line[:runner.max_chars]} ... ({len(line)} chars)"
+            logging.info(f"[{name}:{self.pid}] {shown}", extra=extra)
+        elif name not in step.spill and runner.spill_dir is not None:
+            path = os.path.join(runner.spill_dir, f"{self.pid}.{id(step)}.{name}.log")
+            try:
+                os.makedirs(runner.spill_dir, exist_ok=True)
+                step.spill[name] = open(path, "w", encoding="utf8")
+                logging.info(f"[{name}:{self.pid}] more than {runner.max_lines} lines, continued in \"{path}\"", extra=extra)
+            except OSError:
+                logging.exception(f"Cannot write \"{path}\"")
+                step.spill[name] = None
+        if step.spill.get(name) is not None:
+            step.spill[name].write(line + "\n")
+        if runner.console is not None:
+            runner.console(name, line)
+
+    def _end(self, step, name, code=None):
+        if step is None:
+            return
+        if name == "stdout" and code is not None:
+            step.status.returncode = code
+        spill = step.spill.get(name)
+        if spill is not None:
+            spill.close()
+        elif self.runner.max_lines and step.lines[name] > self.runner.max_lines:
+            logging.info(f"[{name}:{self.pid}] {step.lines[name] - self.runner.max_lines} more line(s) not logged",
+                extra=step.extra)
+        step.done[name].set()
+
+    def _reader(self, stream, name):
+        for raw in iter(stream.readline, b""):
+            line = raw.decode(self.runner.codec, errors="replace").rstrip("\r\n")
+            i = line.find(self.mark)
+            step = self._step
+            if i < 0:
+                self._log(step, name, line)
+                continue
+            # the output of the command may not end with a new line.
+            if line[:i]:
+                self._log(step, name, line[:i])
+            try:
+                code = int(line[i + len(self.mark):].strip() or 0)
+            except ValueError:
+                code = -1
+            self._end(step, name, code)
+        stream.close()
+        # the shell exited, e.g. a batch file called "exit".
+        self.dead = True
+        step = self._step
+        if step is not None and not step.done[name].is_set():
+            self._end(step, name, self.proc.wait() if name == "stdout" else None)
+
+    def _write(self, text):
+        self.proc.stdin.write(text.encode(self.runner.codec))
+        self.proc.stdin.flush()
+
+    def run(self, command, timeout=None, cancel=None):
+        r"""Runs one command and waits for it, as ProcessRunner.run.
+        Args:
+            command (str): one command line of the shell, without redirection of stdin.
+            timeout (float): seconds until the shell is killed, None to wait forever.
+            cancel (threading.Event): kills the shell when set, defaults to the runner's own event.
+        Returns:
+            ProcessStatus
+        """
+        runner = self.runner
+        cancel = cancel if cancel is not None else runner.cancel_event
+        status = ProcessStatus(command)
+        status.pid = self.pid
+        if cancel.is_set():
+            logging.warning(f"Cancelled, not running \"{command}\"")
+            status.cancelled = True
+            return status
+        metrics = telemetry.current()
+        step = _Step(status, {"ingredient": metrics.name, "ingredient_id": metrics.id} if metrics is not None else {})
+        before = self.accounting.sample()
+        start = time.perf_counter()
+        self._step = step
+        nl = self._nl
+        # ":" clears the exit code of the previous command, the subshell keeps the cd and variables of this one.
+        line = f"(:; {command}{nl})"
+        if self._script is not None:
+            # at its prompt cmd.exe does not wait for GUI programs (e.g. msinfo32), in a batch file it
+            # does, as with cmd /c. A called batch file runs in the same cmd.exe, and the end of
+            # its setlocal restores the directory and variables; "(call )" clears the errorlevel.
+            with open(self._script, "w", encoding=runner.codec) as f:
+                f.write(f"@setlocal{nl}@cd /d \"{self.cwd}\"{nl}@(call ){nl}@{command.lstrip('@')}{nl}")
+            line = f"call \"{self._script}\""
+        try:
+            self._write(f"{line} < {self._null}{nl}echo {self.mark} {self._status}{nl}echo {self.mark} 1>&2{nl}")
+        except OSError:
+            # the shell is gone, the pool starts another one next time.
+            self.dead = True
+            for name in step.done:
+                step.done[name].set()
+        on_main = threading.current_thread() is threading.main_thread()
+        while not all(e.is_set() for e in step.done.values()):
+            if cancel.is_set():
+                status.cancelled = True
+                self.kill()
+                break
+            if timeout is not None and time.perf_counter() - start > timeout:
+                status.timed_out = True
+                logging.warning(f"Command timed out after {timeout}s: \"{command}\"")
+                self.kill()
+                break
+            if on_main and runner.idle is not None:
+                runner.idle()
+            next(e for e in step.done.values() if not e.is_set()).wait(runner.poll)
+        if self.dead:
+            for e in step.done.values():
+                e.wait(runner.drain)
+            if status.returncode is None:
+                status.returncode = self.proc.wait()
+        self._step = None
+        status.elapsed = time.perf_counter() - start
+        after = self.accounting.sample()
+        if before is not None and after is not None:
+            status.cpu, status.processes, status.io_read, status.io_write = [b - a for a, b in zip(before, after)]
+        telemetry.record_process(status)
+        return status
+
+    def kill(self):
+        """Kills the shell and the commands it runs."""
+        self.dead = True
+        self.runner.kill(self.proc)
+
+    def close(self):
+        if self.alive:
+            try:
+                self._write(f"exit{self._nl}")
+                self.proc.stdin.close()
+                self.proc.wait(2)
+            except (OSError, subprocess.TimeoutExpired):
+                self.kill()
+        self.dead = True
+        self.accounting.finish(ProcessStatus(None))
+        if self._script is not None:
+            try:
+                os.remove(self._script)
+            except OSError:
+                pass
+
+    def __repr__(self):
+        return f"<ShellSession PID={self.pid} at \"{self.cwd}\"{' dead' if self.dead else ''}>"
+
+def merge(cmd, statuses):
+    """One ProcessStatus for the steps of a recipe, as if run by one "a & b" command line."""
+    status = ProcessStatus(cmd)
+    for s in statuses:
+        status.pid = s.pid
+        status.stdout.extend(s.stdout)
+        status.stderr.extend(s.stderr)
+        status.lines += s.lines
+        status.elapsed += s.elapsed
+        status.timed_out |= s.timed_out
+        status.cancelled |= s.cancelled
+        status.returncode = s.returncode
+    return status
+
+class ShellPool(object):
+    def __init__(self, runner, max_idle=8):
+        r"""
+        Shell sessions by working directory, each used by one caller at a time.
+        Args:
+            runner (ProcessRunner): see ShellSession.
+            max_idle (int): sessions kept running between commands, over all directories.
+        """
+        self.runner = runner
+        self.max_idle = max_idle
+        self.idle = deque() # ShellSession, the most recently used last
+        self.started = 0
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def acquire(self, cwd):
+        cwd = os.path.abspath(cwd)
+        with self._lock:
+            for session in reversed(self.idle):
+                if session.cwd == cwd:
+                    self.idle.remove(session)
+                    if session.alive:
+                        return session
+                    session.close()
+                    break
+            self.started += 1
+        return ShellSession(cwd, self.runner)
+
+    def release(self, session):
+        evicted = session
+        with self._lock:
+            if session.alive and not self._closed:
+                self.idle.append(session)
+                evicted = self.idle.popleft() if len(self.idle) > self.max_idle else None
+        if evicted is not None:
+            evicted.close()
+
+    def run(self, steps, cwd, timeout=None, cancel=None, stop_on_error=False):
+        r"""Runs the steps of a recipe one after the other in one shell session of `cwd`.
+        Args:
+            steps (list (str)): command lines.
+            timeout (float): seconds for all the steps, None to wait forever.
+            stop_on_error (bool): skip the remaining steps after one failed, else run all as cmd "a & b" does.
+                The remaining steps are always skipped after a timeout or a cancellation.
+        Returns:
+            list (ProcessStatus): one per step run.
+        """
+        results = []
+        start = time.perf_counter()
+        session = self.acquire(cwd)
+        try:
+            for step in steps:
+                left = None if timeout is None else max(0.0, timeout - (time.perf_counter() - start))
+                if not session.alive:
+                    self.release(session)
+                    session = self.acquire(cwd)
+                status = session.run(step, left, cancel)
+                results.append(status)
+                # as a recipe run by one cmd.exe, which was killed with the remaining steps.
+                if status.cancelled or status.timed_out or (stop_on_error and not status.ok):
+                    break
+        finally:
+            self.release(session)
+        return results
+
+    def close(self):
+        """Stops the idle sessions, and the busy ones once released."""
+        with self._lock:
+            self._closed = True
+            sessions, self.idle = list(self.idle), deque()
+        for session in sessions:
+            session.close()
+        if self.started:
+            logging.info(f"Closed the shell pool, {self.started} session(s) started.")
@@ -0,0 +1,497 @@
+r"""
+A simulated Windows machine, for running the Traces pipeline on any OS.
+
+    machine = SimulatedMachine("/tmp/sim", scale=0.1)
+    machine.build()
+    with machine.activate():
+        ...  # UI.resrc_path = machine.resource, then UI.execute(...)
+
+It consists of:
+- `resource/`: the resource directory of SIT, where every vendor tool and
+  trace script (acpidump, iasl, Rstcli64, IntelMAS, the .bat, .cmd and .reg
+  files, ...) is a stub that sleeps for a realistic time and writes outputs
+  of realistic sizes (see TOOLS).
+- `root/`: the system drive, C:\ (see TREE): event logs, setupapi logs, WMI
+  ETLs, driver logs. Traces maps its C:\ paths there through SIT_ROOT.
+- `bin/`: the Windows commands SIT calls by name (reg, msinfo32, bcdedit,
+  powershell.exe, tracelog.exe, ...), put first on PATH.
+- `registry.json`: the registry of the machine, edited by the `reg` stub and
+  by the stub .bat files (FakeRegistry). The .reg files are real ones, which
+  SIT imports in process: while the machine is active, registry.py works on
+  this registry (SimulatedRegistry).
+
+Sizes are multiplied by `scale`, and latencies by `time_scale`.
+"""
+import os
+from os.path import join as pjoin
+import sys
+import json
+import time
+import random
+import struct
+import getpass
+import logging
+from contextlib import contextmanager
+
+import registry as sitregistry
+
+MB = 1 << 20
+KB = 1 << 10
+
+class Tool(object):
+    def __init__(self, path, latency=0.0, outputs=(), stdout=0, mode="once", keys=(), delete=()):
+        r"""
+        A stub tool.
+        Args:
+            path (str): location, relative to resource/, root/ or bin/.
+            latency (float or str): seconds it runs, or "$N" for the N-th argument.
+            outputs (list): (path, size) or (path, size, condition) of the files written.
+                The path is formatted with {here} (the directory of the tool), {cwd},
+                {root} and {args}. The condition is an argument that must be given,
+                or "!argument" for one that must not.
+            stdout (int): bytes of text printed.
+            mode (str): "once", "poll" (appends `size` to {args[1]} every {args[2]}
+                seconds until killed), "dump" (writes the output over `latency`
+                seconds, as a live dump), "iasl", "reg" or "bcdedit".
+            keys (list): registry keys added when run. A .reg file holds them, with "Start"=dword:1.
+            delete (list): registry keys deleted when run.
+        """
+        self.path = path
+        self.latency = latency
+        self.outputs = list(outputs)
+        self.stdout = stdout
+        self.mode = mode
+        self.keys = list(keys)
+        self.delete = list(delete)
+
+    def as_dict(self):
+        return {"path": self.path, "latency": self.latency, "outputs": self.outputs, "stdout": self.stdout,
+            "mode": self.mode, "keys": self.keys, "delete": self.delete}
+
+AUTOLOGGER = r"HKEY_LOCAL_MACHINE\SYSTEM\CurrentControlSet\Control\WMI\Autologger"
+SERVICES = r"HKEY_LOCAL_MACHINE\SYSTEM\CurrentControlSet\Services"
+
+def _mei_tools(mode, name):
+    return [
+        Tool(f"CSME/MEI/{mode}/trace_enable_{name}.reg", 0.2, keys=[f"{AUTOLOGGER}\\{name.capitalize()}"]),
+        Tool(f"CSME/MEI/{mode}/trace_enable_{name}_In_dmp.reg", 0.2, keys=[f"{AUTOLOGGER}\\{name.capitalize()}"]),
+    ]
+
+# resource/, as shipped with SIT.
+TOOLS = [
+    Tool("_IdleLog.cmd", 30, [("{here}/idle.etl", 48 * MB)]),
+    Tool("_ModernStandbyETW.cmd", "$1", [("{here}/idle.etl", 96 * MB)]),
+    Tool("_usb_trace.cmd", 20, [("{here}/usbtrace.etl", 24 * MB)]),
+    Tool("_LiveDumpFile.cmd", 15, [("{root}/NTFS_LIVEKD_MEMORY_DMP/memory.dmp", 1024 * MB)], mode="dump"),
+    Tool("iasl-win/acpidump.exe", 3, [("{here}/dsdt.dat", 512 * KB), ("{here}/facp.dat", 276), ("{here}/apic.dat", 356),
+        ("{here}/hpet.dat", 56), ("{here}/mcfg.dat", 60), ("{here}/fpdt.dat", 68), ("{here}/dmar.dat", 168)]
+        + [(f"{{here}}/ssdt{i}.dat", 24 * KB) for i in range(1, 17)]),
+    Tool("iasl-win/iasl.exe", 0.4, mode="iasl"),
+    Tool("livekd/livekd64", 10),
+    Tool("livekd/runtime_acpi.bat", outputs=[("{cwd}/{args[1]}", 256 * KB)], mode="poll"),
+    Tool("RST/Rstcli64.exe", 1.5, stdout=24 * KB),
+    Tool("RST/IntelMAS.exe", 12, [("{here}/output/PHKS1234567/nvme_smart.log", 64 * KB),
+        ("{here}/output/PHKS1234567/telemetry.bin", 8 * MB), ("{here}/output/PHKS1234567/eventlog.bin", 2 * MB)]),
+    Tool("GfxEvents/Install.bat", 2),
+    Tool("GfxEvents/Trace.bat", 4, [("{here}/GfxTrace.etl", 96 * MB, "!--RealTime"),
+        ("{here}/GfxRealTimeTrace.etl", 32 * MB, "--RealTime")]),
+    Tool("GfxEvents/BootTrace.bat", 4, [("{here}/MergGfxBootTrace.etl", 128 * MB, "!--perf")]),
+    Tool("GfxEvents/EventGenerator.exe"),
+    Tool("ThunderboltTrace/StartTrace.bat", 2, [("{cwd}/{args[1]}/TBT_LOG.etl", 16 * MB)]),
+    Tool("ThunderboltTrace/StopTrace.bat", 3),
+    Tool("ThunderboltTrace/StartSingleBootTrace.bat", 2),
+    Tool("ThunderboltTrace/StopBootTrace.bat", 3, [("{here}/TBT_SINGLE_BOOT_LOG.etl", 16 * MB)]),
+    Tool("I2C_log/i2clog_autostart_HIDI2C_WPP.bat", 1, keys=[f"{AUTOLOGGER}\\HIDI2C"]),
+    Tool("I2C_log/i2clog_autostart_ACPI_HIDI2C_WPP.bat", 1, keys=[f"{AUTOLOGGER}\\HIDI2C"]),
+    Tool("I2C_log/i2clog_autostop.bat", 2, [("{here}/i2ctrace.etl", 8 * MB)], delete=[f"{AUTOLOGGER}\\HIDI2C"]),
+    Tool("ISST_Autologger/ISST_Autologger_enabled.reg", 0.2, keys=[f"{AUTOLOGGER}\\ISST", f"{AUTOLOGGER}\\AudioSST"]),
+    Tool("ISST_Autologger/Disable_ISST__auto_logger.reg", 0.2, delete=[f"{AUTOLOGGER}\\ISST", f"{AUTOLOGGER}\\AudioSST"]),
+    Tool("ISST_Autologger/wpp_stop.bat", 2, [("{root}/ISST.etl", 24 * MB)]),
+    Tool("CSME/WiMan_log/WiMan.ctl"),
+    Tool("CSME/WiMan_log/wizard.ps1"),
+    Tool("CSME/DAL/Set universal JHI log level to debug.reg", 0.2, keys=[r"HKEY_LOCAL_MACHINE\SOFTWARE\Intel\Services\DAL"]),
+    Tool("CSME/DAL/Set legacy JHI log level to debug.reg", 0.2, keys=[f"{SERVICES}\\jhi_service"]),
+] + _mei_tools("Tee", "Tee") + _mei_tools("SPD", "SPD") + _mei_tools("gsc", "gsc") + _mei_tools("_aux", "aux")
+
+# bin/, the Windows commands called by name.
+COMMANDS = [
+    Tool("reg", 0.1, mode="reg"),
+    Tool("msinfo32", 45, [("{cwd}/{args[2]}", 3 * MB)]),
+    Tool("bcdedit", 0.3, mode="bcdedit"),
+    Tool("icacls", 1),
+    Tool("pause"),
+    Tool("powershell.exe", 2, [("{cwd}/trace/WiMan.etl", 12 * MB, "-trace_stop")]),
+    Tool("tracelog.exe", 1, [("{root}/Windows/System32/LogFiles/WMI/{args[2]}.etl.001", 6 * MB)]),
+]
+
+# root/, the system drive: (path, size of each file, number of files). {user} is the current user.
+TREE = [
+    ("Windows/System32/winevt/Logs/Application.evtx", 20 * MB, 1),
+    ("Windows/System32/winevt/Logs/System.evtx", 20 * MB, 1),
+    ("Windows/System32/winevt/Logs/Security.evtx", 20 * MB, 1),
+    ("Windows/System32/winevt/Logs/Microsoft-Windows-Kernel-Power%4Thermal-Operational{i}.evtx", 1 * MB, 60),
+    ("Windows/System32/winevt/Logs/Microsoft-Windows-Storage-Storport%4Operational{i}.evtx", 68 * KB, 200),
+    ("Windows/panther/setupact.log", 2 * MB, 1),
+    ("Windows/INF/setupapi.setup.log", 1 * MB, 1),
+    ("Windows/INF/setupapi.dev.log", 4 * MB, 1),
+    ("Windows/INF/setupapi.app.log", 512 * KB, 1),
+    ("Windows/System32/LogFiles/WMI/Tee.etl.00{i}", 4 * MB, 3),
+    ("Windows/System32/LogFiles/WMI/Intel/iCLSClient/iclsclient{i}.log", 256 * KB, 4),
+    ("Windows/System32/config/systemprofile/AppData/Local/Intel/iCLS Client/log/iCLSClient{i}.log", 256 * KB, 2),
+    ("Windows/System32/cAVS/IntcSST{i}.bin", 512 * KB, 4),
+    ("Windows/System32/cAVS/ExtLibs/ext{i}.bin", 128 * KB, 6),
+    ("Windows/System32/cAVS/IAS/ias{i}.log", 64 * KB, 3),
+    ("Windows/ServiceState/IntcOED/Data/oed{i}.bin", 256 * KB, 2),
+    ("Windows/ServiceState/IntelAudioService/Data/ias{i}.dat", 128 * KB, 2),
+    ("Windows/SysWOW64/Gms.log", 1 * MB, 1),
+    ("jhi_log.txt", 2 * MB, 1), # written by the DAL service once its log level is set
+    ("ProgramData/Intel/iCLS Client/log/iCLSClient{i}.log", 256 * KB, 2),
+    ("Users/{user}/AppData/Roaming/placeholder.txt", 1 * KB, 1),
+    ("Users/{user}/AppData/Local/Intel/iCLS Client/log/iCLSClient{i}.log", 256 * KB, 2),
+    ("Users/{user}/AppData/Local/Packages/AppUp.IntelOptaneMemoryandStorageManagem/LocalState/log{i}.txt", 512 * KB, 4),
+    ("Users/{user}/Intel/Logs/IntelME.log", 2 * MB, 1),
+    ("Users/{user}/Intel/Logs/IntelME_MSI.log", 1 * MB, 1),
+    ("Users/{user}/Intel/Logs/DifXFrontend.log", 256 * KB, 1),
+]
+
+GPUVIEW = "Program Files (x86)/Windows Kits/10/Windows Performance Toolkit/gpuview"
+ROOT_TOOLS = [
+    Tool(f"{GPUVIEW}/log.cmd", 4, [("{here}/Merged.etl", 160 * MB)]),
+]
+
+def _content(path, size, seed):
+    """Bytes like those of `path`: text for logs, half random (about 2:1 compressible) binary otherwise."""
+    rng = random.Random(seed)
+    if os.path.splitext(path)[1].lower() in (".log", ".txt", ".dsl"):
+        line = f"{time.strftime('%Y-%m-%d %H:%M:%S')} [INFO] driver event {{:08d}} status=0x{{:08X}}\r\n"
+        out = []
+        n = 0
+        i = 0
+        while n < size:
+            s = line.format(i, rng.getrandbits(32))
+            out.append(s)
+            n += len(s)
+            i += 1
+        return "".join(out).encode("ascii")[:size]
+    if os.path.splitext(path)[1].lower() == ".dat":
+        # an ACPI table, with the standard header (see acpitables.HEADER).
+        sig = os.path.basename(path)[:4].upper().encode("ascii").ljust(4, b"_")
+        body = rng.randbytes(max(0, size - 36))
+        return struct.pack("<4sIBB6s8sI4sI", sig, size, 2, 0, b"INTEL ", b"SIMBOARD", 1, b"INTL", 0x20200925) + body
+    chunk = 64 * KB
+    out = bytearray()
+    while len(out) < size:
+        out += rng.randbytes(chunk // 2) + bytes(chunk // 2)
+    return bytes(out[:size])
+
+def write_dump(path, size, seconds, seed=None):
+    r"""Writes a memory dump of `size` bytes over `seconds`, as a live dump: 1 MB
+    chunks, a third of them zeros (free memory), and the header last."""
+    rng = random.Random(seed if seed is not None else time.time_ns())
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    pause = seconds / max(1, size // MB)
+    with open(path, "wb") as f:
+        f.write(bytes(min(size, MB)))
+        while f.tell() < size:
+            n = min(MB, size - f.tell())
+            f.write(bytes(n) if rng.random() < 1 / 3 else _content(path, n, rng.getrandbits(32)))
+            f.flush()
+            time.sleep(pause)
+        f.seek(0)
+        f.write((b"PAGEDU64" + rng.randbytes(4 * KB))[:min(size, 4 * KB)])
+    return 0
+
+def write_file(path, size, seed=None):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(_content(path, size, seed if seed is not None else time.time_ns()))
+
+class FakeRegistry(object):
+    ROOTS = {"HKLM": "HKEY_LOCAL_MACHINE", "HKCU": "HKEY_CURRENT_USER", "HKCR": "HKEY_CLASSES_ROOT",
+        "HKU": "HKEY_USERS", "HKCC": "HKEY_CURRENT_CONFIG"}
+
+    def __init__(self, path):
+        r"""
+        The registry of the simulated machine: keys -> {value name: data}, in a json file.
+        Args:
+            path (str): the json file.
+        """
+        self.path = path
+
+    def normalize(self, key):
+        root, sep, rest = key.strip("\\").partition("\\")
+        return self.ROOTS.get(root.upper(), root.upper()) + sep + rest
+
+    @contextmanager
+    def _locked(self):
+        """the stubs run in parallel, so every change is made under a file lock."""
+        import fcntl
+        with open(self.path + ".lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            keys = self.load()
+            yield keys
+            tmp = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp, "w", encoding="utf8") as f:
+                json.dump(keys, f, indent=1, sort_keys=True)
+            os.replace(tmp, self.path)
+
+    def load(self):
+        try:
+            with open(self.path, "r", encoding="utf8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def _subkeys(self, keys, key):
+        key = self.normalize(key).lower()
+        return [k for k in keys if k.lower() == key or k.lower().startswith(key + "\\")]
+
+    def add(self, key, values=None):
+        with self._locked() as keys:
+            keys.setdefault(self.normalize(key), {}).update(values or {})
+
+    def delete(self, key):
+        """Deletes the key and its subkeys. Returns False if it does not exist."""
+        with self._locked() as keys:
+            found = self._subkeys(keys, key)
+            for k in found:
+                del keys[k]
+        return bool(found)
+
+    def query(self, key):
+        keys = self.load()
+        return {k: keys[k] for k in self._subkeys(keys, key)}
+
+    def export(self, key, path):
+        """Writes the key and its subkeys as a .reg file, like reg export. Returns False if it does not exist."""
+        found = self.query(key)
+        if not found:
+            return False
+        lines = ["Windows Registry Editor Version 5.00", ""]
+        for k in sorted(found):
+            lines.append(f"[{k}]")
+            lines.extend(f"\"{name}\"=\"{data}\"" for name, data in sorted(found[k].items()))
+            lines.append("")
+        with open(path, "w", encoding="utf-16") as f:
+            f.write("\r\n".join(lines))
+        return True
+
+def _decode(type, data):
+    if type in (sitregistry.REG_SZ, sitregistry.REG_EXPAND_SZ, sitregistry.REG_DWORD,
+            sitregistry.REG_QWORD, sitregistry.REG_MULTI_SZ):
+        return type, data
+    return type, bytes.fromhex(data)
+
+class SimulatedRegistry(sitregistry.RegistryBackend):
+    def __init__(self, path):
+        r"""
+        registry.RegistryBackend of the FakeRegistry in `path`: a batch is applied
+        under one lock of the file. Values other than REG_SZ are kept as [type, data],
+        with bytes in hex.
+        """
+        self.fake = FakeRegistry(path)
+
+    def _memory(self, keys):
+        return sitregistry.MemoryBackend({k: {name: _decode(*v) if isinstance(v, list) else (sitregistry.REG_SZ, v)
+            for name, v in values.items()} for k, values in keys.items()})
+
+    def read(self, keys):
+        return self._memory(self.fake.load()).read(keys)
+
+    def apply(self, ops):
+        with self.fake._locked() as keys:
+            memory = self._memory(keys)
+            results = memory.apply(ops)
+            keys.clear()
+            for k, values in memory.keys.items():
+                keys[k] = {name: data if type == sitregistry.REG_SZ else [type, data.hex() if isinstance(data, bytes) else data]
+                    for name, (type, data) in values.items()}
+        return results
+
+def _reg(registry, args):
+    """the reg command: reg add|delete|query|export KEY ..."""
+    if len(args) < 2:
+        print("ERROR: Invalid syntax.", file=sys.stderr)
+        return 1
+    op, key = args[0].lower(), args[1]
+    if op == "add":
+        registry.add(key)
+        found = True
+    elif op == "delete":
+        found = registry.delete(key)
+    elif op == "query":
+        found = registry.query(key)
+        for k, values in found.items():
+            print(k)
+            for name, data in values.items():
+                print(f"    {name}    REG_SZ    {data}")
+    elif op == "export" and len(args) > 2:
+        found = registry.export(key, args[2])
+    else:
+        print("ERROR: Invalid syntax.", file=sys.stderr)
+        return 1
+    if not found:
+        print("ERROR: The system was unable to find the specified registry key or value.", file=sys.stderr)
+        return 1
+    print("The operation completed successfully.")
+    return 0
+
+def run_stub(spec, env, argv):
+    r"""Runs a stub tool, see Tool. Called by the generated stub scripts.
+    Args:
+        spec (dict): Tool.as_dict().
+        env (dict): "root", "registry" and "time_scale" of the machine.
+        argv (list): sys.argv of the stub.
+    """
+    here = os.path.dirname(os.path.abspath(argv[0]))
+    args = list(argv) + [""] * 4
+    fields = {"here": here, "cwd": os.getcwd(), "root": env["root"], "args": args}
+    registry = FakeRegistry(env["registry"])
+
+    latency = spec["latency"]
+    if isinstance(latency, str):
+        latency = float(args[int(latency[1:])] or 0)
+    if spec["mode"] != "dump":
+        time.sleep(latency * env["time_scale"])
+
+    if spec["mode"] == "reg":
+        return _reg(registry, argv[1:])
+    if spec["mode"] == "bcdedit":
+        print("Windows Boot Loader\r\n-------------------\r\nidentifier              {current}\r\ntestsigning             Yes")
+        return 0
+    if spec["mode"] == "iasl":
+        dat = argv[-1]
+        write_file(os.path.splitext(dat)[0] + ".dsl", 4 * os.path.getsize(dat) + 4 * KB)
+        print(f"Intel ACPI Component Architecture\r\nDisassembly completed, written to \"{dat}\"")
+        return 0
+    for key in spec["keys"]:
+        registry.add(key, {"Start": "1"})
+    for key in spec["delete"]:
+        registry.delete(key)
+    if spec["stdout"]:
+        print(_content("stdout.log", spec["stdout"], time.time_ns()).decode("ascii"))
+
+    outputs = []
+    for out in spec["outputs"]:
+        path, size = out[0], out[1]
+        cond = out[2] if len(out) > 2 else None
+        if cond is not None and ((cond[0] == "!") == (cond.lstrip("!") in argv[1:])):
+            continue
+        outputs.append((path.format(**fields), size))
+    if spec["mode"] == "poll":
+        # like runtime_acpi.bat: reopens the output for every append, until killed.
+        interval = float(args[2] or 10)
+        while True:
+            for path, size in outputs:
+                with open(path, "ab") as f:
+                    f.write(_content(path + ".log", size, time.time_ns()))
+            time.sleep(interval)
+    if spec["mode"] == "dump":
+        for path, size in outputs:
+            write_dump(path, size, latency * env["time_scale"])
+        return 0
+    for path, size in outputs:
+        write_file(path, size)
+    return 0
+
+class SimulatedMachine(object):
+    def __init__(self, base, scale=1.0, time_scale=1.0, seed=0):
+        r"""
+        Args:
+            base (str): directory of the machine, created by build().
+            scale (float): multiplies the sizes of the files.
+            time_scale (float): multiplies the latencies of the tools.
+            seed (int): seed of the contents of the system drive.
+        """
+        self.base = os.path.abspath(base)
+        self.resource = pjoin(self.base, "resource")
+        self.root = pjoin(self.base, "root")
+        self.bin = pjoin(self.base, "bin")
+        self.registry = pjoin(self.base, "registry.json")
+        self.scale = scale
+        self.time_scale = time_scale
+        self.seed = seed
+        self.user = getpass.getuser()
+
+    def _scaled(self, tool):
+        spec = tool.as_dict()
+        spec["outputs"] = [(o[0], max(1, int(o[1] * self.scale))) + tuple(o[2:]) for o in tool.outputs]
+        spec["stdout"] = int(tool.stdout * self.scale)
+        return spec
+
+    def _write_stub(self, where, tool):
+        path = pjoin(where, *tool.path.split("/"))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if path.endswith(".reg"):
+            # imported by SIT itself, see registry.py.
+            lines = [sitregistry.HEADER, ""]
+            lines += [f"[-{key}]\r\n" for key in tool.delete]
+            lines += [f"[{key}]\r\n\"Start\"=dword:00000001\r\n" for key in tool.keys]
+            with open(path, "w", encoding="utf-16") as f:
+                f.write("\r\n".join(lines))
+            return
+        env = {"root": self.root, "registry": self.registry, "time_scale": self.time_scale}
+        here = os.path.dirname(os.path.abspath(__file__))
+        with open(path, "w", encoding="utf8") as f:
+            f.write(f"#!{sys.executable}\n"
+                "import sys\n"
+                f"sys.path.insert(0, {here!r})\n"
+                "import simenv\n"
+                f"sys.exit(simenv.run_stub({self._scaled(tool)!r}, {env!r}, sys.argv))\n")
+        os.chmod(path, 0o755)
+
+    def build(self):
+        """Creates the resource directory, the system drive, the commands and the registry."""
+        start = time.perf_counter()
+        for tool in TOOLS:
+            self._write_stub(self.resource, tool)
+        for tool in COMMANDS:
+            self._write_stub(self.bin, tool)
+        for tool in ROOT_TOOLS:
+            self._write_stub(self.root, tool)
+        self.populate()
+        # as prepared by the user for the live dump, see Traces.livedumpfile.
+        for name in ["Program Files", "Program Files (x86)", "NTFS_LIVEKD_MEMORY_DMP"]:
+            os.makedirs(pjoin(self.root, name), exist_ok=True)
+        registry = FakeRegistry(self.registry)
+        for name in ["IntcAudioBus", "IntcOED", "IntelAudioService", "jhi_service"]:
+            registry.add(f"{SERVICES}\\{name}", {"Start": "3", "Type": "1"})
+        logging.info(f"Simulated machine built at \"{self.base}\" in {time.perf_counter() - start:.1f}s.")
+
+    def populate(self):
+        """(Re)writes the files of the system drive, e.g. after a run moved some of them away."""
+        rng = random.Random(self.seed)
+        for pattern, size, count in TREE:
+            for i in range(count):
+                path = pjoin(self.root, *pattern.format(i=i, user=self.user).split("/"))
+                if not os.path.isfile(path):
+                    write_file(path, max(1, int(size * self.scale)), seed=rng.getrandbits(32))
+
+    def size(self):
+        """bytes on the system drive."""
+        return sum(os.path.getsize(pjoin(d, f)) for d, _, files in os.walk(self.root) for f in files)
+
+    @contextmanager
+    def activate(self):
+        """Points SIT at the machine: SIT_ROOT, the Windows environment variables, PATH and the registry."""
+        env = {
+            "SIT_ROOT": self.root,
+            "PATH": self.bin + os.pathsep + os.environ.get("PATH", ""),
+            "SystemRoot": pjoin(self.root, "Windows"),
+            "APPDATA": pjoin(self.root, "Users", self.user, "AppData", "Roaming"),
+            "ProgramData": pjoin(self.root, "ProgramData"),
+            "PROGRAMFILES": pjoin(self.root, "Program Files"),
+            "PROGRAMFILES(X86)": pjoin(self.root, "Program Files (x86)"),
+        }
+        saved = {k: os.environ.get(k) for k in env}
+        os.environ.update(env)
+        backend = sitregistry.set_default_backend(SimulatedRegistry(self.registry))
+        try:
+            yield self
+        finally:
+            sitregistry.set_default_backend(backend)
+            for k, v in saved.items():
+                if v is None:
+                    os.environ.pop(k, None)
+                else:
+                    os.environ[k] = v
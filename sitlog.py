@@ -0,0 +1,223 @@
+r"""
+Logging of SIT: sit.log, written by a background thread.
+
+Records are put on a queue by the thread that logs them, and formatted and
+written by one writer thread, so the UI and the collection never wait on the
+disk. The writer feeds:
+- `sit.log`, rotated when it reaches `LogMaxMB`. Older segments are
+  compressed, sit.log.1.gz being the latest, and `LogBackups` are kept.
+- a json-lines log (`LogJson`), if set: one object per record, with the
+  run (output directory) and the ingredient it belongs to.
+- while a run is collecting, `sit.log` in its output directory, with the
+  records of that run only, so the bundle carries its own log.
+- stderr.
+
+Options in the [General] section of settings.ini, read by setup().
+"""
+import os
+import sys
+import gzip
+import json
+import queue
+import atexit
+import shutil
+import logging
+import threading
+import logging.handlers
+
+FORMAT = '%(asctime)s [%(levelname)s] [%(funcName)s] %(message)s'
+NAME = "sit.log" # also the name of the log in the output directory
+
+_run = None # name of the output directory being collected, see begin_session
+
+class _ContextFilter(logging.Filter):
+    """adds the run and the ingredient to a record, on the thread that logs it."""
+    def filter(self, record):
+        record.run = _run
+        if not hasattr(record, "ingredient"):
+            # only set while an ingredient runs on this thread, see telemetry.measure.
+            telemetry = sys.modules.get("telemetry")
+            metrics = telemetry.current() if telemetry is not None else None
+            record.ingredient = metrics.name if metrics is not None else None
+            record.ingredient_id = metrics.id if metrics is not None else None
+        return True
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record), "level": record.levelname, "thread": record.threadName,
+            "func": record.funcName, "run": getattr(record, "run", None),
+            "ingredient": getattr(record, "ingredient", None), "ingredient_id": getattr(record, "ingredient_id", None),
+            "message": record.getMessage(),
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+def _compress(source, dest):
+    """rotator of the log files: the rotated segment is gzipped."""
+    with open(source, "rb") as fsrc, gzip.open(dest, "wb") as fdst:
+        shutil.copyfileobj(fsrc, fdst, 1 << 20)
+    os.remove(source)
+
+def rotating_handler(path, max_bytes, backups, codec="utf8"):
+    r"""A file handler that rotates `path` above `max_bytes` into `backups` gzipped segments.
+    With `max_bytes` of 0 the file is appended to forever, as before.
+    """
+    handler = logging.handlers.RotatingFileHandler(path, mode="a", maxBytes=max_bytes,
+        backupCount=backups, encoding=codec, delay=True)
+    handler.namer = lambda name: name + ".gz"
+    handler.rotator = _compress
+    return handler
+
+class _Flush(object):
+    def __init__(self):
+        self.done = threading.Event()
+
+class LogWriter(object):
+    def __init__(self, handlers):
+        r"""
+        Writes the records put on `queue` to the handlers, on its own thread.
+        Args:
+            handlers (list (logging.Handler)): where the records go, formatted by the writer thread.
+        """
+        self.queue = queue.SimpleQueue()
+        self.handlers = list(handlers)
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="sitlog", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            record = self.queue.get()
+            if record is None:
+                break
+            if isinstance(record, _Flush):
+                with self._lock:
+                    for h in self.handlers:
+                        h.flush()
+                record.done.set()
+                continue
+            with self._lock:
+                handlers = list(self.handlers)
+            for h in handlers:
+                if record.levelno >= h.level and h.filter(record):
+                    h.handle(record)
+
+    def add(self, handler):
+        with self._lock:
+            self.handlers.append(handler)
+
+    def remove(self, handler):
+        """Stops writing to the handler once the records queued so far are written, then closes it."""
+        self.flush()
+        with self._lock:
+            self.handlers.remove(handler)
+        handler.close()
+
+    def flush(self, timeout=10.0):
+        """Waits until the records queued so far are written."""
+        if not self._thread.is_alive():
+            return
+        marker = _Flush()
+        self.queue.put(marker)
+        marker.done.wait(timeout)
+
+    def stop(self):
+        if self._thread.is_alive():
+            self.queue.put(None)
+            self._thread.join(10)
+        with self._lock:
+            for h in self.handlers:
+                h.close()
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        # formatted by the writer, only make the message and the traceback safe to hand over.
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+_writer = None
+_session = None # (handler, output directory)
+
+def setup(codec="utf8", config=None, path=NAME, console=True, level=logging.INFO):
+    r"""Installs the background logging for the process, instead of logging.basicConfig.
+    Options in the [General] section of settings.ini, from `config`:
+    - `LogMaxMB`: rotate sit.log above this size (default 10, 0 to never rotate).
+    - `LogBackups`: number of compressed segments kept (default 5).
+    - `LogJson`: also write json lines to this file, e.g. sit.jsonl (default none).
+    Returns:
+        LogWriter
+    """
+    global _writer
+    general = config['General'] if config is not None else {}
+    getint = lambda key, fallback: int(general.get(key, fallback))
+    max_bytes = getint('LogMaxMB', 10) << 20
+    backups = getint('LogBackups', 5)
+    formatter = logging.Formatter(FORMAT)
+
+    handlers = [rotating_handler(path, max_bytes, backups, codec)]
+    jsonpath = general.get('LogJson', "")
+    if jsonpath:
+        handlers.append(rotating_handler(jsonpath, max_bytes, backups, "utf8"))
+        handlers[-1].setFormatter(JsonFormatter())
+    if console:
+        handlers.append(logging.StreamHandler(sys.stderr))
+    for h in handlers:
+        if h.formatter is None:
+            h.setFormatter(formatter)
+
+    if _writer is not None:
+        _writer.stop()
+    _writer = LogWriter(handlers)
+    root = logging.getLogger()
+    for h in list(root.handlers):
+        root.removeHandler(h)
+    handler = _QueueHandler(_writer.queue)
+    handler.addFilter(_ContextFilter())
+    root.addHandler(handler)
+    root.setLevel(level)
+    atexit.unregister(shutdown)
+    atexit.register(shutdown)
+    return _writer
+
+def shutdown():
+    """Writes the queued records, and closes the logs."""
+    end_session()
+    if _writer is not None:
+        _writer.stop()
+
+def begin_session(logdir, codec="utf8"):
+    r"""Also writes the records of the run collecting into `logdir` to `<logdir>/sit.log`,
+    until end_session(). Only one run is collecting at a time.
+    """
+    global _run, _session
+    end_session()
+    _run = os.path.basename(os.path.normpath(logdir))
+    if _writer is None:
+        return # logging was not set up by setup(), e.g. in bench_traces.py
+    os.makedirs(logdir, exist_ok=True)
+    handler = logging.FileHandler(os.path.join(logdir, NAME), mode="a", encoding=codec)
+    handler.setFormatter(logging.Formatter(FORMAT))
+    run = _run
+    handler.addFilter(lambda record: getattr(record, "run", None) == run)
+    _writer.add(handler)
+    _session = (handler, logdir)
+
+def end_session():
+    """Completes the log of the current run, before its output directory is zipped."""
+    global _run, _session
+    if _session is not None:
+        _writer.remove(_session[0])
+        _session = None
+    _run = None
+
+def flush():
+    if _writer is not None:
+        _writer.flush()
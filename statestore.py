@@ -0,0 +1,155 @@
+r"""
+Settings and boot-trace state, read once per process and written atomically.
+
+- `settings.ini` holds the user settings ([General]). It is only written when
+  it is created, or when the boot traces of an older version are migrated.
+- `sitstate.json` holds one record per active boot trace (ingredient id,
+  output directory, start time). Changes are staged in memory and written by
+  `commit()` in one go: to a temp file that is fsync'd, then renamed over the
+  old file, so a hard reset leaves either the old or the new state.
+"""
+import os
+import io
+import json
+import time
+import logging
+import threading
+import configparser
+
+import uiconfig
+
+class BootTrace(object):
+    """An active boot trace, stopped and collected when the tool is launched after the reboot."""
+    def __init__(self, name, id, location, started=None):
+        self.name = name
+        self.id = int(id)
+        self.location = location
+        self.started = started if started is not None else time.strftime("%Y-%m-%d %H:%M:%S")
+
+    def as_dict(self):
+        return {"name": self.name, "id": self.id, "location": self.location, "started": self.started}
+
+    def __repr__(self):
+        return f"<BootTrace {self.name} (id={self.id}) at \"{self.location}\" since {self.started}>"
+
+def _fsync_dir(path):
+    """makes the rename itself durable. Not possible (nor needed) on Windows."""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+def atomic_write(path, text, encoding="utf8"):
+    """Replaces `path` with `text`, durable once this returns."""
+    path = os.path.abspath(path)
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding=encoding) as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    _fsync_dir(os.path.dirname(path))
+
+class StateStore(object):
+    def __init__(self, settings="settings.ini", state="sitstate.json"):
+        r"""
+        Args:
+            settings (str): the user settings file.
+            state (str): the boot-trace state file.
+        """
+        self.settings_path = settings
+        self.state_path = state
+        self._lock = threading.RLock()
+        self._dirty = False
+        self.settings = self._load_settings()
+        self.boottraces = self._load_state() # name -> BootTrace
+        self._migrate()
+
+    def _load_settings(self):
+        logging.info(f"Loading configuration from {self.settings_path}...")
+        config = configparser.ConfigParser()
+        if os.path.isfile(self.settings_path):
+            config.read(self.settings_path)
+        if not config.has_section('General'):
+            logging.info("Creating new configuration file...")
+            config['General'] = {'ZipOutput': True}
+            self._write_settings(config)
+        return config
+
+    def _write_settings(self, config):
+        buf = io.StringIO()
+        config.write(buf)
+        atomic_write(self.settings_path, buf.getvalue())
+
+    def _load_state(self):
+        try:
+            with open(self.state_path, "r", encoding="utf8") as f:
+                records = json.load(f).get("boottraces", [])
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError):
+            logging.exception(f"Cannot read \"{self.state_path}\", ignoring the boot trace state.")
+            return {}
+        return {r["name"]: BootTrace(**r) for r in records}
+
+    def _migrate(self):
+        """moves the [BootTraces] section written by older versions into the state file."""
+        if not self.settings.has_section('BootTraces'):
+            return
+        legacy = dict(self.settings['BootTraces'])
+        location = legacy.pop("location", None)
+        for key, value in legacy.items():
+            if value != "Active":
+                continue
+            for entry in uiconfig.REGISTRY.values():
+                if entry["name"].lower() == key:
+                    logging.info(f"Migrating boot trace \"{entry['name']}\" from {self.settings_path}.")
+                    self.boottraces[entry["name"]] = BootTrace(entry["name"], entry["id"], location)
+                    self._dirty = True
+        self.commit()
+        self.settings.remove_section('BootTraces')
+        self._write_settings(self.settings)
+
+    def active_boot_traces(self):
+        """The active boot traces, in the order they were started."""
+        with self._lock:
+            return sorted(self.boottraces.values(), key=lambda b: b.started)
+
+    def start_boot_trace(self, name, id, location):
+        """Stages a record for a started boot trace, written by commit()."""
+        with self._lock:
+            self.boottraces[name] = BootTrace(name, id, location)
+            self._dirty = True
+
+    def stop_boot_trace(self, name):
+        """Stages the removal of a stopped boot trace, written by commit()."""
+        with self._lock:
+            if self.boottraces.pop(name, None) is not None:
+                self._dirty = True
+
+    def commit(self):
+        """Writes the staged boot trace changes, if any."""
+        with self._lock:
+            if not self._dirty:
+                return
+            state = {"boottraces": [b.as_dict() for b in self.boottraces.values()]}
+            atomic_write(self.state_path, json.dumps(state, indent=2))
+            self._dirty = False
+        logging.info(f"Saved boot trace state: {list(self.boottraces)}")
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_store():
+    """The StateStore of this process, loaded on first use."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = StateStore()
+        return _store
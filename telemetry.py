@@ -0,0 +1,254 @@
+r"""
+Per-ingredient performance telemetry.
+
+While an ingredient runs (see IngredientScheduler), the commands it starts
+and the files it collects on its thread are added to its IngredientMetrics.
+At the end of a run the metrics are appended to `manifest.json` in the output
+directory, and to a local sqlite history (`sit_history.db`) so runs can be
+compared across platforms and versions of the tool.
+"""
+import os
+from os.path import join as pjoin
+import json
+import time
+import sqlite3
+import logging
+import platform
+import threading
+from contextlib import contextmanager
+
+import uiconfig
+
+class IngredientMetrics(object):
+    def __init__(self, name, id):
+        self.name = name
+        self.id = id
+        self.wall = 0.0
+        self.cpu = 0.0 # CPU time of the child processes, when it could be measured
+        self.processes = 0 # including the children of the commands, on Windows
+        self.commands = []  # (command, exit code, elapsed), in order
+        self.io_read = 0 # bytes read/written by the child processes, on Windows
+        self.io_write = 0
+        self.files = 0 # collected by Traces.collect
+        self.bytes = 0
+        self.collect_errors = 0
+        self.output_files = 0 # in the outputs of the ingredient (uiconfig.OUTPUTS)
+        self.output_bytes = 0
+        self.error = None
+        self._lock = threading.Lock()
+
+    def add_process(self, status):
+        with self._lock:
+            self.commands.append((status.cmd, status.returncode, round(status.elapsed, 3)))
+            self.processes += status.processes or 1
+            self.cpu += status.cpu or 0.0
+            self.io_read += status.io_read or 0
+            self.io_write += status.io_write or 0
+
+    def add_collect(self, stats):
+        with self._lock:
+            self.files += stats.files
+            self.bytes += stats.bytes
+            self.collect_errors += stats.errors
+
+    def measure_outputs(self, logdir, names):
+        """adds up the size of the outputs `names`, relative to logdir."""
+        for name in names:
+            path = pjoin(logdir, name)
+            if os.path.isfile(path):
+                self.output_files += 1
+                self.output_bytes += os.path.getsize(path)
+            for root, dirs, files in os.walk(path):
+                for f in files:
+                    try:
+                        self.output_bytes += os.path.getsize(pjoin(root, f))
+                        self.output_files += 1
+                    except OSError:
+                        pass
+
+    def as_dict(self):
+        return {
+            "name": self.name, "id": self.id, "ok": self.error is None, "error": self.error,
+            "wall": round(self.wall, 3), "cpu": round(self.cpu, 3), "processes": self.processes,
+            "commands": [{"cmd": c, "return": r, "elapsed": e} for c, r, e in self.commands],
+            "io_read": self.io_read, "io_write": self.io_write,
+            "files": self.files, "bytes": self.bytes, "collect_errors": self.collect_errors,
+            "output_files": self.output_files, "output_bytes": self.output_bytes,
+        }
+
+    def __repr__(self):
+        return (f"<{self.name}: {self.wall:.1f}s wall, {self.cpu:.1f}s cpu, {self.processes} process(es), "
+            f"{self.files} file(s) / {self.bytes / (1 << 20):.1f} MB collected>")
+
+_local = threading.local()
+
+@contextmanager
+def measure(name, id):
+    """Collects the metrics of everything done on this thread inside the block."""
+    metrics = IngredientMetrics(name, id)
+    previous = getattr(_local, "metrics", None)
+    _local.metrics = metrics
+    start = time.perf_counter()
+    try:
+        yield metrics
+    finally:
+        metrics.wall = time.perf_counter() - start
+        _local.metrics = previous
+
+def current():
+    """The metrics of the ingredient running on this thread, None outside of an ingredient."""
+    return getattr(_local, "metrics", None)
+
+def record_process(status):
+    metrics = current()
+    if metrics is not None:
+        metrics.add_process(status)
+
+def record_collect(stats):
+    metrics = current()
+    if metrics is not None:
+        metrics.add_collect(stats)
+
+def new_run(kind, customer=None):
+    r"""Describes a run for the manifest and the history.
+    Args:
+        kind (str): "collect", "resume" for a run resumed after a crash (see journal.py),
+            or "boot_stop" for boot traces stopped after a reboot.
+        customer (str): OEM-project, if known.
+    """
+    return {
+        "kind": kind,
+        "customer": customer,
+        "started": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "finished": None,
+        "host": platform.node(),
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpus": os.cpu_count(),
+        "ingredients": [],
+    }
+
+def finish_run(run, results, logdir=None):
+    """Adds the metrics of the IngredientResults to the run, with their output sizes in logdir."""
+    for r in results:
+        metrics = r.metrics
+        if metrics is None:
+            continue
+        if logdir is not None:
+            metrics.measure_outputs(logdir, uiconfig.OUTPUTS.get(r.id, []))
+        run["ingredients"].append(metrics.as_dict())
+    run["finished"] = time.strftime("%Y-%m-%d %H:%M:%S")
+    return run
+
+def write_manifest(logdir, run):
+    """Appends the run to manifest.json in the output directory."""
+    path = pjoin(logdir, "manifest.json")
+    try:
+        with open(path, "r", encoding="utf8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        manifest = {"runs": []}
+    manifest["runs"].append(run)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp, path)
+    logging.info(f"Run manifest written to \"{path}\".")
+
+class History(object):
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS runs (
+        id INTEGER PRIMARY KEY, kind TEXT, customer TEXT, started TEXT, finished TEXT,
+        host TEXT, platform TEXT, processor TEXT, cpus INTEGER, logdir TEXT);
+    CREATE TABLE IF NOT EXISTS ingredients (
+        run INTEGER REFERENCES runs(id), name TEXT, ingredient INTEGER, ok INTEGER, error TEXT,
+        wall REAL, cpu REAL, processes INTEGER, commands INTEGER, failed_commands INTEGER,
+        io_read INTEGER, io_write INTEGER, files INTEGER, bytes INTEGER,
+        output_files INTEGER, output_bytes INTEGER);
+    CREATE INDEX IF NOT EXISTS ingredients_by_id ON ingredients(ingredient);
+    """
+
+    def __init__(self, path="sit_history.db"):
+        r"""
+        Local history of the runs, for comparing ingredient timings across runs.
+        Args:
+            path (str): the sqlite database.
+        """
+        self.path = path
+
+    def record(self, run, logdir=None):
+        con = sqlite3.connect(self.path, timeout=10)
+        try:
+            with con:
+                con.executescript(self.SCHEMA)
+                cur = con.execute("INSERT INTO runs (kind, customer, started, finished, host, platform, processor, cpus, logdir)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", (run["kind"], run["customer"], run["started"], run["finished"],
+                    run["host"], run["platform"], run["processor"], run["cpus"], logdir))
+                con.executemany("INSERT INTO ingredients VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    [(cur.lastrowid, m["name"], m["id"], int(m["ok"]), m["error"], m["wall"], m["cpu"], m["processes"],
+                    len(m["commands"]), sum(1 for c in m["commands"] if c["return"] != 0), m["io_read"], m["io_write"],
+                    m["files"], m["bytes"], m["output_files"], m["output_bytes"]) for m in run["ingredients"]])
+        finally:
+            con.close()
+        logging.info(f"Run recorded in \"{self.path}\".")
+
+    def durations(self, ids, host=None, last=5):
+        r"""The median wall time of the ingredients in their last successful runs.
+        Args:
+            ids (list (int)): ingredient ids.
+            host (str): only the runs of this machine, None for any.
+            last (int): number of runs considered for each ingredient.
+        Returns:
+            dict: ingredient id -> seconds, for the ingredients found.
+        """
+        if not ids or not os.path.isfile(self.path):
+            return {}
+        con = sqlite3.connect(self.path, timeout=10)
+        try:
+            rows = con.execute("SELECT i.ingredient, i.wall FROM ingredients i JOIN runs r ON i.run = r.id"
+                f" WHERE i.ok = 1 AND r.kind IN ('collect', 'resume') AND i.ingredient IN ({', '.join('?' * len(ids))})"
+                + (" AND r.host = ?" if host is not None else "") + " ORDER BY r.id DESC",
+                list(ids) + ([host] if host is not None else [])).fetchall()
+        except sqlite3.Error:
+            return {} # no runs recorded yet
+        finally:
+            con.close()
+        walls = {}
+        for id, wall in rows:
+            if len(walls.setdefault(id, [])) < last:
+                walls[id].append(wall)
+        return {id: sorted(w)[len(w) // 2] for id, w in walls.items()}
+
+def estimate(ids, history=None):
+    """Expected seconds of each ingredient: from the runs on this machine, else on any machine, else uiconfig.COSTS."""
+    found = {}
+    if history is not None:
+        try:
+            found = history.durations(ids, platform.node())
+            missing = [i for i in ids if i not in found]
+            found.update({i: w for i, w in history.durations(missing).items()})
+        except Exception:
+            logging.exception("Exception occurred while reading the run history")
+    return {i: found.get(i, uiconfig.COSTS.get(i, 0)) for i in ids}
+
+def open_history(config):
+    r"""Creates the run history from the [General] section of settings.ini, None if disabled.
+    - `History`: False to disable (default True).
+    - `HistoryDB`: location of the database (default sit_history.db).
+    """
+    general = config['General']
+    if not general.getboolean('History', fallback=True):
+        return None
+    return History(general.get('HistoryDB', fallback="sit_history.db"))
+
+def save_run(logdir, run, history=None):
+    """Writes the manifest, and records the run in the history. Failures are only logged."""
+    try:
+        write_manifest(logdir, run)
+    except Exception:
+        logging.exception("Exception occurred while writing the run manifest")
+    if history is not None:
+        try:
+            history.record(run, logdir)
+        except Exception:
+            logging.exception("Exception occurred while recording the run history")
@@ -0,0 +1,116 @@
+import os
+import random
+import struct
+import zipfile
+import zlib
+
+import pytest
+
+import archiver
+from archiver import ArchiveWriter
+
+def make_tree(root):
+    r"""files of every kind: compressible, already compressed (stored by pattern), empty and a directory."""
+    rng = random.Random(0)
+    files = {
+        "sysinfo/system.txt": b"line of text\r\n" * 20000,
+        "gfx/trace.etl.001": rng.randbytes(3 << 20),
+        "dump/memory.dmp": bytes(1 << 20) + rng.randbytes(1 << 20),
+        "empty.txt": b"",
+    }
+    for name, data in files.items():
+        path = os.path.join(root, *name.split("/"))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+    os.makedirs(os.path.join(root, "nothing"))
+    return files
+
+def joined(volumes, path):
+    r"""the volumes concatenated back into one zip, as 7-Zip reads them."""
+    if volumes == [path]:
+        return path
+    with open(path, "wb") as out:
+        for v in volumes:
+            with open(v, "rb") as f:
+                out.write(f.read())
+    return path
+
+def read_entry(zf, path, info):
+    if info.compress_type != archiver.ZIP_ZSTANDARD:
+        return zf.read(info)
+    # zipfile only reads zstd entries from Python 3.14 on.
+    zstandard = pytest.importorskip("zstandard")
+    with open(path, "rb") as f:
+        f.seek(info.header_offset)
+        name_len, extra_len = struct.unpack("<HH", f.read(30)[26:30])
+        f.seek(name_len + extra_len, 1)
+        data = zstandard.ZstdDecompressor().decompress(f.read(info.compress_size), max_output_size=info.file_size)
+    assert zlib.crc32(data) == info.CRC
+    return data
+
+def archive(tmp_path, method, volume_size=0):
+    root = tmp_path / "out"
+    files = make_tree(str(root))
+    writer = ArchiveWriter(str(tmp_path / "out.zip"), method=method, workers=3, volume_size=volume_size, algorithm="sha256")
+    writer.add_tree(str(root))
+    volumes = writer.close()
+    return files, volumes, joined(volumes, str(tmp_path / "joined.zip"))
+
+@pytest.mark.parametrize("method", ["deflate", "store"])
+def test_round_trip(tmp_path, method):
+    files, volumes, path = archive(tmp_path, method)
+    assert volumes == [str(tmp_path / "out.zip")]
+    with zipfile.ZipFile(path) as zf:
+        assert zf.testzip() is None
+        for name, data in files.items():
+            assert zf.read(name) == data
+        assert "nothing/" in zf.namelist()
+        stored = zf.getinfo("gfx/trace.etl.001")
+        assert stored.compress_type == zipfile.ZIP_STORED
+        if method == "deflate":
+            assert zf.getinfo("sysinfo/system.txt").compress_type == zipfile.ZIP_DEFLATED
+        sums = zf.read("SHA256SUMS").decode("utf8")
+        assert "sysinfo/system.txt" in sums
+
+def test_round_trip_across_volumes(tmp_path):
+    files, volumes, path = archive(tmp_path, "deflate", volume_size=1 << 20)
+    assert len(volumes) > 1
+    assert all(v.startswith(str(tmp_path / "out.zip") + ".") for v in volumes)
+    with zipfile.ZipFile(path) as zf:
+        assert zf.testzip() is None
+        assert {n: zf.read(n) for n in files} == files
+
+def test_round_trip_zstd(tmp_path):
+    pytest.importorskip("zstandard")
+    files, volumes, path = archive(tmp_path, "zstd", volume_size=1 << 20)
+    with zipfile.ZipFile(path) as zf:
+        assert zf.getinfo("sysinfo/system.txt").compress_type == archiver.ZIP_ZSTANDARD
+        for name, data in files.items():
+            assert read_entry(zf, path, zf.getinfo(name)) == data
+
+@pytest.mark.parametrize("change", [4096, -4096])
+def test_stored_entry_of_a_file_changing_while_archived(tmp_path, monkeypatch, change):
+    src = tmp_path / "trace.etl.001"
+    data = random.Random(1).randbytes(1 << 20)
+    src.write_bytes(data)
+    getsize = os.path.getsize
+    def getsize_then_change(path):
+        size = getsize(path)
+        if os.fspath(path) == str(src):
+            # the file changes between its size being recorded and being read.
+            with open(src, "r+b") as f:
+                if change > 0:
+                    f.seek(0, 2)
+                    f.write(bytes(change))
+                else:
+                    f.truncate(size + change)
+        return size
+    writer = ArchiveWriter(str(tmp_path / "out.zip"), workers=1)
+    monkeypatch.setattr(archiver.os.path, "getsize", getsize_then_change)
+    writer._write_stored(str(src), archiver._Entry("trace.etl.001", archiver.ZIP_STORED, 0))
+    monkeypatch.undo()
+    writer.close()
+    with zipfile.ZipFile(str(tmp_path / "out.zip")) as zf:
+        assert zf.testzip() is None
+        assert zf.read("trace.etl.001") == data[:len(data) + min(change, 0)]
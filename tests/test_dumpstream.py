@@ -0,0 +1,120 @@
+import os
+import random
+import threading
+import time
+
+import pytest
+
+import dumpstream
+from dumpstream import DumpStream, restore
+
+MB = 1 << 20
+
+@pytest.fixture(autouse=True)
+def small_segments(monkeypatch):
+    monkeypatch.setattr(dumpstream, "SEGMENT", 256 << 10)
+
+def content(size, seed=0):
+    r"""data with zero runs, as a memory dump."""
+    rng = random.Random(seed)
+    return b"".join(rng.randbytes(MB) if i % 3 else bytes(MB) for i in range(size // MB))
+
+def follow(tmp_path, writer, **kwargs):
+    r"""Streams the dump written by `writer` (called with its path), returns the DumpStream and what was written."""
+    src = str(tmp_path / "memory.dmp")
+    stream = DumpStream(str(tmp_path / "memory.dmp.dmpz"), workers=2, algorithm="sha256", **kwargs)
+    done = threading.Event()
+    t = threading.Thread(target=stream.follow, args=(lambda: src if os.path.exists(src) else None, done, 0.02))
+    t.start()
+    try:
+        written = writer(src)
+    finally:
+        done.set()
+        t.join()
+    return stream, written
+
+def restored(tmp_path, stream):
+    out = str(tmp_path / "restored.dmp")
+    result = restore(stream.path, out)
+    with open(out, "rb") as f:
+        return result, f.read()
+
+def append(src, data, chunk=512 << 10, header=b"PAGEDU64"):
+    r"""appends `data` in chunks, then fills in the header, as the dump writers do."""
+    with open(src, "wb") as f:
+        time.sleep(0.1) # seen at 0 bytes
+        for i in range(0, len(data), chunk):
+            f.write(data[i:i + chunk])
+            f.flush()
+            time.sleep(0.01)
+        f.seek(0)
+        f.write(header)
+    return header + data[len(header):]
+
+def test_complete_dump_round_trips_across_volumes(tmp_path):
+    data = content(6 * MB)
+    def writer(src):
+        with open(src, "wb") as f:
+            f.write(data)
+        return data
+    stream, written = follow(tmp_path, writer, volume_size=MB)
+    assert stream.complete and not stream.presized
+    assert len(stream.volumes) > 1
+    assert set(stream.digests) == {os.path.abspath(p) for p in stream.volumes}
+    result, out = restored(tmp_path, stream)
+    assert result.intact
+    assert result.size == len(data) and result.zero == stream.zero > 0
+    assert out == written
+
+def test_dump_growing_from_zero_bytes(tmp_path):
+    data = content(6 * MB, seed=1)
+    stream, written = follow(tmp_path, lambda src: append(src, data), volume_size=0)
+    assert stream.complete and not stream.presized
+    assert stream.size == len(data)
+    result, out = restored(tmp_path, stream)
+    assert result.intact
+    assert out == written
+
+def test_presized_dump_is_read_once_complete(tmp_path, monkeypatch):
+    monkeypatch.setattr(dumpstream, "APPEND_RATE", MB)
+    data = content(6 * MB, seed=2)
+    def writer(src):
+        with open(src, "wb") as f:
+            f.truncate(len(data))
+            f.flush()
+            time.sleep(0.1)
+            # back to front, what was read before the end would be stale.
+            for i in reversed(range(0, len(data), MB)):
+                f.seek(i)
+                f.write(data[i:i + MB])
+                f.flush()
+                time.sleep(0.01)
+        return data
+    stream, written = follow(tmp_path, writer, volume_size=0)
+    assert stream.complete and stream.presized
+    assert stream.punched == 0
+    result, out = restored(tmp_path, stream)
+    assert result.intact
+    assert out == written
+
+def test_truncated_dump_is_not_complete(tmp_path):
+    data = content(6 * MB, seed=3)
+    def writer(src):
+        with open(src, "wb") as f:
+            f.write(data)
+            f.flush()
+            time.sleep(0.3) # read past the header
+            f.truncate(MB // 2)
+        return data[:MB // 2]
+    stream, written = follow(tmp_path, writer, volume_size=0)
+    assert not stream.complete
+    if stream.punched:
+        assert not restore(str(tmp_path / "memory.dmp.dmpz")).intact
+    else:
+        # nothing was deallocated, the dump is left as it is and the output removed.
+        assert not os.path.exists(str(tmp_path / "memory.dmp.dmpz"))
+
+def test_no_dump_written(tmp_path):
+    stream, written = follow(tmp_path, lambda src: None)
+    assert not stream.complete
+    assert not os.listdir(str(tmp_path))
@@ -0,0 +1,54 @@
+import os
+import stat
+import configparser
+
+import permissions
+from permissions import IcaclsBackend, PermissionFixer, PosixBackend
+
+def mode(path):
+    return stat.S_IMODE(os.stat(path).st_mode)
+
+def test_fixer_prepares_the_root(tmp_path):
+    backend = PosixBackend()
+    PermissionFixer(str(tmp_path / "out"), backend=backend)
+    assert backend.prepared == [str(tmp_path / "out")]
+    assert mode(tmp_path / "out") == 0o777
+
+def test_fix_resets_files_and_trees_once(tmp_path):
+    backend = PosixBackend()
+    fixer = PermissionFixer(str(tmp_path), backend=backend)
+    moved = tmp_path / "moved.txt"
+    moved.write_text("x")
+    tree = tmp_path / "tree"
+    (tree / "sub").mkdir(parents=True)
+    inner = tree / "sub" / "inner.txt"
+    inner.write_text("y")
+    for p in (moved, inner, tree / "sub", tree):
+        os.chmod(p, 0o500 if p.is_dir() else 0o400)
+
+    fixer.add(str(moved))
+    fixer.add(str(inner)) # inside the tree, fixed with it
+    fixer.add(str(tree))
+    fixer.add(str(tree / "sub"))
+    fixer.add(str(tmp_path / "gone.txt"))
+    assert fixer.fix() == 2
+    assert sorted(backend.fixed) == sorted([([str(moved)], []), ([], [str(tree)])])
+    assert mode(moved) == 0o666
+    assert mode(inner) == 0o666
+    assert mode(tree / "sub") == 0o777
+    # nothing left for the next call.
+    assert fixer.fix() == 0
+
+def test_icacls_batches_stay_below_the_command_line_limit():
+    backend = IcaclsBackend()
+    files = [f"C:\\out\\{i:05d}-" + "x" * 100 for i in range(1000)]
+    batches = list(backend.batches(files))
+    assert [p for batch in batches for p in batch] == files
+    assert len(batches) > 1
+    for batch in batches:
+        assert sum(len(p) + 3 for p in batch) <= IcaclsBackend.MAX_CHARS
+
+def test_open_fixer_can_be_disabled(tmp_path):
+    config = configparser.ConfigParser()
+    config.read_dict({"General": {"FixPermissions": "False"}})
+    assert permissions.open_fixer(str(tmp_path), config) is None
@@ -0,0 +1,47 @@
+import sys
+import threading
+import time
+
+from procrunner import ProcessRunner
+
+PY = f"\"{sys.executable}\""
+
+def test_run_keeps_the_return_code_and_the_tail(tmp_path):
+    runner = ProcessRunner(tail=2)
+    status = runner.run(f"{PY} -c \"import sys; print('a'); print('b'); print('c'); sys.exit(3)\"", str(tmp_path))
+    assert status.returncode == 3
+    assert not status.ok
+    assert list(status.stdout) == ["b", "c"]
+    assert status.lines == 3
+
+def test_timeout_kills_the_command(tmp_path):
+    runner = ProcessRunner(poll=0.05)
+    start = time.perf_counter()
+    status = runner.run(f"{PY} -c \"import time; time.sleep(30)\"", str(tmp_path), timeout=0.5)
+    assert status.timed_out
+    assert not status.ok
+    assert time.perf_counter() - start < 10
+
+def test_cancel_kills_the_command_and_the_next_ones(tmp_path):
+    runner = ProcessRunner(poll=0.05)
+    threading.Timer(0.5, runner.cancel).start()
+    status = runner.run(f"{PY} -c \"import time; time.sleep(30)\"", str(tmp_path))
+    assert status.cancelled
+    assert status.elapsed < 10
+    after = runner.run(f"{PY} -c \"print(1)\"", str(tmp_path))
+    assert after.cancelled
+    assert after.returncode is None
+
+def test_output_beyond_max_lines_is_spilled(tmp_path):
+    lines = []
+    runner = ProcessRunner(tail=5, max_lines=3, console=lambda name, line: lines.append((name, line)))
+    runner.spill_dir = str(tmp_path / "spill")
+    status = runner.run(f"{PY} -c \"[print(i) for i in range(10)]\"", str(tmp_path))
+    assert status.ok
+    assert status.lines == 10
+    assert list(status.stdout) == ["5", "6", "7", "8", "9"]
+    assert [line for name, line in lines if name == "stdout"] == [str(i) for i in range(10)]
+    spilled = list((tmp_path / "spill").iterdir())
+    assert [p.name for p in spilled] == [f"{status.pid}.stdout.log"]
+    # the lines not logged, from the first one over max_lines.
+    assert spilled[0].read_text(encoding="utf8").split() == [str(i) for i in range(3, 10)]
@@ -0,0 +1,50 @@
+import registry
+from registry import MemoryBackend, Registry
+
+KEYS = {
+    r"HKLM\SOFTWARE\Intel\SIT": {
+        "Name": (registry.REG_SZ, "Software \"Issue\" Tracer\\"),
+        "Path": (registry.REG_EXPAND_SZ, r"%SystemRoot%\System32"),
+        "Level": (registry.REG_DWORD, 0xffffffff),
+        "Size": (registry.REG_QWORD, 1 << 40),
+        "Names": (registry.REG_MULTI_SZ, ["a", "b c"]),
+        "Blob": (registry.REG_BINARY, bytes(range(40))),
+        "": (registry.REG_SZ, "default"),
+    },
+    r"HKLM\SOFTWARE\Intel\SIT\Traces": {},
+    r"HKLM\SOFTWARE\Intel\SIT\Traces\TBT": {"Enabled": (registry.REG_DWORD, 1)},
+    r"HKLM\SOFTWARE\Intel\SIT\Empty": {},
+}
+
+def test_export_then_import_restores_the_keys(tmp_path):
+    original = Registry(MemoryBackend(KEYS))
+    path = str(tmp_path / "sit.reg")
+    assert original.export([(r"HKLM\SOFTWARE\Intel\SIT", path)]) == [path]
+    with open(path, "rb") as f:
+        assert f.read(2) == b"\xff\xfe" # utf-16, as regedit writes it
+
+    restored = Registry(MemoryBackend())
+    assert restored.import_files([path]) > 0
+    key = registry.normalize(r"HKLM\SOFTWARE\Intel\SIT")
+    assert restored.backend.read([key]) == original.backend.read([key])
+
+def test_import_applies_deletions(tmp_path):
+    path = tmp_path / "delete.reg"
+    path.write_text(f"{registry.HEADER}\r\n\r\n[-HKEY_LOCAL_MACHINE\\SOFTWARE\\Intel\\SIT\\Traces]\r\n\r\n"
+        "[HKEY_LOCAL_MACHINE\\SOFTWARE\\Intel\\SIT]\r\n\"Level\"=-\r\n", encoding="utf-16")
+    reg = Registry(MemoryBackend(KEYS))
+    reg.import_files([str(path)])
+    tree = reg.backend.read([registry.normalize(r"HKLM\SOFTWARE\Intel\SIT")])[registry.normalize(r"HKLM\SOFTWARE\Intel\SIT")]
+    assert not any("Traces" in k for k in tree)
+    assert "Level" not in tree[registry.normalize(r"HKLM\SOFTWARE\Intel\SIT")]
+
+def test_delete_is_case_insensitive_and_reports_missing_keys():
+    reg = Registry(MemoryBackend(KEYS))
+    deleted = reg.delete([r"hklm\software\intel\sit\traces", r"HKLM\SOFTWARE\Missing"])
+    assert deleted == [registry.normalize(r"hklm\software\intel\sit\traces")]
+    assert reg.backend.read([r"HKEY_LOCAL_MACHINE\SOFTWARE\Intel\SIT\Traces"]) == {}
+
+def test_export_skips_missing_keys(tmp_path):
+    reg = Registry(MemoryBackend(KEYS))
+    assert reg.export([(r"HKLM\SOFTWARE\Missing", str(tmp_path / "missing.reg"))]) == []
+    assert not (tmp_path / "missing.reg").exists()
@@ -0,0 +1,62 @@
+import os
+import threading
+
+import pytest
+
+from procrunner import ProcessRunner
+from shellpool import ShellPool, merge
+
+pytestmark = pytest.mark.skipif(os.name == "nt", reason="the steps are /bin/sh command lines")
+
+@pytest.fixture
+def pool():
+    pool = ShellPool(ProcessRunner(poll=0.05))
+    yield pool
+    pool.close()
+
+def test_each_step_gets_its_exit_code_and_output(pool, tmp_path):
+    statuses = pool.run(["echo one", "echo two 1>&2; exit 3", "printf 'no newline'", "true"], str(tmp_path))
+    assert [s.returncode for s in statuses] == [0, 3, 0, 0]
+    assert list(statuses[0].stdout) == ["one"]
+    assert list(statuses[1].stderr) == ["two"]
+    assert list(statuses[2].stdout) == ["no newline"]
+    # "exit" only ended the step, the session ran the next ones.
+    assert len({s.pid for s in statuses}) == 1
+    merged = merge("all", statuses)
+    assert merged.returncode == 0 and merged.lines == 3
+
+def test_stop_on_error_skips_the_remaining_steps(pool, tmp_path):
+    statuses = pool.run(["false", "echo skipped"], str(tmp_path), stop_on_error=True)
+    assert [s.returncode for s in statuses] == [1]
+
+def test_the_session_is_reused_without_the_state_of_earlier_steps(pool, tmp_path):
+    first = pool.run(["cd /; export SIT_STEP=1; false"], str(tmp_path))
+    second = pool.run(["echo $?; pwd; echo x$SIT_STEP"], str(tmp_path))
+    assert pool.started == 1
+    assert first[0].pid == second[0].pid
+    assert list(second[0].stdout) == ["0", str(tmp_path), "x"]
+
+def test_timeout_kills_the_session_and_the_next_step_gets_a_new_one(pool, tmp_path):
+    timed_out = pool.run(["sleep 30", "echo skipped"], str(tmp_path), timeout=0.5)
+    assert len(timed_out) == 1 and timed_out[0].timed_out
+    again = pool.run(["echo again"], str(tmp_path))
+    assert again[0].ok and list(again[0].stdout) == ["again"]
+    assert again[0].pid != timed_out[0].pid
+
+def test_cancel_stops_the_running_step(pool, tmp_path):
+    cancel = threading.Event()
+    threading.Timer(0.5, cancel.set).start()
+    statuses = pool.run(["sleep 30", "echo skipped"], str(tmp_path), cancel=cancel)
+    assert len(statuses) == 1 and statuses[0].cancelled
+
+def test_sessions_of_concurrent_callers_are_not_shared(pool, tmp_path):
+    results = {}
+    def run(i):
+        results[i] = pool.run([f"sleep 0.3; echo {i}"], str(tmp_path))[0]
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(3)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert [list(results[i].stdout) for i in range(3)] == [["0"], ["1"], ["2"]]
+    assert len({r.pid for r in results.values()}) == 3
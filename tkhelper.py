@@ -1,14 +1,56 @@
+import os
+from os.path import join as pjoin
+import glob
 import logging
-
-from PIL import Image, ImageTk
 import tkinter as tk
 from tkinter import ttk
+from lazyimport import lazy_import
+
+# PIL is only needed when an image is not in the image cache yet.
+Image = lazy_import("PIL.Image")
+ImageTk = lazy_import("PIL.ImageTk")
+
+_images = {}
+
+def cached_image(file, size, alpha=True):
+    """
+    Returns a PhotoImage of `file` resized to `size`.
+    Resized images are saved as png in ".imgcache" next to `file`, keyed by
+    size and the mtime of `file`, so later launches load them directly with Tk
+    instead of decoding and resizing the original again.
+    """
+    w, h = size
+    mtime = int(os.path.getmtime(file))
+    base = os.path.splitext(os.path.basename(file))[0]
+    cachedir = pjoin(os.path.dirname(file), ".imgcache")
+    cache = pjoin(cachedir, f"{base}-{w}x{h}-{mtime}.png")
+    if cache in _images:
+        return _images[cache]
+    try:
+        if os.path.isfile(cache):
+            _images[cache] = tk.PhotoImage(file=cache)
+            return _images[cache]
+    except tk.TclError:
+        logging.warning(f"Failed to load cached image \"{cache}\", rendering again.")
+
+    image = Image.open(file).convert("RGBA") if alpha else Image.open(file)
+    image = image.resize((w, h), Image.LANCZOS)
+    try:
+        os.makedirs(cachedir, exist_ok=True)
+        for old in glob.glob(pjoin(cachedir, f"{base}-{w}x{h}-*.png")):
+            os.remove(old)
+        image.save(cache, "PNG")
+    except OSError:
+        logging.warning(f"Cannot write image cache at \"{cachedir}\".")
+    _images[cache] = ImageTk.PhotoImage(image)
+    return _images[cache]
 
 class ImageLabel(ttk.Label):
     """
     A class for handling images on the tool, such as a banner or icons.
+    If `size` is given, the image is loaded at that size from the image cache.
     """
-    def __init__(self, parent, file, alpha=True, background="#ffffff"):
+    def __init__(self, parent, file, alpha=True, background="#ffffff", size=None):
         style_name = "{}.TLabel".format(id(file))
         banner_style = ttk.Style()
         banner_style.configure(style_name, foreground="white", background=background)
@@ -16,21 +58,32 @@ class ImageLabel(ttk.Label):
         # setting padding to -3 removes the excessive border!
 
         self.parent = parent
-
-        self.image = Image.open(file).convert("RGBA") if alpha else Image.open(file)
-        self.image_base = self.image.copy()
-        self.photo = ImageTk.PhotoImage(self.image)
-        self.configure(image=self.photo)
+        self.file = file
+        self.alpha = alpha
+        self.image_base = None
+
+        if size is not None:
+            self.resize(size)
+        else:
+            self.image = Image.open(file).convert("RGBA") if alpha else Image.open(file)
+            self.image_base = self.image.copy()
+            self.photo = ImageTk.PhotoImage(self.image)
+            self.configure(image=self.photo)
         
-    def resize(self, size):
-        new_width, new_height = size
-        self.image = self.image_base.resize((new_width, new_height), Image.ANTIALIAS)
-        self.photo = ImageTk.PhotoImage(self.image)
+    def resize(self, size, cache=True):
+        if cache:
+            self.photo = cached_image(self.file, size, self.alpha)
+        else:
+            if self.image_base is None:
+                self.image_base = Image.open(self.file).convert("RGBA") if self.alpha else Image.open(self.file)
+            new_width, new_height = size
+            self.image = self.image_base.resize((new_width, new_height), Image.LANCZOS)
+            self.photo = ImageTk.PhotoImage(self.image)
         self.config(image=self.photo)
 
     def dynamic_resize(self,event):
         """bind to resize event of window to make it work."""
-        self.resize((event.width-4, event.height-4))
+        self.resize((event.width-4, event.height-4), cache=False)
 
 class CopyrightLabel(ttk.Label):
     """
@@ -184,16 +237,21 @@ class Dialog(tk.Toplevel):
 
 class FilterDialog(Dialog):
 
-    def body(self, master, options, precheck=[], icon=None, rows=4):
+    def body(self, master, options, precheck=[], icon=None, rows=4, message=None):
         if icon:
             self.iconbitmap(icon) 
+        top = 0
+        if message:
+            label = ttk.Label(master, text=message)
+            label.grid(padx=5, pady=5, row=0, column=0, columnspan=max(1, (len(options)-1)//rows+1), sticky="w")
+            top = 1
         self.vars = []        
         for i,t in enumerate(options):
             box = ttk.Checkbutton(master, text=t)
             # box.state(['!alternate', '!selected', '!disabled'])
             box.text = t
             box.state(['!alternate', 'selected' if t in precheck else '!selected', '!disabled'])
-            box.grid(padx=5, pady=5, row=i%rows, column=i//rows, sticky="nswe")
+            box.grid(padx=5, pady=5, row=top+i%rows, column=i//rows, sticky="nswe")
             self.vars.append(box)
 
         #     selection = ttk.Checkbutton(frame, text=t)
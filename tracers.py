@@ -2,24 +2,34 @@ import sys
 import os
 from os.path import join as pjoin
 import subprocess
-import shutil
-import json
-import getpass
-import csv
 import logging
 from collections import defaultdict as ddict
 import itertools
 import glob # for wildcard
-import signal # for SIGTERM
-import winreg # for registry
-import time # for sleep
+import threading
 import re
-
-# for prompts
-from tkinter import ttk, messagebox, simpledialog
+from lazyimport import lazy_import
+shutil = lazy_import("shutil")
+json = lazy_import("json")
+getpass = lazy_import("getpass")
+csv = lazy_import("csv")
+signal = lazy_import("signal") # for SIGTERM
+dumpstream = lazy_import("dumpstream") # for livedumpfile
+
+from prompts import TkPrompts
+from procrunner import ProcessRunner
+from shellpool import ShellPool, merge
+import acpitables
+from ringcapture import RingCapture
+from collector import Collector
+from registry import Registry
+
+AUTOLOGGER = r"HKLM\SYSTEM\CurrentControlSet\Control\WMI\Autologger"
+# autologger key of each MEI trace mode
+MEI_AUTOLOGGERS = {"Tee": "Tee", "SPD": "Spd", "gsc": "Gsc", "_aux": "Aux"}
 
 class Traces(object):
-    def __init__(self, logdir, resrc_path, codec):
+    def __init__(self, logdir, resrc_path, codec, prompts=None, root=None):
         r"""
         In general, a trace consists of the following steps:
         1. Run the specific batch script file
@@ -30,6 +40,13 @@ class Traces(object):
         2. User reproduce issue (which involves rebooting)
         3. User re-open SIT Tool
         4. SIT tool automatically runs stop trace batch for that trace.
+
+        Messages and questions to the user go through `prompts` (Tk dialogs by
+        default, see prompts.py).
+
+        `root` is where the system drive (C:\) is, None for the real one. It
+        defaults to the SIT_ROOT environment variable, set by the simulated
+        environment of bench_traces.py (see simenv.py).
         """
 
 
@@ -50,18 +67,33 @@ class Traces(object):
 
         self.powershell = False
         self.codec = codec
+        self.runner = ProcessRunner(codec=codec)
+        if self.logdir is not None:
+            # long command outputs are kept with the bundle instead of filling sit.log.
+            self.runner.spill_dir = pjoin(self.logdir, "command_output")
+        self.shells = ShellPool(self.runner) # shells kept running for runbg and runsteps
+        self.collector = Collector()
+        self.permissions = None # PermissionFixer of logdir, shared with the collector
+        self.registry = Registry() # deletes, exports and imports keys in process
+        self.eventlogs = None # EventLogTracker, when event logs are collected incrementally
+        self.acpi_cache = None # AcpiCache, reuses the disassembly of unchanged ACPI tables
+        self.ring_options = {} # RingCapture options of acpi2, see ringcapture.ring_options
+        self.dump_options = {} # DumpStream options of livedumpfile, see dumpstream.dump_options
+        self.prompts = prompts if prompts is not None else TkPrompts()
+        self.root = root if root is not None else os.environ.get("SIT_ROOT")
 
         logging.info(f"Log dir at: {self.logdir}")
         logging.info(f"Resource dir at: {self.resrc_path}")
         logging.info(f"Temp dir at: {self._tmp_dir}")
         logging.info(f"Using powershell: {self.powershell}")
-        logging.info(f"Log dir at: {self.logdir}")
         logging.info(f"Using codec: {self.codec}")
+        if self.root is not None:
+            logging.info(f"System drive at: {self.root}")
 
         logging.info(f"Initialized tracer instance successfully.")
 
     def cleanup(self):
-        pass
+        self.shells.close()
         # logging.info(f"Cleaning garbage: {self.garbage}")
         # for e in self.garbage:
         #     # both returns false when not exist
@@ -70,29 +102,54 @@ class Traces(object):
         #     elif os.path.isdir(e):
         #         shutil.rmtree(e)
 
-    def move(self, src, tgt):
+    def move(self, src, tgt, label=""):
+        return self.collect([(src, tgt, True)], label)
+
+    def copy(self, src, tgt, label=""):
+        return self.collect([(src, tgt)], label)
+
+    def collect(self, manifest, label=""):
+        """
+        Copies/moves a manifest of (src, tgt) or (src, tgt, move) entries,
+        with files transferred concurrently. Returns the CollectStats.
+        """
         try:
-            if os.path.isfile(src) or os.path.isdir(src):
-                logging.info(f"Moving: \"{src}\" -> \"{tgt}\"")
-                shutil.move(src, tgt)
-            else:                
-                logging.warning(f"\"{src}\" ignore for not existing.")
+            return self.collector.collect(manifest, label)
         except Exception as e:
             logging.exception("Exception occurred")
 
-    def copy(self, src, tgt):
+    def collect_eventlogs(self, src, tgt, manifest):
+        """
+        Copies the event log directory, or only what changed since the last run
+        when incremental collection is enabled. Otherwise it is added to the manifest.
+        """
+        if self.eventlogs is None:
+            manifest.append((src, tgt))
+            return
         try:
-            if os.path.isdir(src):
-                logging.info(f"Copying: \"{src}\" -> \"{tgt}\"")
-                shutil.copytree(src, tgt)
-            elif os.path.isfile(src):
-                logging.info(f"Copying: \"{src}\" -> \"{tgt}\"")
-                shutil.copy2(src, tgt)
-            else:                
-                logging.warning(f"\"{src}\" ignore for not existing.")
+            self.eventlogs.collect(src, tgt, self.logdir, self.collector)
         except Exception as e:
             logging.exception("Exception occurred")
 
+    def syspath(self, path):
+        r"""
+        Maps an absolute path on the system drive, e.g. C:\Windows\INF, under
+        self.root when it is set. Like on Windows, the case of the names does
+        not matter. Wildcards are kept, for glob.
+        """
+        if self.root is None:
+            return path
+        mapped = self.root
+        for part in re.split(r"[\\/]+", re.sub(r"^[a-zA-Z]:", "", path)):
+            if not part:
+                continue
+            try:
+                part = next((e for e in os.listdir(mapped) if e.lower() == part.lower()), part)
+            except OSError:
+                pass
+            mapped = pjoin(mapped, part)
+        return mapped
+
     def mkdir(self, path):
         logging.info(f"Creating directory at: {path}")
         try:
@@ -102,62 +159,118 @@ class Traces(object):
 
     def chmod(self, folder):
         """
-        Some copied folders will still require administrator right to access, 
+        Some moved folders will still require administrator right to access, 
         so we have to change the permission.
-        """
-        commands = [
-        "@echo off",
-        "set folder={0}".format(folder),
-        "cd /d %folder%",
-        "icacls * /t /grant:r \"everyone:(OI)(CI)F\""
-        ]
 
-        script = " & ".join(commands)
-        
-        self.runbg(script, folder)
+        Everything created in `folder` already inherits the permission set on it
+        when the run started, only the files the collector moved or linked in
+        are fixed, in batches (see permissions.py).
+        """
+        if self.permissions is None:
+            return
+        self.permissions.fix()
 
 
     
-    def runat(self, name, at):
+    def runat(self, name, at, timeout=None):
         """
+        Runs the command(s) in a new console window, and waits for the window to close.
+        Returns a ProcessStatus.
+
         Warning: sometimes when running a single command, this command will fail.
         Sol: you can append useless command in name, like so: cmd="hello.bat & echo done"
         """
         logging.info(f"Running command(s) \"{name}\" at \"{at}\"")
-        if self.powershell:
+        if os.name != "nt":
+            # no console windows outside of Windows, e.g. when testing with stub scripts.
+            fullcmd = self._posix_command(name, at)
+        elif self.powershell:
             fullcmd = """powershell.exe -Command "Start-Process -FilePath cmd.exe -ArgumentList '/c', '{}' -WorkingDirectory '{}' -Verb runAs -Wait"
             """.format(name, at)
         else:
             fullcmd = """start "Software Issue Tracer v1.3.0" /Wait /D "{}" cmd.exe /c "{}" /Wait
             """.format(at, name)
-        subprocess.call(fullcmd.strip(), shell=True)
-        logging.info(f"Command completed.")
-
-    def runbg(self, name, at):
-        logging.info(f"Running background command(s) \"{name}\" at \"{at}\"")       
-        p = subprocess.Popen(name, cwd=at, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        out, err = p.communicate()
-        rc = p.returncode
-        status = {"stdout":out.decode(self.codec), "stderr":err.decode(self.codec), "return":rc}
+        status = self.runner.run(fullcmd.strip(), at, timeout=timeout)
+        logging.info(f"Command completed: {status}")
+        return status
+
+    def runbg(self, name, at, timeout=None):
+        r"""Runs the command(s) without a window. Output is streamed to the log line by line.
+        Commands joined with " & " run one after the other, in a shell of the pool (see runsteps).
+        Returns a dict with "stdout", "stderr" (the last lines only), "return", "timeout", "cancelled" and "elapsed".
+        """
+        logging.info(f"Running background command(s) \"{name}\" at \"{at}\"")
+        status = merge(name, self.runsteps(name.split(" & "), at, timeout=timeout))
         logging.info(f"Command returned with status: {status}")
-        if rc != 0:
+        if not status.ok:
             logging.warning("The previous command returned with nonzero return code, see previous message for error details.")
 
-        return status
-
-    def gui_ask_type(self, title, msg, dtype):
+        return status.as_dict()
+
+    def runsteps(self, steps, at, timeout=None, stop_on_error=False):
+        r"""Runs the steps of a recipe without a window, one after the other, in a shell kept
+        running in `at` (see shellpool.py) instead of a new cmd.exe for each.
+        Args:
+            steps (list (str)): command lines, e.g. "acpidump.exe -b".
+            timeout (float): seconds for all the steps.
+            stop_on_error (bool): skip the remaining steps after one failed.
+        Returns:
+            list (ProcessStatus): one per step run, with its own return code.
+        """
+        steps = [s.strip() for s in steps if s.strip()]
+        if os.name != "nt":
+            steps = [self._posix_command(s, at) for s in steps]
+        if not all(s.isascii() for s in steps):
+            # the shell reads its commands as bytes, so a new process is started as before.
+            return [self.runner.run(" & ".join(steps) if os.name == "nt" else " ; ".join(steps), at, timeout=timeout)]
+        statuses = self.shells.run(steps, at, timeout=timeout, stop_on_error=stop_on_error)
+        for s in statuses:
+            if not s.ok:
+                logging.warning(f"Step \"{s.cmd}\" failed: {s}")
+        return statuses
+
+    def _posix_command(self, name, at):
+        r"""
+        Translates a cmd.exe command line for /bin/sh, to run the stub tools of
+        a simulated environment outside of Windows: "a & b" runs a then b, the
+        "@" and ".\\" prefixes are dropped, and a tool found in `at` is run
+        from there, as cmd.exe would.
+        """
+        at = at or "."
+        commands = []
+        for command in name.split(" & "):
+            command = command.strip().lstrip("@").replace(".\\", "./")
+            if not command:
+                continue
+            exe = command.split(" ", 1)[0]
+            if os.path.isfile(pjoin(at, command)):
+                # e.g. "Set legacy JHI log level to debug.reg"
+                command = f"\"{command}\"" if os.path.isabs(command) else f"\"./{command}\""
+            elif "/" not in exe and os.path.isfile(pjoin(at, exe)):
+                command = "./" + command
+            commands.append(command)
+        return " ; ".join(commands)
+
+    def abort(self):
+        """Kills the running command(s), and skips the remaining ones."""
+        logging.warning("Aborting running commands...")
+        self.runner.cancel()
+
+    def gui_ask_type(self, title, msg, dtype, key=None):
         """So far this is only used in highloadingactivities trace
         where the tool asks user for desired timeout in seconds.
         """
         ret = None
         while ret == None:
-            ret = simpledialog.askstring(title, msg)
+            ret = self.prompts.ask(title, msg, key=key)
             if ret != None:
                 try:
                     ret = dtype(ret)
                 except ValueError:
                     logging.error("Cannot convert \"{}\" to type \"{}\"".format(ret, dtype))
                     ret = None
+                    if not self.prompts.interactive:
+                        break # a scripted answer will not change
             else:
                 # user cancelled
                 break
@@ -180,13 +293,12 @@ class Traces(object):
 
         regsinfo = "\n\n".join(regs)
 
-        checkdel = messagebox.askyesno(title='Warning',
-            message=f"This will reset the following registry keys\n\n{regsinfo}\n\nDo you want to continue?")
+        checkdel = self.prompts.yesno(title='Warning',
+            message=f"This will reset the following registry keys\n\n{regsinfo}\n\nDo you want to continue?",
+            key="reset.confirm")
         if checkdel:
-            for reg in regs:
-                command = f"reg delete {reg} /f"
-                self.runbg(command, ".")
-            messagebox.showinfo(title="Info",
+            self.registry.delete(regs)
+            self.prompts.info(title="Info",
                 message="Registry keys reset successfully.")
         else:
             logging.info("User denied. Done.")
@@ -195,7 +307,7 @@ class Traces(object):
     def sysinfo(self, outname='systeminfo'):
         logging.info("Running System Info Collection...")
 
-        messagebox.showwarning(title='Collecting System Info',
+        self.prompts.warning(title='Collecting System Info',
             message="This may take a while (5-10 minutes), please wait while the tool "
             "collects system information.")
         
@@ -205,25 +317,24 @@ class Traces(object):
         # run msinfo and copy to outdir
         self.runbg(r"msinfo32 /report system-msinfo32.txt", self._tmp_dir)
         f = "system-msinfo32.txt"
-        self.move(pjoin(self._tmp_dir, f), pjoin(outdir, f))
+        manifest = [(pjoin(self._tmp_dir, f), pjoin(outdir, f), True)]
 
         # copy other infos
+        self.collect_eventlogs(self.syspath(r"c:\windows\System32\winevt\Logs"), pjoin(outdir, "Logs"), manifest)
         files = [
-        (r"c:\windows\System32\winevt","Logs"),
         (r"c:\windows\panther","setupact.log"),
         (r"c:\windows\INF","setupapi.setup.log"),
         ]
 
         for srcdir, f in files:
-            src = pjoin(srcdir, f)
-            tgt = pjoin(outdir, f)
-            self.copy(src, tgt)
+            manifest.append((pjoin(self.syspath(srcdir), f), pjoin(outdir, f)))
+        self.collect(manifest, "sysinfo")
 
     def marker(self):
         logging.info("Setting marker event...")
         gfxtemp = pjoin(self._tmp_dir, "GfxEvents")
 
-        messagebox.showwarning(title='Setting marker event...',
+        self.prompts.warning(title='Setting marker event...',
             message=f"Please use Alt+Ctrl+1,2,3..to make the issue event.\n\nExample:\n\"Alt+Crtl+1= issue appear\"\n\"Alt+Crtl+2= issue disappear\".")
         p = subprocess.Popen("EventGenerator.exe", cwd=gfxtemp, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
 
@@ -242,7 +353,7 @@ class Traces(object):
         logging.info("Running High Loading Activities trace...")
         name = pjoin(self._tmp_dir, "_ModernStandbyETW.cmd")
 
-        sec = self.gui_ask_type("Timeout", "Please enter value for timeout (sec):", int)
+        sec = self.gui_ask_type("Timeout", "Please enter value for timeout (sec):", int, key="highloading.timeout")
         if sec == None:
             logging.info("User cancelled operation.")
             return
@@ -266,16 +377,76 @@ class Traces(object):
         
 
     def livedumpfile(self, outname='memory.dmp'):
+        r""" Live kernel dump
+        _LiveDumpFile.cmd writes the dump to the NTFS_LIVEKD_MEMORY_DMP folder
+        of a USB device.
+
+        While it is written, the dump is compressed into livedump\<outname>.dmpz
+        in the output directory, in volumes (see dumpstream.py, options in
+        self.dump_options), and the compressed part is deallocated from the
+        USB device. The dump itself is deleted once it is complete.
+        """
         logging.info("Running Live Dump File...")
-        messagebox.showinfo(title='Instructions',
+        options = dict(stream=True, method="deflate", level=1, volume_size=dumpstream.FAT32_VOLUME,
+            workers=None, algorithm=self.collector.algorithm)
+        options.update(self.dump_options)
+        streaming = options.pop("stream") and self.logdir is not None
+        self.prompts.info(title='Instructions',
             message="Please follow the instructions before preceeding:\n"
-            "1. Insert USB storage device larger than system memory.\n"
-            "2. Create folder \"NTFS_LIVEKD_MEMORY_DMP\" in such USB device.\n"
+            + ("1. Insert NTFS formatted USB storage device. The dump is compressed into the output folder "
+                "while it is written, the device does not need to be larger than system memory.\n"
+                if streaming else "1. Insert USB storage device larger than system memory.\n")
+            + "2. Create folder \"NTFS_LIVEKD_MEMORY_DMP\" in such USB device.\n"
             "3. Ensure internet connection for symbol download.")
 
         name = pjoin(self._tmp_dir, "_LiveDumpFile.cmd")
-        
-        self.runat(name, '.')
+        dirs = self._livedump_dirs() if streaming else []
+        if not dirs:
+            if streaming:
+                logging.warning("Folder NTFS_LIVEKD_MEMORY_DMP not found, the dump is not compressed.")
+            self.runat(name, '.')
+            return
+
+        def dumps():
+            return [p for d in dirs for p in glob.glob(pjoin(glob.escape(d), "*.dmp"))]
+        # a dump left by an earlier run is not the one being written.
+        for old in dumps():
+            try:
+                os.replace(old, old + ".back")
+                logging.info(f"Found existing dump. Moved to {old}.back")
+            except OSError:
+                logging.exception(f"Cannot move \"{old}\" away")
+        outdir = pjoin(self.logdir, "livedump")
+        self.mkdir(outdir)
+        stream = dumpstream.DumpStream(pjoin(outdir, outname + ".dmpz"), **options)
+        def locate():
+            found = dumps()
+            return max(found, key=os.path.getmtime) if found else None
+        done = threading.Event()
+        follower = threading.Thread(target=stream.follow, args=(locate, done), name="livedump", daemon=True)
+        follower.start()
+        try:
+            self.runat(name, '.')
+        finally:
+            done.set()
+            follower.join()
+
+        if stream.complete:
+            # the volumes were hashed while written, for the checksums of the bundle.
+            self.collector.digests.update(stream.digests)
+            try:
+                os.remove(stream.source)
+                logging.info(f"Removed \"{stream.source}\", compressed into {len(stream.volumes)} volume(s).")
+            except OSError:
+                logging.exception(f"Cannot remove \"{stream.source}\"")
+
+    def _livedump_dirs(self):
+        r"""The NTFS_LIVEKD_MEMORY_DMP folders at the root of the drives."""
+        if self.root is not None:
+            candidates = [self.syspath(r"C:\NTFS_LIVEKD_MEMORY_DMP")]
+        else:
+            candidates = [f"{d}:\\NTFS_LIVEKD_MEMORY_DMP" for d in "CDEFGHIJKLMNOPQRSTUVWXYZ"]
+        return [d for d in candidates if os.path.isdir(d)]
 
     def tbt_boot(self, stop=False, outname='TBT_SINGLE_BOOT_LOG'):
         logging.info(f"Running TBT trace(boot)...")
@@ -300,20 +471,15 @@ class Traces(object):
         tbttemp = pjoin(self._tmp_dir, "ThunderboltTrace")
 
         """Now execute required files"""
-        commands = [
-        "@mkdir \"TBT_LOG_\"",
-        "StartTrace.bat TBT_LOG_",
-        "@echo #########################################################################",
-        "@echo # Log is currently being collected and will stop once you press any key",
-        "@echo #########################################################################",
-        "pause",
-        "StopTrace.bat",
-        "@echo Log is complete."
-        ]
-
-        script = " & ".join(commands)
-        
-        self.runat(script, tbttemp)
+        os.makedirs(pjoin(tbttemp, "TBT_LOG_"), exist_ok=True)
+        started = self.runsteps(["StartTrace.bat TBT_LOG_"], tbttemp)[-1]
+        if started.ok:
+            self.prompts.wait(title="trace running...",
+                message="Log is currently being collected. Press \"OK\" to stop the trace.", key="tbt.duration")
+        else:
+            logging.error("The TBT trace did not start, stopping it.")
+        self.runsteps(["StopTrace.bat"], tbttemp)
+        logging.info("Log is complete.")
 
         for entry in os.listdir(tbttemp):
             if "TBT_LOG_" in entry:
@@ -333,8 +499,8 @@ class Traces(object):
 
         logging.info(f"Starting display trace.")
 
-        messagebox.showwarning(title="trace running...", 
-            message="Trace is running. Press \"OK\" to stop the trace.")
+        self.prompts.wait(title="trace running...", 
+            message="Trace is running. Press \"OK\" to stop the trace.", key="display.duration")
 
         logging.info('Stoping display trace.')
 
@@ -367,7 +533,7 @@ class Traces(object):
 
     def video_performance(self, outname='video_performance.etl'):
         logging.info("Running video performance trace...")
-        gpuviewdir = r"C:\Program Files (x86)\Windows Kits\10\Windows Performance Toolkit\gpuview"
+        gpuviewdir = self.syspath(r"C:\Program Files (x86)\Windows Kits\10\Windows Performance Toolkit\gpuview")
         if not os.path.isdir(gpuviewdir):
             logging.error(f"Cannot find directory \"{gpuviewdir}\".")
             msg = "The tool failed to locate gpuview at \"" + gpuviewdir + "\". Please install Windows ADK properly before running the tool."
@@ -375,19 +541,15 @@ class Traces(object):
 
         """Now execute required files"""
 
-        commands = [
-        "log.cmd",
-        "@echo #########################################################################",
-        "@echo # Log is currently being collected and will stop once you press any key",
-        "@echo #########################################################################",
-        "pause",
-        "log.cmd",
-        "@echo Log is complete.",
-        ]
-
-        script = " & ".join(commands)
-
-        self.runat(script, gpuviewdir)
+        # log.cmd starts the trace, and stops it when run again.
+        started = self.runsteps(["log.cmd"], gpuviewdir)[-1]
+        if started.ok:
+            self.prompts.wait(title="trace running...",
+                message="Log is currently being collected. Press \"OK\" to stop the trace.", key="video.duration")
+        else:
+            logging.error("The video performance trace did not start, stopping it.")
+        self.runsteps(["log.cmd"], gpuviewdir)
+        logging.info("Log is complete.")
 
         src = pjoin(gpuviewdir, "Merged.etl")
         tgt = pjoin(self.logdir, outname)
@@ -401,12 +563,12 @@ class Traces(object):
             status = self.runbg("Trace.bat --RealTime", exedir)
             msg = status['stderr'] # status['stdout'] + "\n" + 
             if msg:
-                messagebox.showwarning(title="info", message=msg)
+                self.prompts.warning(title="info", message=msg)
         else:
             status = self.runbg("Trace.bat --RealTime", exedir)
             msg = status['stderr'] # status['stdout'] + "\n" + 
             if msg:
-                messagebox.showwarning(title="info", message=msg)
+                self.prompts.warning(title="info", message=msg)
             logging.info("Copying log file...")
             src = pjoin(exedir, "GfxRealTimeTrace.etl")
             tgt = pjoin(self.logdir, outname)            
@@ -419,19 +581,16 @@ class Traces(object):
         
 
         commands = [
-        "@echo off",
         # "cd %~dp0", sincer there is no file
         r".\Rstcli64.exe --disableVersionCheck --version >> .\rst.log",
         r".\Rstcli64.exe --disableVersionCheck -I >> .\rst.log",
         r".\Rstcli64.exe --disableVersionCheck --OptaneMemory --info >> .\rst.log",
         r".\Rstcli64.exe --disableVersionCheck --accelerate --stats >> .\rst.log",
-        "echo Command completed successfully.",
         ]
 
-        script = " & ".join(commands)
-
         """Now execute required files"""
-        self.runat(script, rsttemp)
+        statuses = self.runsteps(commands, rsttemp)
+        logging.info(f"{sum(s.ok for s in statuses)} of {len(commands)} Rstcli64 command(s) succeeded.")
 
 
         src = pjoin(rsttemp, "rst.log")
@@ -442,17 +601,19 @@ class Traces(object):
         logging.info("Running Optane log collection...")
         user = getpass.getuser()
         srcs =[
-        pjoin("C:\\", "Windows", "system32", "WINEVT", "LOGS"),
-        pjoin("C:\\", "Users", user, "AppData", "Local", "Packages", "AppUp.IntelOptaneMemoryandStorageManagem"),
-        pjoin("C:\\", "Users", user, "Intel", "logs"),
+        self.syspath(pjoin("C:\\", "Windows", "system32", "WINEVT", "LOGS")),
+        self.syspath(pjoin("C:\\", "Users", user, "AppData", "Local", "Packages", "AppUp.IntelOptaneMemoryandStorageManagem")),
+        self.syspath(pjoin("C:\\", "Users", user, "Intel", "logs")),
         ]
         tgts = [
         pjoin(self.logdir, "winevt", "logs"),
         pjoin(self.logdir, "AppUp.IntelOptaneMemoryandStorageManagem"),
         pjoin(self.logdir, "intel", "logs"),
         ]
-        for src,tgt in zip(srcs, tgts):
-            self.copy(src, tgt)
+        manifest = []
+        self.collect_eventlogs(srcs[0], tgts[0], manifest)
+        manifest.extend(zip(srcs[1:], tgts[1:]))
+        self.collect(manifest, "optane")
 
     def acpi(self, outname="acpidump\\"):
         logging.info("Running ACPI code dump...")
@@ -460,26 +621,14 @@ class Traces(object):
         exedir = pjoin(self._tmp_dir, "iasl-win")
 
         """Now execute required files"""
-        commands = [
-        "acpidump.exe -b",
-        "iasl.exe -d *.dat",
-        "@echo collection is complete.",
-        ]
-
-        script = " & ".join(commands)
-        
-        self.runat(script, exedir)
+        if not self.runsteps(["acpidump.exe -b"], exedir)[-1].ok:
+            logging.error("acpidump failed, collecting the tables it dumped, if any.")
         tgt = pjoin(self.logdir, outname)
         self.mkdir(tgt)
 
-        """get all .dat and .dsl files"""
-        files = itertools.chain(
-            glob.glob(pjoin(exedir, "*.dat")),
-            glob.glob(pjoin(exedir, "*.dsl"))
-            )
-
-        for src in files:
-            self.move(src, tgt)
+        """move the tables, then disassemble them next to it, one iasl per table"""
+        self.collect([(src, tgt, True) for src in glob.glob(pjoin(exedir, "*.dat"))], "acpi")
+        acpitables.disassemble(tgt, pjoin(exedir, "iasl.exe"), self.runbg, cache=self.acpi_cache)
             
     def re_search(self, pattern, text, params, catch=True):
         try:
@@ -521,13 +670,13 @@ class Traces(object):
                     return False
             else:
                 # success. prompt restart
-                messagebox.showwarning(title="Setup Success", 
+                self.prompts.warning(title="Setup Success", 
                     message="Please restart now and open SIT tool again after restart.")
                 return True
 
         # handle secure boot error.
         logging.error("A required value \"testsigning\" is protected by Secure Boot. Please disable Secure Boot and try again.")
-        messagebox.showerror(title="Error", 
+        self.prompts.error(title="Error", 
             message="Please disable Secure Boot and try again.")
         return False
                 
@@ -541,6 +690,10 @@ class Traces(object):
         We also need control for user to interrupt the execution loop,
         hence we create a subprocess to run runtime_acpi.bat, and then 
         on the main process we await user input by messagebox.showwarning
+
+        While running, <out> is moved into a bounded ring of snapshots (see
+        ringcapture.py, options in self.ring_options), so only the latest
+        output is kept however long the trace runs.
         """
         if not self._check_testsigning():
             return
@@ -548,11 +701,11 @@ class Traces(object):
         exedir = pjoin(self._tmp_dir, "livekd")
         
         #### check for symbol availability
-        sym_path = r"c:\\symbols\\ntkrnlmp.pdb\\"
+        sym_path = self.syspath(r"c:\\symbols\\ntkrnlmp.pdb\\")
         if os.path.isdir(sym_path):
             logging.info("Symbols are available, but may not be loaded.")
         else:
-            messagebox.showwarning(title="Symbol Not Found", 
+            self.prompts.warning(title="Symbol Not Found", 
                 message="Please ensure internet connection for symbol download.")
             logging.warning("Symbols are not found. Attempt to download by running livekd64...")
             self.runat("livekd64 -b -c q", exedir)
@@ -566,33 +719,30 @@ class Traces(object):
             self.move(src, tgt)
             # os.remove(src)
 
-        script = [
-        pjoin(exedir, "runtime_acpi.bat"),
-        outname,
-        "10" # polling seconds
-        ]
-        sub = subprocess.Popen(script)
+        options = dict(interval=10, max_bytes=64 << 20, max_age=0)
+        options.update(self.ring_options)
+        script = "\"{}\" {} {}".format(pjoin(exedir, "runtime_acpi.bat"), outname, options["interval"]) # polling seconds
+        sub, status, readers = self.runner.start(script, exedir)
         logging.info(f"Subprocess created. PID={sub.pid}")
 
-        messagebox.showwarning(title="trace running...", 
-            message="Trace is running. Press \"OK\" to stop the trace.")
+        ring = RingCapture(pjoin(exedir, outname), pjoin(self.logdir, outname + ".ring"),
+            max_bytes=options["max_bytes"], max_age=options["max_age"], poll=options["interval"])
+        stop = threading.Event()
+        capture = threading.Thread(target=ring.run, args=(stop,), name="acpi2-ring", daemon=True)
+        capture.start()
+
+        self.prompts.wait(title="trace running...", 
+            message="Trace is running. Press \"OK\" to stop the trace.", key="acpi2.duration")
 
         logging.info('Terminating subprocess ...')
-        # subprocess.call("@taskkill /PID {} /F >nul 2>&1".format(sub.pid), shell=True)
-        sub.terminate()        
-        sub.communicate()
+        stop.set()
+        capture.join()
+        self.runner.kill(sub)
+        sub.wait()
         logging.info('Successfully terminated subprocess.')
 
-        src = pjoin(exedir, outname)
-        tgt = pjoin(self.logdir, outname)
-        self.move(src, tgt)
-        for i in range(5):
-            try:
-                self.move(src, tgt)
-                break
-            except :
-                logging.warning("Failed to move directory, the subprocess might still be alive, retrying in 1 sec...")
-                time.sleep(5)
+        # hand over the last output as soon as the subprocess released it.
+        ring.finish(pjoin(self.logdir, outname))
         
    
     def isst(self, stop=False, outname="isst"):
@@ -602,39 +752,33 @@ class Traces(object):
 
         if not stop:
             # self.runat("ISST_Autologger_enabled.reg", exedir)
-            self.runbg("ISST_Autologger_enabled.reg", exedir)
+            self.registry.import_files([pjoin(exedir, "ISST_Autologger_enabled.reg")])
         else:
             logging.info("Disabling auto logging...")
-            commands = [
-            "wpp_stop.bat",
-            "Disable_ISST__auto_logger.reg"
-            ]
-            self.runbg(" & ".join(commands), exedir)
+            self.runbg("wpp_stop.bat", exedir)
+            self.registry.import_files([pjoin(exedir, "Disable_ISST__auto_logger.reg")])
             
             logging.info("Copying log files...")
             tgtdir = pjoin(self.logdir, outname)
             self.mkdir(tgtdir)
 
-            self.move(r"C:\ISST.etl", tgtdir)
-
+            manifest = [(self.syspath(r"C:\ISST.etl"), tgtdir, True)]
 
             files = itertools.chain(
-                glob.glob(r"C:\Windows\System32\cAVS\ExtLibs\*.bin"),
-                glob.glob(r"C:\Windows\System32\cAVS\*.bin"),
-                glob.glob(r"C:\Windows\ServiceState\IntcOED\Data\*.*"),
-                glob.glob(r"C:\windows\ServiceState\IntelAudioService\Data\*.*"),
-                glob.glob(r"C:\windows\system32\cavs\IAS\*.*"),
+                glob.glob(self.syspath(r"C:\Windows\System32\cAVS\ExtLibs\*.bin")),
+                glob.glob(self.syspath(r"C:\Windows\System32\cAVS\*.bin")),
+                glob.glob(self.syspath(r"C:\Windows\ServiceState\IntcOED\Data\*.*")),
+                glob.glob(self.syspath(r"C:\windows\ServiceState\IntelAudioService\Data\*.*")),
+                glob.glob(self.syspath(r"C:\windows\system32\cavs\IAS\*.*")),
                 )
 
-            for src in files:
-                self.copy(src, tgtdir)
+            manifest.extend((src, tgtdir) for src in files)
+            self.collect(manifest, "isst")
 
             logging.info("Collecting registry values...")
 
-            for key in ["IntcAudioBus", "IntcOED", "IntelAudioService"]:
-                tgt = pjoin(tgtdir, f"{key}.reg")
-                command = f"reg export HKEY_LOCAL_MACHINE\\SYSTEM\\CurrentControlSet\\Services\\{key} {tgt} & "
-                self.runbg(command, ".")
+            self.registry.export([(f"HKEY_LOCAL_MACHINE\\SYSTEM\\CurrentControlSet\\Services\\{key}", pjoin(tgtdir, f"{key}.reg"))
+                for key in ["IntcAudioBus", "IntcOED", "IntelAudioService"]])
 
     def i2c(self, acpi=False, stop=False, outname="i2ctrace.etl"):
         logging.info(f"Running I2C trace (stop={stop}, acpi={acpi})...")
@@ -665,7 +809,7 @@ class Traces(object):
         
         if not stop:
             ctl = pjoin(wimantemp, "WiMan.ctl")
-            self.copy(ctl, "C:\\")
+            self.copy(ctl, self.syspath("C:\\"))
 
             self.runbg("powershell.exe Set-ExecutionPolicy RemoteSigned -Force", ".")
             self.runbg(r"powershell.exe .\wizard.ps1 -trace", wimantemp)
@@ -681,26 +825,23 @@ class Traces(object):
         logging.info("Collecting installer driver logs...")        
         user = getpass.getuser()
 
-        files = itertools.chain(glob.glob(r"C:\Windows\INF\setupapi.*.log"))
+        files = itertools.chain(glob.glob(self.syspath(r"C:\Windows\INF\setupapi.*.log")))
         
         srcs = [
-            pjoin("C:\\", "Users", user, "Intel", "Logs", "IntelME.log"),
-            pjoin("C:\\", "Users", user, "Intel", "Logs", "IntelME_MSI.log"),
-            pjoin("C:\\", "Users", user, "Intel", "Logs", "DifXFrontend.log"),
+            self.syspath(pjoin("C:\\", "Users", user, "Intel", "Logs", "IntelME.log")),
+            self.syspath(pjoin("C:\\", "Users", user, "Intel", "Logs", "IntelME_MSI.log")),
+            self.syspath(pjoin("C:\\", "Users", user, "Intel", "Logs", "DifXFrontend.log")),
         ]
         
         tgtdir = pjoin(self.logdir, outname)
         self.mkdir(tgtdir)
 
-        for src in files:
-            self.copy(src, tgtdir)
-        for src in srcs:
-            self.copy(src, tgtdir)
+        self.collect([(src, tgtdir) for src in itertools.chain(files, srcs)], "installer")
        
     def lms(self, outname="Gms.log"):
         logging.info("Collecting LMS driver log...")
 
-        src = pjoin("C:\\", "Windows", "SysWOW64", "Gms.log")
+        src = self.syspath(pjoin("C:\\", "Windows", "SysWOW64", "Gms.log"))
         tgt = pjoin(self.logdir, outname)
 
         self.copy(src, tgt)
@@ -720,8 +861,7 @@ class Traces(object):
 
         tgtdir = pjoin(self.logdir, outname)
 
-        for src in srcs:
-            self.copy(src, tgtdir)
+        self.collect([(src, tgtdir) for src in srcs], "icls")
 
 
     def dal(self, stop=False, outname="jhi_log.txt"):
@@ -733,11 +873,10 @@ class Traces(object):
         """Now execute required files"""
         if not stop:
             run = ["Set universal JHI log level to debug.reg", "Set legacy JHI log level to debug.reg"]
-            for reg in run:
-                self.runbg(reg, daltemp)
+            self.registry.import_files([pjoin(daltemp, reg) for reg in run])
         else: 
             logging.info('Success. Copying files...')
-            src = pjoin("C:\\", "jhi_log.txt")
+            src = self.syspath(pjoin("C:\\", "jhi_log.txt"))
             tgt = pjoin(self.logdir, outname)        
             self.move(src, tgt)
     
@@ -746,14 +885,8 @@ class Traces(object):
 
         if not stop:
             """ Delete registry if exist to avoid setting mix up """
-            if mode == "Tee":
-                self.runbg(r"reg delete HKLM\SYSTEM\CurrentControlSet\Control\WMI\Autologger\Tee /f", ".")
-            elif mode == "SPD":
-                self.runbg(r"reg delete HKLM\SYSTEM\CurrentControlSet\Control\WMI\Autologger\Spd /f", ".")
-            elif mode == "gsc":
-                self.runbg(r"reg delete HKLM\SYSTEM\CurrentControlSet\Control\WMI\Autologger\Gsc /f", ".")
-            elif mode == "_aux":
-                self.runbg(r"reg delete HKLM\SYSTEM\CurrentControlSet\Control\WMI\Autologger\Aux /f", ".")
+            if mode in MEI_AUTOLOGGERS:
+                self.registry.delete([f"{AUTOLOGGER}\\{MEI_AUTOLOGGERS[mode]}"])
 
             """"""
             meitemp = pjoin(self._tmp_dir, "CSME", "MEI", f'{mode}')
@@ -763,7 +896,7 @@ class Traces(object):
             """Now execute required files"""
             reg = f"trace_enable_{mode}.reg"
 
-            self.runbg(reg, meitemp)
+            self.registry.import_files([pjoin(meitemp, reg)])
         else:
             if 'PROGRAMFILES(X86)' in os.environ:
                 if mode == "Tee":
@@ -784,25 +917,18 @@ class Traces(object):
                 elif mode == "_aux":
                     self.runbg("tracelog.exe -stop aux", os.getenv('PROGRAMFILES'))
 
-            files = itertools.chain(glob.glob(r"C:\Windows\System32\LogFiles\WMI\*.etl.*"))
+            files = itertools.chain(glob.glob(self.syspath(r"C:\Windows\System32\LogFiles\WMI\*.etl.*")))
             
             tgtdir = pjoin(self.logdir, outname)
             self.mkdir(tgtdir)
-            for src in files:
-                self.move(src, tgtdir)
+            self.collect([(src, tgtdir, True) for src in files], "csme_yellowbang")
 
     def csme_bsod(self, mode="Tee", outname=""):
         logging.info(f"Running MEI driver BSOD/System Hang {mode} boot trace...")
 
         """ Delete registry if exist to avoid setting mix up """
-        if mode == "Tee":
-            self.runbg(r"reg delete HKLM\SYSTEM\CurrentControlSet\Control\WMI\Autologger\Tee /f", ".")
-        elif mode == "SPD":
-            self.runbg(r"reg delete HKLM\SYSTEM\CurrentControlSet\Control\WMI\Autologger\Spd /f", ".")
-        elif mode == "gsc":
-            self.runbg(r"reg delete HKLM\SYSTEM\CurrentControlSet\Control\WMI\Autologger\Gsc /f", ".")
-        elif mode == "_aux":
-            self.runbg(r"reg delete HKLM\SYSTEM\CurrentControlSet\Control\WMI\Autologger\Aux /f", ".")
+        if mode in MEI_AUTOLOGGERS:
+            self.registry.delete([f"{AUTOLOGGER}\\{MEI_AUTOLOGGERS[mode]}"])
         
         """"""
         meitemp = pjoin(self._tmp_dir, "CSME", "MEI", f'{mode}')
@@ -812,9 +938,9 @@ class Traces(object):
         """Now execute required files"""
         reg = f"trace_enable_{mode}_In_dmp.reg"
 
-        self.runbg(reg, meitemp)
+        self.registry.import_files([pjoin(meitemp, reg)])
         
-        messagebox.showwarning(title="trace running...", 
+        self.prompts.warning(title="trace running...", 
             message="You have enabled trace that requires a restart. Restart system and then reproduce your issue(s) if required. After BSOD is reproduced, the log will be stored in complete memory dump file.")
 
     def storage(self, outname="storage_trace"):
@@ -829,6 +955,5 @@ class Traces(object):
         self.mkdir(tgtdir)
 
         files = itertools.chain(glob.glob(fr"{rsttemp}/output/*/*"))
-        for src in files:
-            self.move(src, tgtdir)
+        self.collect([(src, tgtdir, True) for src in files], "storage")
         
\ No newline at end of file
@@ -9,6 +9,12 @@ r"""
 - `type`: One of `trace`,`log`,`config`
 - `reboot`: If this trace involves a reboot (i.e. the tool would be closed, and should be re-launched to collect data).
 - `tip`: The description to show on the display when the cursor hovers above this ingredient trace.
+- `start`: `[method, kwargs]` calls on `Traces` that run the ingredient, in order.
+- `stop`: `[method, kwargs]` calls that stop a boot trace and collect its outputs, after the reboot.
+- `locks`: Resources (mostly directories under ./resource) the ingredient works in. Ingredients sharing a resource are never run at the same time.
+- `outputs`: Outputs of the ingredient relative to the output directory, archived as soon as it returns.
+- `interactive`: If the ingredient prompts the user. These run one by one on the UI thread.
+- `cost`: Estimated run time (sec), the longest ingredients are started first.
 """
 
 ISSUETYPES = {
@@ -75,210 +81,437 @@ INGREDIENTS = {
     "id": -99,
     "type": "",
     "reboot": False,
-    "tip": ""
+    "tip": "",
+    "start": [],
+    "stop": [],
+    "locks": [],
+    "outputs": [],
+    "interactive": False,
+    "cost": 0
   },
   "USB": {
     "id": 1,
     "type": "trace",
     "reboot": False,
-    "tip": ""
+    "tip": "",
+    "start": [["usb", {}]],
+    "stop": [],
+    "locks": [],
+    "outputs": ["usbtrace.etl"],
+    "interactive": False,
+    "cost": 30
   },
   "High Loading Activities": {
     "id": 2,
     "type": "trace",
     "reboot": False,
-    "tip": ""
+    "tip": "",
+    "start": [["highloadingactivities", {}]],
+    "stop": [],
+    "locks": ["idle.etl"],
+    "outputs": ["system_performance.etl"],
+    "interactive": True,
+    "cost": 60
   },
   "Idle ETL": {
     "id": 3,
     "type": "trace",
     "reboot": False,
-    "tip": ""
+    "tip": "",
+    "start": [["idle", {}]],
+    "stop": [],
+    "locks": ["idle.etl"],
+    "outputs": ["idle.etl"],
+    "interactive": False,
+    "cost": 60
   },
   "ACPI Code dump": {
     "id": 4,
     "type": "config",
     "reboot": False,
-    "tip": ""
+    "tip": "",
+    "start": [["acpi", {}]],
+    "stop": [],
+    "locks": ["iasl-win"],
+    "outputs": ["acpidump"],
+    "interactive": False,
+    "cost": 20
   },
   "Unexpected Reset": {
     "id": 5,
     "type": "log",
     "reboot": False,
-    "tip": ""
+    "tip": "",
+    "start": [],
+    "stop": [],
+    "locks": [],
+    "outputs": [],
+    "interactive": False,
+    "cost": 0
   },
   "Display": {
     "id": 6,
     "type": "trace",
     "reboot": False,
-    "tip": "ETL trace tool"
+    "tip": "ETL trace tool",
+    "start": [["marker", {}], ["display", {}]],
+    "stop": [],
+    "locks": ["GfxEvents"],
+    "outputs": ["Display.etl"],
+    "interactive": True,
+    "cost": 60
   },
   "SLP_S0 Status": {
     "id": 7,
     "type": "log",
     "reboot": False,
-    "tip": ""
+    "tip": "",
+    "start": [],
+    "stop": [],
+    "locks": [],
+    "outputs": [],
+    "interactive": False,
+    "cost": 0
   },
   "TBT (S0/S3/S4)": {
     "id": 8,
     "type": "trace",
     "reboot": False,
-    "tip": ""
+    "tip": "",
+    "start": [["tbt", {}]],
+    "stop": [],
+    "locks": ["ThunderboltTrace"],
+    "outputs": ["TBT_LOG"],
+    "interactive": True,
+    "cost": 30
   },
   "Runtime ACPI Code": {
     "id": 9,
     "type": "trace",
     "reboot": False,
-    "tip": ""
+    "tip": "",
+    "start": [["acpi2", {}]],
+    "stop": [],
+    "locks": ["livekd"],
+    "outputs": ["runtime_acpi.log"],
+    "interactive": True,
+    "cost": 60
   },
   "Live Dump File": {
     "id": 10,
     "type": "trace",
     "reboot": False,
-    "tip": ""
+    "tip": "",
+    "start": [["livedumpfile", {}]],
+    "stop": [],
+    "locks": [],
+    "outputs": ["livedump"],
+    "interactive": True,
+    "cost": 300
   },
   "RST Logs": {
     "id": 12,
     "type": "log",
     "reboot": False,
-    "tip": ""
+    "tip": "",
+    "start": [["rst", {}]],
+    "stop": [],
+    "locks": ["RST"],
+    "outputs": ["rst.log"],
+    "interactive": False,
+    "cost": 20
   },
   "Video/performance": {
     "id": 13,
     "type": "trace",
     "reboot": False,
-    "tip": "GPUView tool"
+    "tip": "GPUView tool",
+    "start": [["video_performance", {}]],
+    "stop": [],
+    "locks": ["gpuview"],
+    "outputs": ["video_performance.etl"],
+    "interactive": True,
+    "cost": 60
   },
   "Realtime BSOD": {
     "id": 14,
     "type": "trace",
     "reboot": True,
-    "tip": ""
+    "tip": "",
+    "start": [["realtimebsod", {}]],
+    "stop": [["realtimebsod", {"stop": True}]],
+    "locks": ["GfxEvents"],
+    "outputs": [],
+    "interactive": True,
+    "cost": 10
   },
   "TBT (boot)": {
     "id": 15,
     "type": "trace",
     "reboot": True,
-    "tip": ""
+    "tip": "",
+    "start": [["tbt_boot", {}]],
+    "stop": [["tbt_boot", {"stop": True}]],
+    "locks": ["ThunderboltTrace"],
+    "outputs": [],
+    "interactive": False,
+    "cost": 10
   },
   "Optane Logs": {
     "id": 16,
     "type": "log",
     "reboot": False,
-    "tip": ""
+    "tip": "",
+    "start": [["optane", {}]],
+    "stop": [],
+    "locks": [],
+    "outputs": ["winevt", "AppUp.IntelOptaneMemoryandStorageManagem", "intel"],
+    "interactive": False,
+    "cost": 30
   },
   "ISST": {
     "id": 17,
     "type": "trace",
     "reboot": True,
-    "tip": ""
+    "tip": "",
+    "start": [["isst", {}]],
+    "stop": [["isst", {"stop": True}]],
+    "locks": ["ISST_Autologger"],
+    "outputs": [],
+    "interactive": False,
+    "cost": 10
   },
   "I2C": {
     "id": 18,
     "type": "trace",
     "reboot": True,
-    "tip": ""
+    "tip": "",
+    "start": [["i2c", {"acpi": False}]],
+    "stop": [["i2c", {"acpi": False, "stop": True}]],
+    "locks": ["I2C_log"],
+    "outputs": [],
+    "interactive": False,
+    "cost": 10
   },
   "System Information": {
     "id": 19,
     "type": "config",
     "reboot": False,
-    "tip": "Collect system information and event log."
+    "tip": "Collect system information and event log.",
+    "start": [["sysinfo", {}]],
+    "stop": [],
+    "locks": [],
+    "outputs": ["systeminfo"],
+    "interactive": True,
+    "cost": 420
   },
   "I2C ACPI": {
     "id": 20,
     "type": "trace",
     "reboot": True,
-    "tip": ""
+    "tip": "",
+    "start": [["i2c", {"acpi": True}]],
+    "stop": [["i2c", {"acpi": True, "stop": True}]],
+    "locks": ["I2C_log"],
+    "outputs": [],
+    "interactive": False,
+    "cost": 10
   },
   "Boot Trace": {
     "id": 21,
     "type": "trace",
-    "reboot": True, 
-    "tip": ""
+    "reboot": True,
+    "tip": "",
+    "start": [["graphic_boot", {}]],
+    "stop": [["graphic_boot", {"stop": True}]],
+    "locks": ["GfxEvents"],
+    "outputs": [],
+    "interactive": False,
+    "cost": 10
   },
   "Wiman Driver Log": {
-    "id": 22, 
-    "type": "trace", 
-    "reboot": True, 
-    "tip": ""
+    "id": 22,
+    "type": "trace",
+    "reboot": True,
+    "tip": "",
+    "start": [["wiman", {}]],
+    "stop": [["wiman", {"stop": True}]],
+    "locks": ["CSME\\WiMan_log"],
+    "outputs": [],
+    "interactive": False,
+    "cost": 10
   },
   "Installer Log": {
-    "id": 23, 
-    "type": "log", 
+    "id": 23,
+    "type": "log",
     "reboot": False,
-    "tip": ""
+    "tip": "",
+    "start": [["installer", {}]],
+    "stop": [],
+    "locks": [],
+    "outputs": ["installer log"],
+    "interactive": False,
+    "cost": 10
   },
   "LMS Driver Log": {
-    "id": 24, 
+    "id": 24,
     "type": "log",
     "reboot": False,
-    "tip": ""
-  }, 
+    "tip": "",
+    "start": [["lms", {}]],
+    "stop": [],
+    "locks": [],
+    "outputs": ["Gms.log"],
+    "interactive": False,
+    "cost": 5
+  },
   "iCLS Driver Log": {
-    "id": 25, 
+    "id": 25,
     "type": "log",
     "reboot": False,
-    "tip": ""
+    "tip": "",
+    "start": [["icls", {}]],
+    "stop": [],
+    "locks": [],
+    "outputs": ["iCLS"],
+    "interactive": False,
+    "cost": 10
   },
   "DAL Driver Log": {
-    "id": 26, 
+    "id": 26,
     "type": "trace",
     "reboot": True,
-    "tip": ""
+    "tip": "",
+    "start": [["dal", {}]],
+    "stop": [["dal", {"stop": True}]],
+    "locks": ["CSME\\DAL"],
+    "outputs": [],
+    "interactive": False,
+    "cost": 10
   },
   "MEI Driver Yellow Bang": {
-    "id": 27, 
+    "id": 27,
     "type": "trace",
     "reboot": True,
-    "tip": ""
+    "tip": "",
+    "start": [["csme_yellowbang", {"mode": "Tee"}]],
+    "stop": [["csme_yellowbang", {"mode": "Tee", "stop": True}]],
+    "locks": ["CSME\\MEI"],
+    "outputs": [],
+    "interactive": False,
+    "cost": 10
   },
   "SPD Driver Yellow Bang": {
-    "id": 28, 
+    "id": 28,
     "type": "trace",
     "reboot": True,
-    "tip": ""
-  },
-   "GSC Driver Yellow Bang": {
-    "id": 29, 
+    "tip": "",
+    "start": [["csme_yellowbang", {"mode": "SPD"}]],
+    "stop": [["csme_yellowbang", {"mode": "SPD", "stop": True}]],
+    "locks": ["CSME\\MEI"],
+    "outputs": [],
+    "interactive": False,
+    "cost": 10
+  },
+  "GSC Driver Yellow Bang": {
+    "id": 29,
     "type": "trace",
     "reboot": True,
-    "tip": ""
+    "tip": "",
+    "start": [["csme_yellowbang", {"mode": "gsc"}]],
+    "stop": [["csme_yellowbang", {"mode": "gsc", "stop": True}]],
+    "locks": ["CSME\\MEI"],
+    "outputs": [],
+    "interactive": False,
+    "cost": 10
   },
   "AUX Driver Yellow Bang": {
-    "id": 30, 
+    "id": 30,
     "type": "trace",
     "reboot": True,
-    "tip": ""
+    "tip": "",
+    "start": [["csme_yellowbang", {"mode": "_aux"}]],
+    "stop": [["csme_yellowbang", {"mode": "_aux", "stop": True}]],
+    "locks": ["CSME\\MEI"],
+    "outputs": [],
+    "interactive": False,
+    "cost": 10
   },
   "MEI Driver BSOD/System Hang": {
-    "id": 31, 
+    "id": 31,
     "type": "trace",
     "reboot": False,
-    "tip": ""
+    "tip": "",
+    "start": [["csme_bsod", {"mode": "Tee"}]],
+    "stop": [],
+    "locks": ["CSME\\MEI"],
+    "outputs": [],
+    "interactive": True,
+    "cost": 10
   },
   "SPD Driver BSOD/System Hang": {
-    "id": 32, 
+    "id": 32,
     "type": "trace",
     "reboot": False,
-    "tip": ""
+    "tip": "",
+    "start": [["csme_bsod", {"mode": "SPD"}]],
+    "stop": [],
+    "locks": ["CSME\\MEI"],
+    "outputs": [],
+    "interactive": True,
+    "cost": 10
   },
   "GSC Driver BSOD/System Hang": {
-    "id": 33, 
+    "id": 33,
     "type": "trace",
     "reboot": False,
-    "tip": ""
+    "tip": "",
+    "start": [["csme_bsod", {"mode": "gsc"}]],
+    "stop": [],
+    "locks": ["CSME\\MEI"],
+    "outputs": [],
+    "interactive": True,
+    "cost": 10
   },
   "AUX Driver BSOD/System Hang": {
-    "id": 34, 
+    "id": 34,
     "type": "trace",
     "reboot": False,
-    "tip": ""
+    "tip": "",
+    "start": [["csme_bsod", {"mode": "_aux"}]],
+    "stop": [],
+    "locks": ["CSME\\MEI"],
+    "outputs": [],
+    "interactive": True,
+    "cost": 10
   },
   "Intel Storage Trace": {
-    "id": 35, 
+    "id": 35,
     "type": "trace",
     "reboot": False,
-    "tip": ""
+    "tip": "",
+    "start": [["storage", {}]],
+    "stop": [],
+    "locks": ["RST"],
+    "outputs": ["storage_trace"],
+    "interactive": False,
+    "cost": 60
   }
-}
\ No newline at end of file
+}
+
+# The ingredients by id, each with its "name" (the key in INGREDIENTS).
+REGISTRY = {d["id"]: dict(d, name=t) for t, d in INGREDIENTS.items()}
+
+# Resources (mostly directories under ./resource) that an ingredient works in.
+# Ingredients sharing a resource are never run at the same time.
+LOCKS = {i: d["locks"] for i, d in REGISTRY.items() if d["locks"]}
+
+# Outputs of each ingredient, relative to the output directory. These are
+# handed to the archive as soon as the ingredient returns.
+OUTPUTS = {i: d["outputs"] for i, d in REGISTRY.items() if d["outputs"]}
+
+# Ingredients that prompt the user with dialogs, run one by one on the UI thread.
+INTERACTIVE = [i for i, d in REGISTRY.items() if d["interactive"]]
+
+# Estimated run time (sec), the longest ingredients are started first.
+COSTS = {i: d["cost"] for i, d in REGISTRY.items()}